@@ -0,0 +1,84 @@
+"""Run the benchmark suite
+
+Usage:
+
+    python -m benchmarks --output results.json [--baseline baseline.json]
+
+The suite needs the same privileges as the test suite. The exit code is 1 if
+any p50 or p99 latency regressed by more than the tolerance.
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import storage_device_managers as sdm
+
+from .cases import CASES, Workspace
+from .harness import Result, compare, load_results, save_results
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(item) for item in value.split(",")]
+
+
+def _parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("--output", type=Path, required=True)
+    parser.add_argument("--baseline", type=Path)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--repetitions", type=int, default=20)
+    parser.add_argument(
+        "--mount-counts", type=_int_list, default=[10, 100, 1000, 10000]
+    )
+    parser.add_argument("--tree-files", type=int, default=10000)
+    parser.add_argument("--parallel-devices", type=_int_list, default=[1, 4, 8])
+    parser.add_argument(
+        "--only", nargs="+", choices=sorted(CASES), default=sorted(CASES)
+    )
+    return parser.parse_args(argv)
+
+
+def _run_cases(args: argparse.Namespace) -> list[Result]:
+    results = []
+    with TemporaryDirectory() as directory, TemporaryDirectory() as cache:
+        ws = Workspace(
+            directory=Path(directory),
+            image_cache=Path(cache),
+            pass_cmd=sdm.generate_passcmd(),
+            repetitions=args.repetitions,
+            mount_counts=args.mount_counts,
+            tree_files=args.tree_files,
+            parallel_devices=args.parallel_devices,
+        )
+        for name in args.only:
+            for result in CASES[name](ws):
+                print(
+                    f"{result.name:40} p50={result.p50 * 1000:9.2f}ms "
+                    f"p99={result.p99 * 1000:9.2f}ms"
+                )
+                results.append(result)
+    return results
+
+
+def main(argv: list[str]) -> int:
+    args = _parse_args(argv)
+    results = _run_cases(args)
+    save_results(args.output, results)
+    if args.baseline is None:
+        return 0
+    regressions = compare(results, load_results(args.baseline), args.tolerance)
+    for reg in regressions:
+        print(
+            f"REGRESSION {reg.name} {reg.statistic}: "
+            f"{reg.baseline * 1000:.2f}ms -> {reg.current * 1000:.2f}ms "
+            f"(x{reg.ratio:.2f})"
+        )
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import contextlib
+import dataclasses
+import os
+import typing as t
+from collections.abc import Callable, Iterator, Sequence
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+import shell_interface as sh
+
+import storage_device_managers as sdm
+from storage_device_managers.testing import FakeBackend
+
+from .harness import Result, measure
+
+MIN_SIZE = 128 * 1024**2  # ~109MiB is the minimum size for BtrFS
+SYNC_PAYLOAD = 16 * 1024**2
+
+
+@dataclasses.dataclass(frozen=True)
+class Workspace:
+    """Shared state of a benchmark run
+
+    Attributes:
+    -----------
+    directory
+        scratch directory for images, trees and mount points
+    image_cache
+        template cache passed to `provision_image`
+    pass_cmd
+        password command for encrypted images
+    repetitions
+        number of timed repetitions per case
+    mount_counts
+        numbers of mounts for which `get_mounted_devices` is measured
+    tree_files
+        number of files in the tree passed to `chown`
+    parallel_devices
+        numbers of devices attached at once by `decrypted_devices`
+    """
+
+    directory: Path
+    image_cache: Path
+    pass_cmd: str
+    repetitions: int
+    mount_counts: Sequence[int]
+    tree_files: int
+    parallel_devices: Sequence[int]
+
+
+Case = Callable[[Workspace], Iterator[Result]]
+
+
+@contextlib.contextmanager
+def loop_image(
+    ws: Workspace, filesystem: sdm.ValidFileSystems, *, encrypted: bool = False
+) -> Iterator[Path]:
+    with NamedTemporaryFile(dir=ws.directory) as ntf:
+        image = sdm.provision_image(
+            Path(ntf.name),
+            MIN_SIZE,
+            filesystem,
+            pass_cmd=ws.pass_cmd if encrypted else None,
+            cache_dir=ws.image_cache,
+        )
+        with sdm.loop_device(image) as device:
+            yield device
+
+
+def bench_decrypted_device(ws: Workspace) -> Iterator[Result]:
+    with loop_image(ws, "btrfs", encrypted=True) as device:
+
+        def run() -> None:
+            with sdm.decrypted_device(device, ws.pass_cmd):
+                pass
+
+        yield measure("decrypted_device", run, ws.repetitions)
+
+
+def bench_mounted_device(ws: Workspace) -> Iterator[Result]:
+    for filesystem in t.get_args(sdm.ValidFileSystems):
+        with loop_image(ws, filesystem) as device:
+
+            def run(device: Path = device) -> None:
+                with sdm.mounted_device(device):
+                    pass
+
+            yield measure(f"mounted_device[{filesystem}]", run, ws.repetitions)
+
+
+def bench_sync_device(ws: Workspace) -> Iterator[Result]:
+    payload = os.urandom(SYNC_PAYLOAD)
+    with loop_image(ws, "btrfs") as device, sdm.mounted_device(device) as mount_dir:
+        target = mount_dir / "payload"
+        sdm.chown(mount_dir, sh.get_user(), recursive=False)
+        yield measure(
+            "sync_device",
+            lambda: sdm.sync_device(device),
+            ws.repetitions,
+            setup=lambda: target.write_bytes(payload),
+            bytes_per_sample=SYNC_PAYLOAD,
+        )
+
+
+def bench_unmount_device(ws: Workspace) -> Iterator[Result]:
+    with loop_image(ws, "btrfs") as device, sdm.temporary_directory() as mount_dir:
+        yield measure(
+            "unmount_device",
+            lambda: sdm.unmount_device(device),
+            ws.repetitions,
+            setup=lambda: sdm.mount_btrfs_device(device, mount_dir),
+        )
+
+
+def bench_get_mounted_devices(ws: Workspace) -> Iterator[Result]:
+    source = ws.directory / "bind-source"
+    source.mkdir()
+    with contextlib.ExitStack() as stack:
+        n_mounts = 0
+        for count in sorted(ws.mount_counts):
+            for idx in range(n_mounts, count):
+                stack.enter_context(_bind_mount(source, ws.directory / f"bind-{idx}"))
+            n_mounts = max(n_mounts, count)
+            yield measure(
+                f"get_mounted_devices[mounts={count}]",
+                sdm.get_mounted_devices,
+                ws.repetitions,
+            )
+
+
+@contextlib.contextmanager
+def _bind_mount(source: Path, mount_dir: Path) -> Iterator[Path]:
+    mount_dir.mkdir()
+    mount_cmd: sh.StrPathList = ["sudo", "mount", "-o", "bind", source, mount_dir]
+    sh.run_cmd(cmd=mount_cmd)
+    try:
+        yield mount_dir
+    finally:
+        umount_cmd: sh.StrPathList = ["sudo", "umount", mount_dir]
+        sh.run_cmd(cmd=umount_cmd)
+        mount_dir.rmdir()
+
+
+def bench_get_filesystem(ws: Workspace) -> Iterator[Result]:
+    with loop_image(ws, "ext4") as device:
+        yield measure(
+            "get_filesystem", lambda: sdm.get_filesystem(device), ws.repetitions
+        )
+
+
+def bench_chown(ws: Workspace) -> Iterator[Result]:
+    tree = ws.directory / "tree"
+    files_per_dir = 100
+    for idx in range(ws.tree_files):
+        folder = tree / f"{idx // files_per_dir}"
+        folder.mkdir(parents=True, exist_ok=True)
+        (folder / f"{idx}").touch()
+    user = sh.get_user()
+    yield measure(
+        f"chown[files={ws.tree_files}]",
+        lambda: sdm.chown(tree, user, recursive=True),
+        ws.repetitions,
+    )
+
+
+def bench_decrypted_devices(ws: Workspace) -> Iterator[Result]:
+    for count in ws.parallel_devices:
+        with contextlib.ExitStack() as stack:
+            devices = [
+                stack.enter_context(loop_image(ws, "btrfs", encrypted=True))
+                for _ in range(count)
+            ]
+
+            def run(devices: list[Path] = devices) -> None:
+                with sdm.decrypted_devices(devices, ws.pass_cmd):
+                    pass
+
+            yield measure(f"decrypted_devices[devices={count}]", run, ws.repetitions)
+
+
+def bench_orchestration(ws: Workspace) -> Iterator[Result]:
+    """Overhead of this library alone, measured with the in-memory backend"""
+    backend = FakeBackend()
+    device = Path("/dev/fake")
+    backend.add_encrypted_device(device, ws.pass_cmd, "btrfs")
+
+    def run() -> None:
+        with sdm.decrypted_device(device, ws.pass_cmd) as decrypted:
+            with sdm.mounted_device(decrypted):
+                pass
+
+    with sdm.command_backend(backend):
+        yield measure("orchestration[fake]", run, ws.repetitions)
+
+
+CASES: dict[str, Case] = {
+    "decrypted_device": bench_decrypted_device,
+    "mounted_device": bench_mounted_device,
+    "sync_device": bench_sync_device,
+    "unmount_device": bench_unmount_device,
+    "get_mounted_devices": bench_get_mounted_devices,
+    "get_filesystem": bench_get_filesystem,
+    "chown": bench_chown,
+    "decrypted_devices": bench_decrypted_devices,
+    "orchestration": bench_orchestration,
+}
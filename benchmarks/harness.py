@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import dataclasses
+import json
+import math
+import os
+import platform
+import time
+import typing as t
+from collections.abc import Callable, Iterable, Sequence
+from datetime import UTC, datetime
+from importlib import metadata
+from pathlib import Path
+
+FORMAT_VERSION = 1
+
+
+@dataclasses.dataclass(frozen=True)
+class Result:
+    """Latency distribution of one benchmark case
+
+    Attributes:
+    -----------
+    name
+        name of the case, including its parameters, e.g. `"mounts[n=100]"`
+    samples
+        duration of each repetition in seconds
+    bytes_per_sample
+        bytes processed per repetition, if the case measures throughput
+    """
+
+    name: str
+    samples: tuple[float, ...]
+    bytes_per_sample: int | None = None
+
+    @property
+    def p50(self) -> float:
+        return percentile(self.samples, 50)
+
+    @property
+    def p99(self) -> float:
+        return percentile(self.samples, 99)
+
+    @property
+    def throughput(self) -> float | None:
+        """Bytes per second at the median latency"""
+        if self.bytes_per_sample is None or self.p50 == 0:
+            return None
+        return self.bytes_per_sample / self.p50
+
+    def to_json(self) -> dict[str, t.Any]:
+        return {
+            "name": self.name,
+            "repetitions": len(self.samples),
+            "p50": self.p50,
+            "p99": self.p99,
+            "throughput": self.throughput,
+            "samples": list(self.samples),
+            "bytes_per_sample": self.bytes_per_sample,
+        }
+
+    @classmethod
+    def from_json(cls, data: t.Mapping[str, t.Any]) -> Result:
+        return cls(
+            name=data["name"],
+            samples=tuple(data["samples"]),
+            bytes_per_sample=data.get("bytes_per_sample"),
+        )
+
+
+@dataclasses.dataclass(frozen=True)
+class Regression:
+    """A statistic that got worse than allowed compared to the baseline"""
+
+    name: str
+    statistic: str
+    baseline: float
+    current: float
+
+    @property
+    def ratio(self) -> float:
+        """Factor by which the statistic got worse; infinite for a zero baseline"""
+        if self.baseline == 0:
+            return math.inf
+        return self.current / self.baseline
+
+
+def percentile(samples: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of `samples`"""
+    if not samples:
+        raise ValueError("Percentile of empty sample requested!")
+    ordered = sorted(samples)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def measure(
+    name: str,
+    run: Callable[[], object],
+    repetitions: int,
+    *,
+    setup: Callable[[], object] | None = None,
+    bytes_per_sample: int | None = None,
+) -> Result:
+    """Time `run` repeatedly, after one untimed warm-up run
+
+    If given, `setup` is called before each run without being timed.
+    """
+    samples = []
+    for idx in range(repetitions + 1):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        run()
+        if idx > 0:
+            samples.append(time.perf_counter() - start)
+    return Result(name, tuple(samples), bytes_per_sample)
+
+
+def compare(
+    results: Iterable[Result], baseline: Iterable[Result], tolerance: float
+) -> list[Regression]:
+    """Find results whose p50 or p99 exceed the baseline by more than `tolerance`
+
+    Cases missing in either set are ignored, so that cases can be added and
+    removed without invalidating the baseline.
+    """
+    reference = {res.name: res for res in baseline}
+    regressions = []
+    for result in results:
+        if result.name not in reference:
+            continue
+        base = reference[result.name]
+        for statistic in ("p50", "p99"):
+            current = getattr(result, statistic)
+            previous = getattr(base, statistic)
+            if current > previous * (1 + tolerance):
+                regressions.append(
+                    Regression(result.name, statistic, previous, current)
+                )
+    return regressions
+
+
+def environment() -> dict[str, str]:
+    return {
+        "timestamp": datetime.now(UTC).isoformat(),
+        "python": platform.python_version(),
+        "kernel": os.uname().release,
+        "machine": platform.machine(),
+        "version": metadata.version("storage-device-managers"),
+    }
+
+
+def save_results(path: Path, results: Iterable[Result]) -> None:
+    document = {
+        "format": FORMAT_VERSION,
+        "environment": environment(),
+        "results": [res.to_json() for res in results],
+    }
+    path.write_text(json.dumps(document, indent=2) + "\n")
+
+
+def load_results(path: Path) -> list[Result]:
+    document = json.loads(path.read_text())
+    if document.get("format") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported benchmark result format in {path}!")
+    return [Result.from_json(res) for res in document["results"]]
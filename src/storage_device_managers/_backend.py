@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import contextlib
+import functools
+import subprocess
+import threading
+import typing as t
+from collections.abc import Callable, Iterator
+
+from ._instrumentation import _instrumentation_hooks, _instrumented
+from ._limits import _in_scope, _io_priority, _needs_scope, _scope_properties
+from ._operation import _current_operation, _record_command
+
+# shell_interface imports loguru and importlib.metadata, which takes longer than
+# importing this package. It is only imported once a command runs.
+if t.TYPE_CHECKING:
+    import shell_interface as sh
+
+    _Limiter = Callable[[sh.StrPathList], sh.StrPathList]
+
+
+class CommandBackend(t.Protocol):
+    """Executor of the commands issued by this package
+
+    The default backend is `ShellBackend`, which runs commands using
+    `shell_interface`. Alternative backends can be activated via
+    `command_backend`. Backends must be thread-safe and signal failures the way
+    `shell_interface` does, i.e. by raising `ShellInterfaceError` or
+    `PassCmdError` from a `subprocess.CalledProcessError`.
+    """
+
+    def run_cmd(
+        self, cmd: sh.StrPathList, capture_output: bool
+    ) -> subprocess.CompletedProcess[bytes]: ...
+
+    def pipe_pass_cmd_to_real_cmd(
+        self, pass_cmd: str, command: sh.StrPathList
+    ) -> subprocess.CompletedProcess[bytes]: ...
+
+
+class ShellBackend:
+    """Backend executing commands in subprocesses via `shell_interface`"""
+
+    def run_cmd(
+        self, cmd: sh.StrPathList, capture_output: bool
+    ) -> subprocess.CompletedProcess[bytes]:
+        import shell_interface as sh  # noqa: PLC0415
+
+        if capture_output:
+            return sh.run_cmd(cmd=cmd, capture_output=True)
+        return sh.run_cmd(cmd=cmd)
+
+    def pipe_pass_cmd_to_real_cmd(
+        self, pass_cmd: str, command: sh.StrPathList
+    ) -> subprocess.CompletedProcess[bytes]:
+        import shell_interface as sh  # noqa: PLC0415
+
+        return sh.pipe_pass_cmd_to_real_cmd(pass_cmd=pass_cmd, command=command)
+
+
+_backends: list[CommandBackend] = [ShellBackend()]
+_backends_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def command_backend(backend: CommandBackend) -> Iterator[CommandBackend]:
+    """Execute all commands of this package with `backend`
+
+    The backend is active process-wide, i.e. in all threads, until the context
+    manager is left. Nested usage is supported; the innermost backend wins.
+
+    This does not affect `btrfs_send_receive`, which streams data between
+    processes and therefore always spawns real subprocesses.
+
+    Parameters:
+    -----------
+    backend
+        backend to use, e.g. `storage_device_managers.testing.FakeBackend`
+
+    Returns:
+    --------
+    CommandBackend
+        the given backend
+    """
+    with _backends_lock:
+        _backends.append(backend)
+    try:
+        yield backend
+    finally:
+        with _backends_lock:
+            # Remove the last occurrence, so that nested usage of one backend
+            # is unwound correctly.
+            idx = len(_backends) - 1 - _backends[::-1].index(backend)
+            del _backends[idx]
+
+
+def _run_cmd(
+    cmd: sh.StrPathList, capture_output: bool = False
+) -> subprocess.CompletedProcess[bytes]:
+    _record_command(cmd)
+    backend = _backends[-1]
+    with _resource_limits() as limited:
+        if not _instrumentation_hooks:
+            return backend.run_cmd(limited(cmd), capture_output)
+        with _instrumented(cmd):
+            return backend.run_cmd(limited(cmd), capture_output)
+
+
+def _pipe_pass_cmd_to_real_cmd(
+    pass_cmd: str, command: sh.StrPathList
+) -> subprocess.CompletedProcess[bytes]:
+    _record_command(command)
+    with _resource_limits() as limited, _instrumented(command):
+        return _backends[-1].pipe_pass_cmd_to_real_cmd(pass_cmd, limited(command))
+
+
+@contextlib.contextmanager
+def _resource_limits() -> Iterator[_Limiter]:
+    """Apply the resource limits of the current operation
+
+    The I/O priority is set while the context is active. The yielded function
+    wraps commands such that they run in a transient scope with the limits.
+    """
+    current = _current_operation.get()
+    limits = None if current is None else current.statistics.limits
+    if current is None or limits is None:
+        yield _unchanged
+        return
+    limiter: _Limiter = _unchanged
+    if _needs_scope(limits):
+        limiter = functools.partial(_in_scope, properties=_scope_properties(limits))
+    with _io_priority(limits):
+        yield limiter
+
+
+def _unchanged(cmd: sh.StrPathList) -> sh.StrPathList:
+    return cmd
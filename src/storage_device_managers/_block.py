@@ -0,0 +1,272 @@
+import contextlib
+import os
+import shlex
+import threading
+import typing as t
+from collections.abc import Iterator, Sequence
+from pathlib import Path
+
+import shell_interface as sh
+
+from ._backend import _run_cmd
+from ._log import logger
+from ._operation import _forget_operation_state
+from ._types import BlockQueueTuning
+
+_SYSFS = Path("/sys")
+
+_LOOP_POOL_SIZE = 8
+_loop_pool: list[Path] = []
+_loop_pool_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def tuned_block_device(device: Path, tuning: BlockQueueTuning) -> Iterator[Path]:
+    """Apply block layer settings to a device temporarily
+
+    This context manager will write the settings of `tuning` to the sysfs
+    attributes of `device` and restore their original values upon exit.
+
+    The device is resolved as follows: Block devices and symbolic links to them,
+    e.g. into `/dev/mapper`, are used directly. Partitions are replaced by the
+    disk they are part of, since only disks have a request queue. For regular
+    files, the loop device they are attached to is used.
+
+    Device mapper targets like dm-crypt have no I/O scheduler. Therefore,
+    `scheduler` and `nr_requests` are applied to the physical devices beneath
+    them, which are found by following `slaves` in sysfs. All other settings are
+    applied to `device` itself.
+
+    Parameters:
+    -----------
+    device
+        block device, or regular file attached to a loop device
+    tuning
+        settings to apply
+
+    Returns:
+    --------
+    Path
+        the given device
+
+    Raises:
+    -------
+    ValueError
+        if `device` is neither a block device nor attached to a loop device
+    shell_interface.ShellInterfaceError
+        if the settings could not be written
+    """
+    name = _block_device_name(device)
+    settings = _block_queue_settings(name, tuning)
+    originals = {attribute: _read_sysfs_value(attribute) for attribute in settings}
+    try:
+        _write_sysfs_values(settings)
+    except sh.ShellInterfaceError:
+        # The values written before the failing one must not stay in effect.
+        _write_sysfs_values(
+            {
+                attribute: value
+                for attribute, value in originals.items()
+                if _read_sysfs_value(attribute) != value
+            }
+        )
+        raise
+    logger.success(
+        "Blockgeräte-Einstellungen für {device} erfolgreich gesetzt.", device=device
+    )
+    try:
+        yield device
+    finally:
+        # Devices might have vanished in the meantime, e.g. detached loop devices.
+        still_present = {
+            attribute: value
+            for attribute, value in originals.items()
+            if attribute.exists()
+        }
+        _write_sysfs_values(still_present)
+        logger.success(
+            "Blockgeräte-Einstellungen für {device} erfolgreich zurückgesetzt.",
+            device=device,
+        )
+
+
+@contextlib.contextmanager
+def _maybe_tuned_block_devices(
+    devices: Sequence[Path], tuning: BlockQueueTuning | None
+) -> Iterator[None]:
+    with contextlib.ExitStack() as stack:
+        if tuning is not None:
+            for device in devices:
+                stack.enter_context(tuned_block_device(device, tuning))
+        yield
+
+
+def _block_device_name(device: Path) -> str:
+    if device.is_block_device():
+        rdev = device.stat().st_rdev
+        dev_number = f"{os.major(rdev)}:{os.minor(rdev)}"
+        name = (_SYSFS / "dev" / "block" / dev_number).resolve().name
+    else:
+        name = _loop_device_name(device)
+    return _disk_name(name)
+
+
+def _disk_name(name: str) -> str:
+    if (_SYSFS / "class" / "block" / name / "partition").exists():
+        return (_SYSFS / "class" / "block" / name).resolve().parent.name
+    return name
+
+
+def _loop_device_name(backing_file: Path) -> str:
+    absolute = str(backing_file.resolve())
+    for candidate in (_SYSFS / "block").glob("loop*/loop/backing_file"):
+        if candidate.read_text().strip() == absolute:
+            return candidate.parent.parent.name
+    raise ValueError(f"{backing_file} is neither a block device nor a loop device!")
+
+
+def _slave_device_names(name: str) -> list[str]:
+    slaves_dir = _SYSFS / "block" / name / "slaves"
+    if not slaves_dir.is_dir() or not any(slaves_dir.iterdir()):
+        return [name]
+    leaves = []
+    for slave in sorted(slaves_dir.iterdir()):
+        leaves.extend(_slave_device_names(_disk_name(slave.name)))
+    return leaves
+
+
+def _block_queue_settings(name: str, tuning: BlockQueueTuning) -> dict[Path, str]:
+    queue = _SYSFS / "block" / name / "queue"
+    dev_number = (_SYSFS / "block" / name / "dev").read_text().strip()
+    bdi = _SYSFS / "class" / "bdi" / dev_number
+    candidates: list[tuple[Path, object]] = [
+        (queue / "read_ahead_kb", tuning.read_ahead_kb),
+        (bdi / "max_ratio", tuning.max_ratio),
+        (bdi / "strict_limit", tuning.strict_limit),
+    ]
+    for leaf in _slave_device_names(name):
+        leaf_queue = _SYSFS / "block" / leaf / "queue"
+        candidates.append((leaf_queue / "scheduler", tuning.scheduler))
+        candidates.append((leaf_queue / "nr_requests", tuning.nr_requests))
+    return {
+        attribute: str(int(value)) if isinstance(value, bool) else str(value)
+        for attribute, value in candidates
+        if value is not None
+    }
+
+
+def _read_sysfs_value(attribute: Path) -> str:
+    # Example content of queue/scheduler:
+    # mq-deadline kyber [bfq] none
+    value = attribute.read_text().strip()
+    if "[" in value:
+        return value[value.index("[") + 1 : value.index("]")]
+    return value
+
+
+def _write_sysfs_values(values: t.Mapping[Path, str]) -> None:
+    if not values:
+        return
+    # Stop at the first failing write, so that its error is not hidden.
+    script = " && ".join(
+        f"printf %s {shlex.quote(value)} > {shlex.quote(str(attribute))}"
+        for attribute, value in values.items()
+    )
+    write_cmd: sh.StrPathList = ["sudo", "sh", "-c", script]
+    _run_cmd(write_cmd)
+
+
+@contextlib.contextmanager
+def loop_device(
+    image: Path,
+    direct_io: bool = True,
+    block_size: int = 4096,
+    read_only: bool = False,
+) -> Iterator[Path]:
+    """Attach an image file to a loop device
+
+    This context manager will attach `image` to a loop device and return the
+    device's path. Upon exit, the loop device is detached again. The device can be
+    passed to `decrypted_device`, `mounted_device` and all other functions
+    expecting a block device.
+
+    Unlike the loop devices set up implicitly by `mount` or `cryptsetup`, direct
+    I/O is used by default. This way, the content of `image` is not cached twice,
+    once for the loop device and once for the file. Direct I/O requires
+    `block_size` to be a multiple of the logical block size of the file system
+    containing `image`. The device is configured atomically by `losetup`, which
+    uses the `LOOP_CONFIGURE` ioctl.
+
+    Detached loop devices are remembered and reused for subsequent images, which
+    avoids creating new device nodes.
+
+    Parameters:
+    -----------
+    image
+        file to be attached
+    direct_io
+        whether to bypass the page cache for accesses to `image`
+    block_size
+        logical block size of the loop device in bytes
+    read_only
+        whether to attach `image` read-only
+
+    Returns:
+    --------
+    Path
+        path of the loop device
+
+    Raises:
+    -------
+    FileNotFoundError
+        if `image` does not exist
+    shell_interface.ShellInterfaceError
+        if `image` could not be attached
+    """
+    if not image.exists():
+        raise FileNotFoundError
+    options: sh.StrPathList = [
+        f"--direct-io={'on' if direct_io else 'off'}",
+        "--sector-size",
+        str(block_size),
+    ]
+    if read_only:
+        options.append("--read-only")
+    device = _attach_loop_device(image, options)
+    logger.success(
+        "Datei {image} erfolgreich an {device} angebunden.", image=image, device=device
+    )
+    try:
+        yield device
+    finally:
+        _forget_operation_state()
+        detach_cmd: sh.StrPathList = ["sudo", "losetup", "--detach", device]
+        _run_cmd(detach_cmd)
+        with _loop_pool_lock:
+            if len(_loop_pool) < _LOOP_POOL_SIZE:
+                _loop_pool.append(device)
+        logger.success("Loop-Gerät {device} erfolgreich gelöst.", device=device)
+
+
+def _attach_loop_device(image: Path, options: sh.StrPathList) -> Path:
+    while True:
+        with _loop_pool_lock:
+            if not _loop_pool:
+                break
+            candidate = _loop_pool.pop()
+        attach_cmd: sh.StrPathList = ["sudo", "losetup", *options, candidate, image]
+        try:
+            _run_cmd(attach_cmd)
+        except sh.ShellInterfaceError as e:
+            # E.g. the device was taken by someone else in the meantime. It is not
+            # put back into the pool, so that a broken device is not retried.
+            logger.warning(
+                "Loop-Gerät {device} konnte nicht wiederverwendet werden: {error}",
+                device=candidate,
+                error=e,
+            )
+            continue
+        return candidate
+    find_cmd: sh.StrPathList = ["sudo", "losetup", "--find", "--show", *options, image]
+    result = _run_cmd(find_cmd, capture_output=True)
+    return Path(result.stdout.decode().strip())
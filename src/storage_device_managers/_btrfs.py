@@ -0,0 +1,384 @@
+import contextlib
+import errno
+import functools
+import os
+import shlex
+import subprocess
+import time
+import typing as t
+from collections.abc import Callable, Iterator, Sequence
+from pathlib import Path
+
+import shell_interface as sh
+
+from ._backend import _resource_limits, _run_cmd
+from ._instrumentation import _instrumented
+from ._log import logger
+from ._operation import _record_command
+from ._types import SendReceiveError, SubvolumeDeletionError, TransferStatistics
+
+
+@contextlib.contextmanager
+def btrfs_snapshot(src: Path, dest: Path, readonly: bool = True) -> Iterator[Path]:
+    """Create a BtrFS snapshot of `src` at `dest`
+
+    This context manager will snapshot the BtrFS subvolume `src` to `dest`. Creating
+    a snapshot takes constant time regardless of the amount of data, which makes it
+    a cheap source for point-in-time backups. Upon exit, the snapshot is deleted.
+
+    The snapshot is only deleted if it cannot contain data that exists nowhere
+    else. A read-only snapshot is deleted only if it is still read-only. A writable
+    snapshot is deleted only if its generation did not change, i.e. nothing in it
+    was modified after its creation. Otherwise, a SubvolumeDeletionError is raised
+    and the snapshot is kept. If the body raised an exception, that exception is
+    raised instead, with the SubvolumeDeletionError as its cause.
+
+    Parameters:
+    -----------
+    src
+        BtrFS subvolume to be snapshotted
+    dest
+        path at which the snapshot is created; must not exist
+    readonly
+        whether the snapshot is created read-only
+
+    Returns:
+    --------
+    Path
+        path to the snapshot
+
+    Raises:
+    -------
+    FileNotFoundError
+        if `src` does not exist
+    FileExistsError
+        if `dest` already exists
+    SubvolumeDeletionError
+        if the snapshot might contain unexpected data upon exit
+    """
+    if not src.exists():
+        raise FileNotFoundError
+    if dest.exists():
+        raise FileExistsError
+    snapshot_cmd: sh.StrPathList = ["sudo", "btrfs", "subvolume", "snapshot"]
+    if readonly:
+        snapshot_cmd.append("-r")
+    snapshot_cmd.extend([src, dest])
+    _run_cmd(snapshot_cmd)
+    try:
+        generation = _get_subvolume_generation(dest)
+    except BaseException:
+        # Nothing can have been written to the snapshot yet.
+        _delete_subvolume(dest)
+        raise
+    logger.success(
+        "Snapshot von {src} nach {dest} erfolgreich erstellt.", src=src, dest=dest
+    )
+    keep_reason = functools.partial(_snapshot_keep_reason, dest, readonly, generation)
+    with _deleted_on_exit(dest, keep_reason):
+        yield dest
+
+
+def _snapshot_keep_reason(dest: Path, readonly: bool, generation: int) -> str | None:
+    if readonly and not _is_readonly_subvolume(dest):
+        return f"Snapshot {dest} is not read-only anymore and will not be deleted."
+    if not readonly and _subvolume_modified_since(dest, generation):
+        return f"Snapshot {dest} was modified and will not be deleted."
+    return None
+
+
+@contextlib.contextmanager
+def subvolume(path: Path) -> Iterator[Path]:
+    """Create a BtrFS subvolume at `path`
+
+    This context manager will create a new, empty BtrFS subvolume. Upon exit, the
+    subvolume is deleted again, but only if it is empty. Similar to
+    `temporary_directory`, content that was put into the subvolume will never be
+    deleted silently. Instead, a SubvolumeDeletionError is raised, or chained as
+    cause to the exception raised by the body.
+
+    Parameters:
+    -----------
+    path
+        path at which the subvolume is created; must not exist
+
+    Returns:
+    --------
+    Path
+        path to the subvolume
+
+    Raises:
+    -------
+    FileExistsError
+        if `path` already exists
+    SubvolumeDeletionError
+        if the subvolume is not empty upon exit
+    """
+    if path.exists():
+        raise FileExistsError
+    create_cmd: sh.StrPathList = ["sudo", "btrfs", "subvolume", "create", path]
+    _run_cmd(create_cmd)
+    logger.success("Subvolume {path} erfolgreich erstellt.", path=path)
+    with _deleted_on_exit(path, functools.partial(_subvolume_keep_reason, path)):
+        yield path
+
+
+def _subvolume_keep_reason(path: Path) -> str | None:
+    if any(path.iterdir()):
+        return f"Subvolume {path} is not empty and will not be deleted."
+    return None
+
+
+@contextlib.contextmanager
+def _deleted_on_exit(
+    path: Path, keep_reason: Callable[[], str | None]
+) -> Iterator[None]:
+    """Delete the subvolume `path` upon exit unless `keep_reason` gives a reason
+
+    If the body raised, its exception is propagated and the failure to delete is
+    chained to it as its cause, instead of replacing it.
+    """
+    try:
+        yield
+    except BaseException as body_error:
+        try:
+            _delete_unless_kept(path, keep_reason)
+        except Exception as deletion_error:
+            raise body_error from deletion_error
+        raise
+    _delete_unless_kept(path, keep_reason)
+
+
+def _delete_unless_kept(path: Path, keep_reason: Callable[[], str | None]) -> None:
+    reason = keep_reason()
+    if reason is not None:
+        raise SubvolumeDeletionError(reason)
+    _delete_subvolume(path)
+    logger.success("Subvolume {path} erfolgreich entfernt.", path=path)
+
+
+def _get_subvolume_generation(path: Path) -> int:
+    # Example line of `btrfs subvolume show`:
+    # 	Generation: 		12
+    show_cmd: sh.StrPathList = ["sudo", "btrfs", "subvolume", "show", path]
+    result = _run_cmd(show_cmd, capture_output=True)
+    for line in result.stdout.decode().splitlines():
+        key, _, value = line.partition(":")
+        if key.strip() == "Generation":
+            return int(value)
+    raise ValueError(f"Could not determine generation of subvolume {path}.")
+
+
+def _subvolume_modified_since(path: Path, generation: int) -> bool:
+    # Any change to the subvolume, including new directories, renames or xattrs,
+    # raises its generation once committed. `find-new` would only list changed
+    # file data, so the pending transaction is committed and the generations
+    # compared instead.
+    sync_cmd: sh.StrPathList = ["sudo", "btrfs", "filesystem", "sync", path]
+    _run_cmd(sync_cmd)
+    return _get_subvolume_generation(path) != generation
+
+
+def _is_readonly_subvolume(path: Path) -> bool:
+    get_cmd: sh.StrPathList = ["sudo", "btrfs", "property", "get", "-ts", path, "ro"]
+    result = _run_cmd(get_cmd, capture_output=True)
+    return result.stdout.decode().strip() == "ro=true"
+
+
+def _delete_subvolume(path: Path) -> None:
+    delete_cmd: sh.StrPathList = ["sudo", "btrfs", "subvolume", "delete", path]
+    _run_cmd(delete_cmd)
+
+
+_PIPE_CHUNK_SIZE = 1024**2
+
+
+def btrfs_send_receive(
+    snapshot: Path,
+    dest_dir: Path,
+    parent: Path | None = None,
+    *,
+    compression: bool = False,
+    remote: Sequence[str] | None = None,
+) -> TransferStatistics:
+    """Replicate a read-only BtrFS snapshot into another BtrFS
+
+    This function streams the output of `btrfs send` into `btrfs receive`. The data
+    is moved between both processes using `splice`, so it never has to be copied
+    into user space. If `parent` is given, only the difference between `parent`
+    and `snapshot` is sent. In that case, `parent` must already exist at the
+    receiving side.
+
+    If `remote` is given, `btrfs receive` is executed by prefixing it with
+    `remote`, e.g. `["ssh", "backup-host"]`. The receiving command is passed to
+    `remote` as a single shell command. For slow connections, `compression` can be
+    enabled to compress the stream with `zstd` before sending it.
+
+    If the transfer fails for a local `dest_dir`, the partially received snapshot
+    is deleted. This is safe since `dest_dir` must not contain a snapshot of the
+    same name beforehand. For remote targets, no cleanup is attempted.
+
+    Parameters:
+    -----------
+    snapshot
+        read-only BtrFS snapshot to be sent
+    dest_dir
+        directory in a BtrFS at which the snapshot is received
+    parent
+        read-only BtrFS snapshot to send an incremental stream against
+    compression
+        whether to compress the stream using `zstd`
+    remote
+        command prefix to run `btrfs receive` on another host
+
+    Returns:
+    --------
+    TransferStatistics
+        number of bytes transferred and time taken
+
+    Raises:
+    -------
+    FileExistsError
+        if a local `dest_dir` already contains an entry named like `snapshot`
+    SendReceiveError
+        if any of the involved commands fails
+    """
+    received = dest_dir / snapshot.name
+    if remote is None and received.exists():
+        raise FileExistsError
+    producers = _btrfs_send_commands(snapshot, parent, compression)
+    consumer = _btrfs_receive_command(dest_dir, compression, remote)
+    start = time.monotonic()
+    try:
+        with _instrumented(producers[0]) as measurement:
+            total_bytes = _run_pipeline(producers, consumer)
+            measurement.bytes_written = total_bytes
+    except SendReceiveError:
+        if remote is None and received.exists():
+            _delete_subvolume(received)
+        raise
+    statistics = TransferStatistics(total_bytes, time.monotonic() - start)
+    logger.success(
+        "Snapshot {snapshot} erfolgreich nach {dest_dir} übertragen "
+        "({statistics.total_bytes} Bytes, {statistics.bytes_per_second:.0f} Bytes/s).",
+        snapshot=snapshot,
+        dest_dir=dest_dir,
+        statistics=statistics,
+    )
+    return statistics
+
+
+def _btrfs_send_commands(
+    snapshot: Path, parent: Path | None, compression: bool
+) -> list[sh.StrPathList]:
+    send_cmd: sh.StrPathList = ["sudo", "btrfs", "send"]
+    if parent is not None:
+        send_cmd.extend(["-p", parent])
+    send_cmd.append(snapshot)
+    if compression:
+        return [send_cmd, ["zstd", "--compress", "--stdout", "-T0"]]
+    return [send_cmd]
+
+
+def _btrfs_receive_command(
+    dest_dir: Path, compression: bool, remote: Sequence[str] | None
+) -> sh.StrPathList:
+    receive = f"sudo btrfs receive {shlex.quote(str(dest_dir))}"
+    if compression:
+        receive = f"zstd --decompress --stdout | {receive}"
+    if remote is not None:
+        return [*remote, receive]
+    if compression:
+        return ["sh", "-c", receive]
+    return ["sudo", "btrfs", "receive", dest_dir]
+
+
+def _run_pipeline(producers: list[sh.StrPathList], consumer: sh.StrPathList) -> int:
+    processes: list[subprocess.Popen[bytes]] = []
+    try:
+        total_bytes = _start_and_pump(processes, producers, consumer)
+    except BaseException as e:
+        _kill_all(processes)
+        if isinstance(e, OSError):
+            raise SendReceiveError(
+                f"Pipeline {producers} | {consumer} failed: {e}"
+            ) from e
+        raise
+    failed = [process.args for process in processes if process.wait() != 0]
+    if total_bytes < 0:
+        # The producers were killed by SIGPIPE, so only the consumer is of interest.
+        raise SendReceiveError(
+            f"Command {consumer} exited with code {processes[-1].returncode} "
+            "before reading all data."
+        )
+    if failed:
+        raise SendReceiveError(f"Commands {failed} failed.")
+    return total_bytes
+
+
+def _kill_all(processes: list[subprocess.Popen[bytes]]) -> None:
+    for process in processes:
+        process.kill()
+    for process in processes:
+        process.wait()
+
+
+def _start_and_pump(
+    processes: list[subprocess.Popen[bytes]],
+    producers: list[sh.StrPathList],
+    consumer: sh.StrPathList,
+) -> int:
+    """Start the pipeline and pump the last producer's output into the consumer
+
+    Started processes are appended to `processes`, so that the caller can clean
+    them up if starting or pumping fails. Returns -1 if the consumer exited early.
+    """
+    stdin: t.IO[bytes] | None = None
+    try:
+        with _resource_limits() as limited:
+            for cmd in producers:
+                _record_command(cmd)
+                process = subprocess.Popen(
+                    limited(cmd), stdin=stdin, stdout=subprocess.PIPE
+                )
+                if stdin is not None:
+                    # Let the previous process receive SIGPIPE if this one exits early.
+                    stdin.close()
+                stdin = process.stdout
+                processes.append(process)
+            assert stdin is not None
+            _record_command(consumer)
+            receiver = subprocess.Popen(limited(consumer), stdin=subprocess.PIPE)
+        processes.append(receiver)
+        assert receiver.stdin is not None
+        with receiver.stdin:
+            return _pump(stdin.fileno(), receiver.stdin.fileno())
+    except BrokenPipeError:
+        return -1
+    finally:
+        if stdin is not None:
+            stdin.close()
+
+
+def _pump(src_fd: int, dest_fd: int) -> int:
+    total_bytes = 0
+    while True:
+        try:
+            n_bytes = os.splice(src_fd, dest_fd, _PIPE_CHUNK_SIZE)
+        except OSError as e:
+            if e.errno not in {errno.EINVAL, errno.ENOSYS}:
+                raise
+            return total_bytes + _copy(src_fd, dest_fd)
+        if n_bytes == 0:
+            return total_bytes
+        total_bytes += n_bytes
+
+
+def _copy(src_fd: int, dest_fd: int) -> int:
+    total_bytes = 0
+    while chunk := os.read(src_fd, _PIPE_CHUNK_SIZE):
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(dest_fd, view) :]
+        total_bytes += len(chunk)
+    return total_bytes
@@ -0,0 +1,311 @@
+import argparse
+import contextvars
+import dataclasses
+import enum
+import json
+import sys
+import threading
+import typing as t
+from collections.abc import Callable, Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from uuid import UUID
+
+import storage_device_managers as sdm
+
+from ._operation import operation
+from ._types import MkfsProfiles, ValidCompressions, VolumeKeyCache
+
+
+@dataclasses.dataclass(frozen=True)
+class _Param:
+    name: str
+    convert: Callable[[t.Any], object] = Path
+    required: bool = True
+    many: bool = False
+    flag: bool = False
+    choices: tuple[str, ...] | None = None
+    # Name of the keyword argument of the function, if it differs from `name`.
+    keyword: str | None = None
+
+
+@dataclasses.dataclass(frozen=True)
+class _Command:
+    function: str
+    help: str
+    params: tuple[_Param, ...] = ()
+
+    @property
+    def name(self) -> str:
+        return self.function.replace("_", "-")
+
+
+def _key_cache(ttl: str | int) -> VolumeKeyCache:
+    """Cache volume keys for the given number of seconds"""
+    return VolumeKeyCache(ttl=int(ttl))
+
+
+_FILESYSTEMS = ("btrfs", "ext4")
+_DEVICE = _Param("device")
+
+_COMMANDS: t.Final[tuple[_Command, ...]] = (
+    _Command("get_mounted_devices", "list mounted devices and their mount points"),
+    _Command(
+        "is_mounted", "exit with 0 if the device is mounted, 1 otherwise", (_DEVICE,)
+    ),
+    _Command("get_filesystem", "print the file system of a device", (_DEVICE,)),
+    _Command(
+        "mount_device",
+        "mount one or several devices",
+        (
+            _Param("mount_dir"),
+            _Param("device", many=True),
+            _Param("compression", ValidCompressions, required=False),
+            _Param("subvol", str, required=False),
+        ),
+    ),
+    _Command("unmount_device", "sync and unmount a device", (_DEVICE,)),
+    _Command("sync_device", "flush pending writes of a device", (_DEVICE,)),
+    _Command(
+        "open_encrypted_device",
+        "open an encrypted device and print the decrypted device",
+        (
+            _Param("device", str),
+            _Param("pass_cmd", str),
+            _Param("key_cache", _key_cache, required=False),
+        ),
+    ),
+    _Command(
+        "close_decrypted_device",
+        "close a decrypted device",
+        (_DEVICE, _Param("revoke_key", bool, required=False, flag=True)),
+    ),
+    _Command(
+        "encrypt_device",
+        "encrypt a device and print the UUID of its LUKS header",
+        (_DEVICE, _Param("password_cmd", str)),
+    ),
+    _Command(
+        "mkfs",
+        "create a file system",
+        (
+            _DEVICE,
+            _Param("filesystem", str, choices=_FILESYSTEMS),
+            _Param("profile", MkfsProfiles, required=False, keyword="options"),
+        ),
+    ),
+    _Command(
+        "chown",
+        "change the owner of a file or folder",
+        (
+            _Param("file_or_folder"),
+            _Param("user", str),
+            _Param("group", str, required=False),
+            _Param("recursive", bool, required=False, flag=True),
+        ),
+    ),
+    _Command("generate_passcmd", "print a password command with a random password"),
+    _Command(
+        "provision_image",
+        "create a sparse image file, optionally encrypted and formatted",
+        (
+            _Param("dest"),
+            _Param("size", int),
+            _Param("filesystem", str, required=False, choices=_FILESYSTEMS),
+            _Param("pass_cmd", str, required=False),
+            _Param("cache_dir", required=False),
+        ),
+    ),
+)
+_COMMANDS_BY_FUNCTION: t.Final = {cmd.function: cmd for cmd in _COMMANDS}
+
+
+class _RequestError(ValueError):
+    pass
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    """Entry point of the `storage-device-managers` command"""
+    args = _build_parser().parse_args(argv)
+    if args.version:
+        print(sdm.__version__)
+        return 0
+    if args.command is None:
+        _build_parser().print_usage(sys.stderr)
+        return 2
+    if args.command == "batch":
+        return _run_batch(args.file, args.jobs, sys.stdout)
+    command = _COMMANDS_BY_FUNCTION[args.command]
+    kwargs = {param.name: getattr(args, param.name) for param in command.params}
+    try:
+        result = _execute(command, kwargs)
+    except Exception as e:
+        print(f"{type(e).__name__}: {e}", file=sys.stderr)
+        return 1
+    return _print_result(result, as_json=args.json)
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="storage-device-managers",
+        description="Manage decryption and mounts of storage devices.",
+    )
+    parser.add_argument("--version", action="store_true", help="print the version")
+    parser.add_argument("--json", action="store_true", help="print all results as JSON")
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND")
+    for command in _COMMANDS:
+        subparser = subparsers.add_parser(command.name, help=command.help)
+        subparser.set_defaults(command=command.function)
+        for param in command.params:
+            _add_argument(subparser, param)
+    batch = subparsers.add_parser(
+        "batch",
+        help="run the operations of a JSON or NDJSON stream in one process",
+        description=_BATCH_DESCRIPTION,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    batch.set_defaults(command="batch")
+    batch.add_argument(
+        "file", type=argparse.FileType("r"), nargs="?", default=sys.stdin
+    )
+    batch.add_argument("--jobs", type=int, default=1, help="operations run in parallel")
+    return parser
+
+
+_BATCH_DESCRIPTION = """\
+Each operation is an object like
+
+    {"id": "x", "op": "mount_device", "args": {"device": "/dev/sdx", "mount_dir": "/mnt"}}
+
+where "op" is the name of a function of this package and "args" its arguments.
+The operations are read from FILE, either as one JSON array or as one object per
+line. For each operation, one line is printed:
+
+    {"id": "x", "index": 0, "ok": true, "result": null}
+
+Failed operations have "ok" set to false and an "error" with "type" and
+"message". All operations share one `operation()`, i.e. their query caches.
+With --jobs, results are printed in the order the operations complete.
+"""
+
+
+def _add_argument(parser: argparse.ArgumentParser, param: _Param) -> None:
+    if param.flag:
+        parser.add_argument(f"--{param.name.replace('_', '-')}", action="store_true")
+        return
+    kwargs: dict[str, t.Any] = {"choices": param.choices}
+    if param.many:
+        kwargs["nargs"] = "+"
+    if param.required:
+        parser.add_argument(param.name, **kwargs)
+    else:
+        parser.add_argument(
+            f"--{param.name.replace('_', '-')}", dest=param.name, **kwargs
+        )
+
+
+def _execute(command: _Command, raw: t.Mapping[str, t.Any]) -> object:
+    unknown = set(raw) - {param.name for param in command.params}
+    if unknown:
+        raise _RequestError(f"Unknown arguments {sorted(unknown)}!")
+    kwargs = {}
+    for param in command.params:
+        value = raw.get(param.name)
+        if value is None:
+            if param.required:
+                raise _RequestError(f"Argument {param.name} is missing!")
+            continue
+        kwargs[param.keyword or param.name] = _convert(param, value)
+    function: Callable[..., object] = getattr(sdm, command.function)
+    return function(**kwargs)
+
+
+def _convert(param: _Param, value: t.Any) -> object:
+    if param.choices is not None and value not in param.choices:
+        raise _RequestError(f"Argument {param.name} must be one of {param.choices}!")
+    if param.many and isinstance(value, list):
+        return [param.convert(item) for item in value]
+    return param.convert(value)
+
+
+def _to_json(value: object) -> t.Any:
+    if isinstance(value, Path | UUID | enum.Enum):
+        return str(value)
+    if isinstance(value, t.Mapping):
+        return {str(key): _to_json(val) for key, val in value.items()}
+    if isinstance(value, frozenset | set):
+        return sorted(_to_json(item) for item in value)
+    if isinstance(value, list | tuple):
+        return [_to_json(item) for item in value]
+    return value
+
+
+def _print_result(result: object, *, as_json: bool) -> int:
+    if as_json:
+        print(json.dumps(_to_json(result)))
+    elif isinstance(result, str | Path | UUID):
+        print(result)
+    elif result is not None and not isinstance(result, bool):
+        print(json.dumps(_to_json(result), indent=2))
+    return 1 if result is False else 0
+
+
+def _run_batch(stream: t.TextIO, jobs: int, out: t.TextIO) -> int:
+    failures = 0
+    lock = threading.Lock()
+
+    def emit(response: dict[str, t.Any]) -> None:
+        nonlocal failures
+        with lock:
+            failures += not response["ok"]
+            out.write(json.dumps(response) + "\n")
+            out.flush()
+
+    with operation(), ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        for index, request in enumerate(_read_requests(stream)):
+            future = executor.submit(
+                contextvars.copy_context().run, _handle_request, index, request
+            )
+            future.add_done_callback(lambda fut: emit(fut.result()))
+    return 1 if failures else 0
+
+
+def _read_requests(stream: t.TextIO) -> Iterator[object]:
+    first = stream.readline()
+    if first.lstrip().startswith("["):
+        yield from _parse_json(first + stream.read(), expect_list=True)
+        return
+    for line in [first, *stream] if first else []:
+        if line.strip():
+            yield from _parse_json(line, expect_list=False)
+
+
+def _parse_json(text: str, *, expect_list: bool) -> Iterator[object]:
+    try:
+        document = json.loads(text)
+    except json.JSONDecodeError as e:
+        yield _RequestError(f"Invalid JSON: {e}")
+        return
+    if expect_list:
+        yield from document
+    else:
+        yield document
+
+
+def _handle_request(index: int, request: object) -> dict[str, t.Any]:
+    response: dict[str, t.Any] = {"index": index}
+    try:
+        if isinstance(request, Exception):
+            raise request
+        if not isinstance(request, dict):
+            raise _RequestError("Operation must be a JSON object!")
+        response["id"] = request.get("id")
+        command = _COMMANDS_BY_FUNCTION.get(request.get("op", ""))
+        if command is None:
+            raise _RequestError(f"Unknown operation {request.get('op')!r}!")
+        result = _execute(command, request.get("args", {}))
+    except Exception as e:
+        response.update(ok=False, error={"type": type(e).__name__, "message": str(e)})
+    else:
+        response.update(ok=True, result=_to_json(result))
+    return response
@@ -0,0 +1,437 @@
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import functools
+import re
+import secrets
+import string
+import typing as t
+from collections.abc import Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from uuid import UUID, uuid4
+
+import shell_interface as sh
+
+from ._backend import _pipe_pass_cmd_to_real_cmd, _run_cmd
+from ._log import logger
+from ._operation import _forget_operation_state
+from ._types import (
+    BlockQueueTuning,
+    DeviceDecryptionError,
+    InvalidDecryptedDevice,
+    VolumeKeyCache,
+)
+
+if t.TYPE_CHECKING:
+    from ._inventory import DeviceSpec
+
+_KEY_DESCRIPTION_PREFIX = "storage-device-managers:"
+# Device mapper UUID of dm-crypt mappings, e.g. CRYPT-LUKS2-<LUKS UUID as hex>-<name>
+_DM_CRYPT_UUID = re.compile(r"CRYPT-[^-]+-([0-9a-fA-F]{32})-")
+
+
+@contextlib.contextmanager
+def decrypted_device(
+    device: DeviceSpec,
+    pass_cmd: str,
+    *,
+    tuning: BlockQueueTuning | None = None,
+    key_cache: VolumeKeyCache | None = None,
+    allow_discards: bool = False,
+) -> Iterator[Path]:
+    """Decrypt a given device using pass_cmd
+
+    Given a device and a shell command that outputs a password on STDOUT, this
+    context manager will open the device using `cryptsetup`. Upon exit, the
+    device is closed again.
+
+    If `tuning` is given, it is applied to the decrypted device and the devices
+    underlying it for as long as the device is open. Refer to `tuned_block_device`
+    for details.
+
+    If `key_cache` is given, the volume key is cached in the kernel keyring and
+    kept after the device is closed. Refer to `open_encrypted_device` for details.
+
+    If `allow_discards` is true, discard requests, e.g. from `trim_filesystem`,
+    are passed on to `device`.
+
+    The device can be given by path, by UUID or as `UUID=...`, `LABEL=...` or
+    `PARTUUID=...`. Refer to `DeviceInventory` for how these are resolved.
+
+    Note that pass_cmd will directly be executed in a subshell. Therefore, DO NOT
+    USE UNTRUSTED `pass_cmd`!
+
+    Parameters:
+    -----------
+    device
+        file-like object to be opened with `cryptsetup`, or its identifier
+    pass_cmd
+        command that prints the device's password on STDOUT
+    tuning
+        block layer settings to apply while the device is open
+    key_cache
+        settings for caching the volume key in the kernel keyring
+    allow_discards
+        whether to pass discard requests on to `device`
+
+    Returns:
+    --------
+    Path
+        destination of opened device
+
+    Raises:
+    -------
+    shell_interface.PassCmdError
+        if the password command returns a non-zero exit code
+    DeviceDecryptionError
+        if cryptsetup returns a non-zero exit code
+    DeviceNotFoundError
+        if no device carries the given identifier
+    """
+    from ._block import _maybe_tuned_block_devices  # noqa: PLC0415
+
+    decrypted = open_encrypted_device(
+        device, pass_cmd, key_cache=key_cache, allow_discards=allow_discards
+    )
+    logger.success("Speichermedium {device} erfolgreich entschlüsselt.", device=device)
+    try:
+        with _maybe_tuned_block_devices([decrypted], tuning):
+            yield decrypted
+    finally:
+        _forget_operation_state()
+        close_decrypted_device(decrypted)
+        logger.success(
+            "Verschlüsselung des Speichermediums {device} erfolgreich geschlossen.",
+            device=device,
+        )
+
+
+@contextlib.contextmanager
+def decrypted_devices(
+    devices: Sequence[DeviceSpec],
+    pass_cmd: str,
+    *,
+    key_cache: VolumeKeyCache | None = None,
+    allow_discards: bool = False,
+) -> Iterator[list[Path]]:
+    """Decrypt several devices in parallel using pass_cmd
+
+    This context manager behaves like `decrypted_device`, but opens all given
+    devices concurrently. This is useful for the members of a multi-device BtrFS,
+    which all have to be opened before the file system can be mounted. If opening
+    any of the devices fails, all devices opened so far are closed again. Upon exit,
+    all devices are closed.
+
+    Note that pass_cmd will directly be executed in a subshell. Therefore, DO NOT
+    USE UNTRUSTED `pass_cmd`!
+
+    Parameters:
+    -----------
+    devices
+        file-like objects to be opened with `cryptsetup`, or their identifiers
+    pass_cmd
+        command that prints the devices' password on STDOUT
+    key_cache
+        settings for caching the volume keys in the kernel keyring
+    allow_discards
+        whether to pass discard requests on to `devices`
+
+    Returns:
+    --------
+    list[Path]
+        destinations of opened devices, in the order of `devices`
+
+    Raises:
+    -------
+    shell_interface.PassCmdError
+        if the password command returns a non-zero exit code
+    DeviceDecryptionError
+        if cryptsetup returns a non-zero exit code
+    """
+    with contextlib.ExitStack() as stack:
+        with ThreadPoolExecutor(max_workers=max(len(devices), 1)) as executor:
+            futures = [
+                executor.submit(
+                    contextvars.copy_context().run,
+                    functools.partial(
+                        open_encrypted_device,
+                        device,
+                        pass_cmd,
+                        key_cache=key_cache,
+                        allow_discards=allow_discards,
+                    ),
+                )
+                for device in devices
+            ]
+        for future in futures:
+            if future.exception() is None:
+                stack.callback(close_decrypted_device, future.result())
+        decrypted = [future.result() for future in futures]
+        logger.success(
+            "Speichermedien {devices} erfolgreich entschlüsselt.", devices=devices
+        )
+        try:
+            yield decrypted
+        finally:
+            _forget_operation_state()
+    logger.success(
+        "Verschlüsselung der Speichermedien {devices} erfolgreich geschlossen.",
+        devices=devices,
+    )
+
+
+def open_encrypted_device(
+    device: DeviceSpec,
+    pass_cmd: str,
+    *,
+    key_cache: VolumeKeyCache | None = None,
+    allow_discards: bool = False,
+) -> Path:
+    """Open an encrypted device
+
+    This function will open an encrypted device. The given path must point to a
+    device that can be opened by `cryptsetup`.
+
+    In order to encrypt the device, `pass_cmd` is executed and its output is
+    piped into `cryptsetup`. This allows to use any program that can output
+    the password to decrypt the device.
+
+    Instead of a path, the device can be given by UUID or as `UUID=...`,
+    `LABEL=...` or `PARTUUID=...`. Refer to `DeviceInventory` for details.
+
+    If `key_cache` is given, the device is first opened with the volume key
+    cached in the kernel keyring by an earlier call, which skips both `pass_cmd`
+    and the key derivation. If there is no such key, the device is opened with
+    `pass_cmd` and its volume key is cached for `key_cache.ttl` seconds. Refer to
+    `VolumeKeyCache` for the requirements.
+
+    If `allow_discards` is true, discard requests, e.g. from `trim_filesystem`,
+    are passed on to `device`. This might reveal which blocks are unused.
+
+    Note that pass_cmd will directly be executed in a subshell. Therefore, DO NOT
+    USE UNTRUSTED `pass_cmd`!
+
+    Parameters:
+    -----------
+    device
+        The device to be opened, or its identifier.
+    pass_cmd
+        The command that outputs the password to decrypt the device.
+    key_cache
+        settings for caching the volume key in the kernel keyring
+    allow_discards
+        whether to pass discard requests on to `device`
+
+    Raises:
+    -------
+    shell_interface.PassCmdError
+        if the password command returns a non-zero exit code
+    DeviceDecryptionError
+        if cryptsetup returns a non-zero exit code
+    DeviceNotFoundError
+        if no device carries the given identifier
+    """
+    from ._inventory import resolve_device  # noqa: PLC0415
+
+    device = resolve_device(device)
+    map_name = device.name
+    options = ["--allow-discards"] if allow_discards else []
+    try:
+        if key_cache is None:
+            decrypt_cmd: sh.StrPathList = ["sudo", "cryptsetup", "open", *options]
+            decrypt_cmd.extend([device, map_name])
+            _pipe_pass_cmd_to_real_cmd(pass_cmd, decrypt_cmd)
+        else:
+            _open_with_key_cache(device, map_name, pass_cmd, key_cache, options)
+    except sh.ShellInterfaceError as e:
+        raise DeviceDecryptionError from e
+    return Path("/dev/mapper/") / map_name
+
+
+def _open_with_key_cache(
+    device: Path,
+    map_name: str,
+    pass_cmd: str,
+    key_cache: VolumeKeyCache,
+    options: list[str],
+) -> None:
+    luks_uuid = _luks_uuid(device)
+    key = _volume_key_spec(luks_uuid)
+    base_cmd: sh.StrPathList = ["sudo", "cryptsetup", "open", *options]
+    cached_cmd = [*base_cmd, "--volume-key-keyring", key, device, map_name]
+    try:
+        _run_cmd(cached_cmd)
+    except sh.ShellInterfaceError:
+        logger.info(
+            "Kein gültiger Schlüssel für {device} im Schlüsselbund.", device=device
+        )
+    else:
+        logger.info(
+            "Speichermedium {device} mit zwischengespeichertem Schlüssel geöffnet.",
+            device=device,
+        )
+        return
+    link = f"{key_cache.keyring}::{key}"
+    link_cmd = [*base_cmd, "--link-vk-to-keyring", link, device, map_name]
+    _pipe_pass_cmd_to_real_cmd(pass_cmd, link_cmd)
+    # The key only exists after opening, so its expiry can only be set afterwards.
+    timeout_cmd: sh.StrPathList = ["sudo", "keyctl", "timeout", key, str(key_cache.ttl)]
+    try:
+        _run_cmd(timeout_cmd)
+    except sh.ShellInterfaceError as timeout_error:
+        _undo_open(map_name, luks_uuid, timeout_error)
+        raise
+
+
+def _undo_open(map_name: str, luks_uuid: UUID, error: Exception) -> None:
+    """Revoke the volume key without expiry and close the mapping again"""
+    logger.warning(
+        "Ablaufzeit des Schlüssels für {map_name} nicht gesetzt: {error}",
+        map_name=map_name,
+        error=error,
+    )
+    _revoke_volume_key(luks_uuid)
+    close_cmd: sh.StrPathList = ["sudo", "cryptsetup", "close", map_name]
+    try:
+        _run_cmd(close_cmd)
+    except sh.ShellInterfaceError as close_error:
+        raise error from close_error
+
+
+def _luks_uuid(device: Path) -> UUID:
+    cmd: sh.StrPathList = ["sudo", "cryptsetup", "luksUUID", device]
+    return UUID(_run_cmd(cmd, capture_output=True).stdout.decode().strip())
+
+
+def _mapping_luks_uuid(map_name: str) -> UUID:
+    cmd: sh.StrPathList = [
+        "sudo",
+        "dmsetup",
+        "info",
+        "-c",
+        "--noheadings",
+        "-o",
+        "uuid",
+        map_name,
+    ]
+    dm_uuid = _run_cmd(cmd, capture_output=True).stdout.decode().strip()
+    match = _DM_CRYPT_UUID.match(dm_uuid)
+    if match is None:
+        raise InvalidDecryptedDevice(f"{map_name} is no dm-crypt mapping!")
+    return UUID(hex=match[1])
+
+
+def _volume_key_spec(luks_uuid: UUID) -> str:
+    return f"%user:{_KEY_DESCRIPTION_PREFIX}{luks_uuid}"
+
+
+def close_decrypted_device(device: Path, *, revoke_key: bool = False) -> None:
+    """Close a decrypted device
+
+    This function will try to close a device that was previously opened by
+    `cryptsetup`. The given path must point into `/dev/mapper`, because
+    `cryptsetup` always opens devices into there. If the given path points
+    somewhere else, a InvalidDecryptedDevice is raised.
+
+    If `revoke_key` is true, a volume key cached via `VolumeKeyCache` is revoked,
+    so that the device cannot be opened without password anymore.
+
+    Parameters:
+    -----------
+    device
+        The device do be closed.
+    revoke_key
+        whether to revoke the volume key cached in the kernel keyring
+
+    Raises:
+    -------
+    InvalidDecryptedDevice
+        if `device` does not point into `/dev/mapper`
+    shell_interface.ShellInterfaceError
+        if the exit code of the close command is non-zero
+    """
+    if device.parent != Path("/dev/mapper"):
+        raise InvalidDecryptedDevice
+    map_name = device.name
+    luks_uuid = _mapping_luks_uuid(map_name) if revoke_key else None
+    close_cmd: sh.StrPathList = ["sudo", "cryptsetup", "close", map_name]
+    _run_cmd(close_cmd)
+    if luks_uuid is not None:
+        _revoke_volume_key(luks_uuid)
+
+
+def _revoke_volume_key(luks_uuid: UUID) -> None:
+    revoke_cmd: sh.StrPathList = [
+        "sudo",
+        "keyctl",
+        "revoke",
+        _volume_key_spec(luks_uuid),
+    ]
+    try:
+        _run_cmd(revoke_cmd)
+    except sh.ShellInterfaceError:
+        # Without a cached key, the aimed for state has been reached already.
+        logger.info(
+            "Kein Schlüssel für LUKS-UUID {uuid} im Schlüsselbund.", uuid=luks_uuid
+        )
+
+
+def encrypt_device(device: Path, password_cmd: str) -> UUID:
+    """Encrypt a device
+
+    This function will encrypt a device. The device can be any valid file-like
+    object like real devices in `/dev/` or suitably sized files in $HOME.
+
+    In order to retrieve the necessary password, the input `password_cmd` is
+    executed in a subshell and its STDOUT used as password. Therefore, DO NOT
+    USE UNTRUSTED `password_cmd`!
+
+    In order to obtain a safe password_cmd, refer to `generate_passcmd`.
+
+    Parameters:
+    -----------
+    device
+        file-like object to be encrypted
+    password_cmd
+        Shell command that prints the password to be used to STDOUT
+
+    Returns:
+    --------
+    UUID
+        UUID of the new LUKS partition
+
+    Raises:
+    -------
+    shell_interface.PassCmdError
+        if the password command returns a non-zero exit code
+    shell_interface.ShellInterfaceError
+        if the cryptsetup command returns a non-zero exit code
+    """
+    new_uuid = uuid4()
+    format_cmd: sh.StrPathList = [
+        "sudo",
+        "cryptsetup",
+        "luksFormat",
+        "--uuid",
+        str(new_uuid),
+        device,
+    ]
+    _pipe_pass_cmd_to_real_cmd(password_cmd, format_cmd)
+    return new_uuid
+
+
+def generate_passcmd() -> str:
+    """
+    Generate `echo` safe password and return PassCmd
+
+    Returns
+    -------
+    str
+        password command producing the password
+    """
+    n_chars = 16
+    alphabet = string.ascii_letters + string.digits
+    passphrase = "".join(secrets.choice(alphabet) for _ in range(n_chars))
+    return f"echo {passphrase}"
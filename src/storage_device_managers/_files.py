@@ -0,0 +1,285 @@
+import contextlib
+import os
+import tempfile
+import typing as t
+from collections.abc import Iterator
+from pathlib import Path
+
+import shell_interface as sh
+
+from ._backend import _run_cmd
+from ._log import logger
+from ._types import UnmountError
+
+_RUN_DIR_NAME = "storage-device-managers"
+_RUN_DIR = Path("/run") / _RUN_DIR_NAME
+
+
+@contextlib.contextmanager
+def temporary_directory(
+    base_dir: Path | None = None, name: str | None = None
+) -> Iterator[Path]:
+    """Create a temporary directory
+
+    This context manager will create a temporary directory and return its path.
+    Upon exit, the directory is removed again.
+
+    If `name` is given, the directory gets this name instead of a random one. If
+    the directory exists already, it is reused, provided it is an empty directory
+    and not a mount point. This allows to reuse mount points left over by
+    previous runs.
+
+    In any case, the directory is only removed if it is empty. Its content is
+    never deleted.
+
+    Parameters:
+    -----------
+    base_dir
+        directory in which to create the temporary directory; defaults to the
+        directory used by `tempfile`
+    name
+        name of the temporary directory
+
+    Returns:
+    --------
+    Path
+        path to the created temporary directory
+
+    Raises:
+    -------
+    ValueError
+        if `name` is not a plain file name
+    FileExistsError
+        if a directory with the given name exists and is not empty, or exists but
+        is no directory
+    """
+    if name is None:
+        tmpdir = Path(tempfile.mkdtemp(dir=base_dir))
+    else:
+        tmpdir = _claim_directory(base_dir or Path(tempfile.gettempdir()), name)
+    try:
+        yield tmpdir
+    except UnmountError:
+        # In case unmounting fails, the mount directory cannot be removed, because it is
+        # "busy". There is no use in trying to do `mount_dir.rmdir()`.
+        raise
+    except Exception:
+        tmpdir.rmdir()
+        raise
+    # Try to remove the mount directory. Path.rmdir() will only succeed if the directory
+    # is empty, so if anything happened, mount_dir's contents will not be silently
+    # deleted. Previously, shutil.rmtree was used implicitly via TemporaryDirectory,
+    # which caused the loss of two terabytes of backup data when unmounting failed.
+    tmpdir.rmdir()
+
+
+def _claim_directory(base_dir: Path, name: str) -> Path:
+    if name in ("", ".", "..") or os.sep in name:
+        raise ValueError(f"Directory name {name!r} is not a plain file name!")
+    base_dir.mkdir(parents=True, exist_ok=True)
+    directory = base_dir / name
+    try:
+        directory.mkdir(mode=0o700)
+    except FileExistsError:
+        if not _is_reusable(directory):
+            raise
+        logger.info(
+            "Leeres Verzeichnis {directory} wird wiederverwendet.", directory=directory
+        )
+    return directory
+
+
+def _is_reusable(directory: Path) -> bool:
+    if directory.is_symlink() or not directory.is_dir() or os.path.ismount(directory):
+        return False
+    with os.scandir(directory) as entries:
+        return next(entries, None) is None
+
+
+def _default_mount_base() -> Path | None:
+    candidates = [_RUN_DIR]
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        candidates.append(Path(runtime_dir) / _RUN_DIR_NAME)
+    for candidate in candidates:
+        try:
+            candidate.mkdir(exist_ok=True)
+        except OSError:
+            continue
+        if os.access(candidate, os.W_OK | os.X_OK):
+            return candidate
+    return None
+
+
+@contextlib.contextmanager
+def symbolic_link(src: Path, dest: Path) -> Iterator[Path]:
+    """Create a symbolic link from `src` to `dest`
+
+    This context manager will create a symbolic link from src to dest. It
+    differentiates itself from `Path.link_to()` by …:
+
+        * … creating the link with root privileges if necessary. This allows to
+          limit root permissions to only the necessary parts of the program. If
+          the parent directory of `dest` is writable, no privileges are requested.
+
+        * … ensuring that the link gets removed after usage.
+
+    Parameters:
+    -----------
+    src: Path to source; can be anything that has a filesystem path
+    dest: Path to destination file
+
+    Returns:
+    --------
+    Path
+        The value of `dest.absolute()` will be returned.
+    """
+
+    with symbolic_links({dest: src}) as links:
+        logger.success(
+            "Symlink von {src} nach {dest} erfolgreich erstellt.", src=src, dest=dest
+        )
+        yield links[0]
+    logger.success(
+        "Symlink von {src} nach {dest} erfolgreich entfernt.", src=src, dest=dest
+    )
+
+
+@contextlib.contextmanager
+def symbolic_links(links: t.Mapping[Path, Path]) -> Iterator[list[Path]]:
+    """Create several symbolic links at once
+
+    This context manager behaves like `symbolic_link` for every pair of `links`,
+    which maps destinations to their sources. Links are created without root
+    privileges where possible. All links that require root privileges are created
+    by one privileged command, so that many links cost at most one escalation.
+
+    Creation is all or nothing: If any link cannot be created, the links created
+    so far are removed again before the error is propagated. Upon exit, all links
+    are removed, again using at most one privileged command.
+
+    Parameters:
+    -----------
+    links
+        mapping from link destinations to the paths they point to
+
+    Returns:
+    --------
+    list[Path]
+        absolute destinations, in the order of `links`
+
+    Raises:
+    -------
+    FileNotFoundError
+        if any source does not exist
+    FileExistsError
+        if any destination exists already
+    shell_interface.ShellInterfaceError
+        if the privileged command fails
+    """
+    pairs = [(src.absolute(), dest.absolute()) for dest, src in links.items()]
+    for src, dest in pairs:
+        if not src.exists():
+            raise FileNotFoundError(src)
+        if os.path.lexists(dest):
+            raise FileExistsError(dest)
+    try:
+        _create_links(pairs)
+    except BaseException:
+        _remove_links([dest for src, dest in pairs if _points_to(dest, src)])
+        raise
+    logger.info("{n_links} Symlinks erstellt.", n_links=len(pairs))
+    try:
+        yield [dest for _, dest in pairs]
+    finally:
+        # In case link destinations vanished, the program must not crash. After
+        # all, the aimed for state has been reached.
+        _remove_links([dest for _, dest in pairs])
+        logger.info("{n_links} Symlinks entfernt.", n_links=len(pairs))
+
+
+def _create_links(pairs: list[tuple[Path, Path]]) -> None:
+    for idx, (src, dest) in enumerate(pairs):
+        try:
+            os.symlink(src, dest)
+        except PermissionError:
+            _create_links_privileged(pairs[idx:])
+            return
+
+
+def _create_links_privileged(pairs: list[tuple[Path, Path]]) -> None:
+    if len(pairs) == 1:
+        ln_cmd: sh.StrPathList = ["sudo", "ln", "-s", *pairs[0]]
+    else:
+        args = [path for pair in pairs for path in pair]
+        ln_cmd = ["sudo", "sh", "-c", _LN_PAIRS_SCRIPT, "sh", *args]
+    _run_cmd(ln_cmd)
+
+
+# Creates links for pairs of positional arguments and stops at the first failure.
+_LN_PAIRS_SCRIPT = 'while [ "$#" -gt 0 ]; do ln -s -- "$1" "$2" || exit; shift 2; done'
+
+
+def _remove_links(dests: list[Path]) -> None:
+    privileged = []
+    for dest in dests:
+        try:
+            os.unlink(dest)
+        except FileNotFoundError:
+            pass
+        except PermissionError:
+            privileged.append(dest)
+    if privileged:
+        rm_cmd: sh.StrPathList = ["sudo", "rm", "-f", "--", *privileged]
+        _run_cmd(rm_cmd)
+
+
+def _points_to(link: Path, target: Path) -> bool:
+    return link.is_symlink() and Path(os.readlink(link)) == target
+
+
+def chown(
+    file_or_folder: Path,
+    /,
+    user: int | str,
+    group: int | str | None = None,
+    *,
+    recursive: bool,
+) -> None:
+    """Change user and group of a device or folder
+
+    This function will change the ownership as specified. It requires root
+    privileges and will ask for them if not available. If no group is given,
+    only the owner is changed.
+
+    If recursive is true, ownership information of all files and folders
+    contained by `file_or_folder` will be adapted.
+
+    If `file_or_folder` points to a file, `recursive` must be `False`.
+    Otherwise a ValueError will be raised.
+
+
+    Parameters:
+    -----------
+    user
+        user ID, either as name or as UID
+    group
+        group ID, either as name or as GID
+    recursive
+        whether or not to change ownership for content
+
+    Raises:
+    --------
+    ValueError
+        if `file_or_folder` is a file but `recursive` is `True`
+    """
+    if file_or_folder.is_file() and recursive:
+        raise ValueError(
+            "First argument must point to a directory if `recursive` is `True`!"
+        )
+
+    user_spec = str(user) if group is None else f"{user}:{group}"
+    chown_cmd: sh.StrPathList = ["sudo", "chown", user_spec, file_or_folder]
+    if recursive:
+        chown_cmd.append("--recursive")
+    _run_cmd(chown_cmd)
@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import typing as t
+from pathlib import Path
+
+from ._backend import _run_cmd
+from ._operation import _FILESYSTEM_CACHE, _cached
+from ._types import (
+    BtrfsMkfsOptions,
+    ChecksumAlgorithms,
+    Devices,
+    Ext4MkfsOptions,
+    MkfsOptions,
+    MkfsProfiles,
+    ValidFileSystems,
+    _as_device_list,
+)
+
+if t.TYPE_CHECKING:
+    import shell_interface as sh
+
+_BTRFS_PROFILES: t.Final[t.Mapping[MkfsProfiles, BtrfsMkfsOptions]] = {
+    MkfsProfiles.FAST_PROVISION: BtrfsMkfsOptions(
+        nodiscard=True, block_group_tree=True
+    ),
+    MkfsProfiles.LARGE_FILES: BtrfsMkfsOptions(
+        checksum=ChecksumAlgorithms.XXHASH, block_group_tree=True
+    ),
+}
+_EXT4_PROFILES: t.Final[t.Mapping[MkfsProfiles, Ext4MkfsOptions]] = {
+    MkfsProfiles.FAST_PROVISION: Ext4MkfsOptions(
+        lazy_itable_init=False, lazy_journal_init=False, nodiscard=True
+    ),
+    MkfsProfiles.LARGE_FILES: Ext4MkfsOptions(
+        lazy_itable_init=True, bytes_per_inode=1024**2
+    ),
+}
+
+
+def get_filesystem(device: Path) -> str:
+    """Get the file system type of a given device or path
+
+    This function will query the file system type of the given device using
+    `blkid`.
+
+    Parameters:
+    -----------
+    device
+        file-like object whose file system type to determine
+
+    Returns:
+    --------
+    str
+        the file system type (e.g. ``"btrfs"`` or ``"ext4"``)
+    """
+    return _cached(_FILESYSTEM_CACHE, str(device), lambda: _query_filesystem(device))
+
+
+def _query_filesystem(device: Path) -> str:
+    cmd: sh.StrPathList = ["sudo", "blkid", "-o", "value", "-s", "TYPE", device]
+    result = _run_cmd(cmd, capture_output=True)
+    return result.stdout.decode().strip()
+
+
+def _btrfs_mkfs_args(options: BtrfsMkfsOptions) -> list[str]:
+    args: list[str] = []
+    valued_flags = [
+        ("--label", options.label),
+        ("--uuid", options.uuid),
+        ("--nodesize", options.nodesize),
+        ("--sectorsize", options.sectorsize),
+        ("--csum", options.checksum),
+        ("--data", options.data_profile),
+        ("--metadata", options.metadata_profile),
+    ]
+    for flag, value in valued_flags:
+        if value is not None:
+            args.extend([flag, str(value)])
+    if options.nodiscard:
+        args.append("--nodiscard")
+    if options.block_group_tree:
+        args.extend(["--features", "block-group-tree"])
+    return args
+
+
+def _ext4_mkfs_args(options: Ext4MkfsOptions) -> list[str]:
+    args: list[str] = []
+    valued_flags = [
+        ("-L", options.label),
+        ("-U", options.uuid),
+        ("-i", options.bytes_per_inode),
+    ]
+    for flag, value in valued_flags:
+        if value is not None:
+            args.extend([flag, str(value)])
+    if not options.journal:
+        args.extend(["-O", "^has_journal"])
+    extended = [
+        f"{name}={int(value)}"
+        for name, value in [
+            ("lazy_itable_init", options.lazy_itable_init),
+            ("lazy_journal_init", options.lazy_journal_init),
+            ("stride", options.stride),
+            ("stripe_width", options.stripe_width),
+        ]
+        if value is not None
+    ]
+    if options.nodiscard:
+        extended.append("nodiscard")
+    if extended:
+        args.extend(["-E", ",".join(extended)])
+    return args
+
+
+def mkfs_btrfs(
+    device: Devices, options: BtrfsMkfsOptions | MkfsProfiles | None = None
+) -> None:
+    """Format device with BtrFS
+
+    If multiple devices are given, a single file system spanning all of them is
+    created. How data and metadata are distributed over the devices is controlled by
+    the `data_profile` and `metadata_profile` options.
+
+    Parameters:
+    -----------
+    device
+        file-like object or objects to be formatted
+    options
+        options for `mkfs.btrfs`, either explicitly or as named profile
+
+    Raises:
+    -------
+    TypeError
+        if `options` are not meant for BtrFS
+    """
+    if options is None:
+        options = BtrfsMkfsOptions()
+    elif isinstance(options, MkfsProfiles):
+        options = _BTRFS_PROFILES[options]
+    elif not isinstance(options, BtrfsMkfsOptions):
+        raise TypeError(f"Options {options} cannot be used for BtrFS!")
+    cmd: sh.StrPathList = [
+        "sudo",
+        "mkfs.btrfs",
+        *_btrfs_mkfs_args(options),
+        *_as_device_list(device),
+    ]
+    _run_cmd(cmd)
+
+
+def mkfs_ext4(
+    device: Path, options: Ext4MkfsOptions | MkfsProfiles | None = None
+) -> None:
+    """Format device with ext4
+
+    Parameters:
+    -----------
+    device
+        file-like object to be formatted
+    options
+        options for `mkfs.ext4`, either explicitly or as named profile
+
+    Raises:
+    -------
+    TypeError
+        if `options` are not meant for ext4
+    """
+    if options is None:
+        options = Ext4MkfsOptions()
+    elif isinstance(options, MkfsProfiles):
+        options = _EXT4_PROFILES[options]
+    elif not isinstance(options, Ext4MkfsOptions):
+        raise TypeError(f"Options {options} cannot be used for ext4!")
+    cmd: sh.StrPathList = ["sudo", "mkfs.ext4", *_ext4_mkfs_args(options), device]
+    _run_cmd(cmd)
+
+
+def mkfs(
+    device: Path,
+    filesystem: ValidFileSystems,
+    options: MkfsOptions | MkfsProfiles | None = None,
+) -> None:
+    """Format device with the given file system
+
+    This function formats the given device with the specified file system,
+    so the caller does not need to branch on the file system type themselves.
+
+    Named profiles are translated into the options of the respective file system.
+    Explicit options must match `filesystem`.
+
+    Parameters:
+    -----------
+    device
+        file-like object to be formatted
+    filesystem
+        the file system to use for formatting
+    options
+        options for the `mkfs` program, either explicitly or as named profile
+
+    Raises:
+    -------
+    TypeError
+        if `options` are not meant for `filesystem`
+    """
+    match filesystem:
+        case "btrfs":
+            if isinstance(options, Ext4MkfsOptions):
+                raise TypeError(f"Options {options} cannot be used for BtrFS!")
+            mkfs_btrfs(device, options)
+        case "ext4":
+            if isinstance(options, BtrfsMkfsOptions):
+                raise TypeError(f"Options {options} cannot be used for ext4!")
+            mkfs_ext4(device, options)
+        case _:
+            t.assert_never(filesystem)
@@ -0,0 +1,228 @@
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import typing as t
+from pathlib import Path
+from uuid import uuid4
+
+import shell_interface as sh
+
+from ._backend import _pipe_pass_cmd_to_real_cmd, _run_cmd
+from ._crypt import decrypted_device, encrypt_device
+from ._filesystems import mkfs
+from ._instrumentation import _instrumented
+from ._log import logger
+from ._types import ValidFileSystems
+
+# From linux/fs.h: _IOW(0x94, 9, int)
+_FICLONE = 0x40049409
+# Errors of copy_file_range between different file systems or where unsupported
+_NO_COPY_FILE_RANGE = frozenset({errno.EXDEV, errno.EOPNOTSUPP, errno.ENOSYS})
+_COPY_CHUNK_SIZE = 1024**2
+# Commands giving the file system on the appended device a new random UUID
+_NEW_UUID_CMDS: t.Final[t.Mapping[ValidFileSystems, list[str]]] = {
+    "btrfs": ["btrfstune", "-f", "-u"],
+    "ext4": ["tune2fs", "-U", "random"],
+}
+
+
+def provision_image(
+    dest: Path,
+    size: int,
+    filesystem: ValidFileSystems | None = None,
+    *,
+    pass_cmd: str | None = None,
+    cache_dir: Path | None = None,
+) -> Path:
+    """Create a sparse image file, optionally encrypted and formatted
+
+    This function creates an image file of the given size at `dest`. If
+    `pass_cmd` is given, the image is encrypted using `encrypt_device`. If
+    `filesystem` is given, the image (or its decrypted content) is formatted
+    using `mkfs`.
+
+    Encrypting and formatting is slow. Therefore, each distinct combination of
+    arguments is prepared only once as golden template in `cache_dir`. All
+    further images are cloned from that template. On file systems supporting
+    reflinks (e.g. BtrFS or XFS), cloning takes constant time and space.
+    Elsewhere, only the parts of the template that contain data are copied,
+    keeping the clone sparse. This works across file systems, so `cache_dir` and
+    `dest` may reside on different ones.
+
+    Templates are keyed by a SHA-256 digest of size, file system and `pass_cmd`.
+    As the digest of a short `pass_cmd` can be brute-forced, `cache_dir` is
+    created accessible by its owner only. An encrypted template is only reused if
+    the password printed by `pass_cmd` still opens it. Otherwise, it is replaced
+    by a new template.
+
+    Each clone gets new UUIDs for its LUKS header and file system, so that clones
+    can be told apart, e.g. by `resolve_device`, and several BtrFS clones can be
+    used at the same time. For an encrypted clone, this requires opening it once.
+    Encrypted clones still share the LUKS volume key, so whoever obtains the
+    volume key of one clone, e.g. from a LUKS header backup or the kernel keyring,
+    can decrypt all of them. Changing the password of a clone does not change its
+    volume key. Hence, encrypted clones are meant for tests and scratch space, not
+    for data that must stay confidential independently of the other clones.
+
+    Parameters:
+    -----------
+    dest
+        path of the image; must not exist or be empty
+    size
+        size of the image in bytes
+    filesystem
+        file system to create in the image
+    pass_cmd
+        command that prints the password to encrypt the image with
+    cache_dir
+        directory of the golden templates; defaults to a directory in
+        `$XDG_CACHE_HOME`
+
+    Returns:
+    --------
+    Path
+        the value of `dest`
+
+    Raises:
+    -------
+    FileExistsError
+        if `dest` exists and is not empty
+    """
+    if dest.exists() and dest.stat().st_size > 0:
+        raise FileExistsError
+    if cache_dir is None:
+        cache_home = os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")
+        cache_dir = Path(cache_home) / "storage-device-managers" / "images"
+    cache_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+    key = json.dumps([size, filesystem, pass_cmd])
+    template = cache_dir / f"{hashlib.sha256(key.encode()).hexdigest()}.img"
+    if not template.exists() or not _opens_template(template, pass_cmd):
+        _create_template(template, size, filesystem, pass_cmd)
+        logger.info("Vorlage {template} erfolgreich erstellt.", template=template)
+    _clone_file(template, dest)
+    _regenerate_uuids(dest, filesystem, pass_cmd)
+    return dest
+
+
+def _opens_template(template: Path, pass_cmd: str | None) -> bool:
+    if pass_cmd is None:
+        return True
+    test_cmd: sh.StrPathList = [
+        "sudo",
+        "cryptsetup",
+        "open",
+        "--test-passphrase",
+        template,
+    ]
+    try:
+        _pipe_pass_cmd_to_real_cmd(pass_cmd, test_cmd)
+    except sh.ShellInterfaceError:
+        return False
+    return True
+
+
+def _create_template(
+    template: Path,
+    size: int,
+    filesystem: ValidFileSystems | None,
+    pass_cmd: str | None,
+) -> None:
+    fd, name = tempfile.mkstemp(dir=template.parent, suffix=".partial")
+    partial = Path(name)
+    try:
+        os.ftruncate(fd, size)
+        os.close(fd)
+        if pass_cmd is not None:
+            encrypt_device(partial, pass_cmd)
+        if filesystem is not None and pass_cmd is not None:
+            with decrypted_device(partial, pass_cmd) as decrypted:
+                mkfs(decrypted, filesystem)
+        elif filesystem is not None:
+            mkfs(partial, filesystem)
+    except BaseException:
+        partial.unlink()
+        raise
+    # Concurrent creators of the same template are harmless, as the rename is atomic.
+    partial.replace(template)
+
+
+def _regenerate_uuids(
+    image: Path, filesystem: ValidFileSystems | None, pass_cmd: str | None
+) -> None:
+    if pass_cmd is not None:
+        luks_cmd: sh.StrPathList = [
+            "sudo",
+            "cryptsetup",
+            "luksUUID",
+            "--uuid",
+            str(uuid4()),
+            image,
+        ]
+        _run_cmd(luks_cmd)
+    if filesystem is None:
+        return
+    if pass_cmd is None:
+        _run_cmd(["sudo", *_NEW_UUID_CMDS[filesystem], image])
+        return
+    with decrypted_device(image, pass_cmd) as decrypted:
+        _run_cmd(["sudo", *_NEW_UUID_CMDS[filesystem], decrypted])
+
+
+def _clone_file(src: Path, dest: Path) -> None:
+    with src.open("rb") as src_fh, dest.open("wb") as dest_fh:
+        try:
+            with _instrumented(["ioctl FICLONE", dest]):
+                fcntl.ioctl(dest_fh.fileno(), _FICLONE, src_fh.fileno())
+        except OSError:
+            with _instrumented(["copy_file_range", dest]) as measurement:
+                measurement.bytes_written = _copy_sparse(
+                    src_fh.fileno(), dest_fh.fileno()
+                )
+
+
+def _copy_sparse(src_fd: int, dest_fd: int) -> int:
+    size = os.fstat(src_fd).st_size
+    os.ftruncate(dest_fd, size)
+    offset = 0
+    copied = 0
+    while offset < size:
+        try:
+            data_start = os.lseek(src_fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            # ENXIO signals that there is no data after `offset`.
+            if e.errno == errno.ENXIO:
+                break
+            raise
+        data_end = os.lseek(src_fd, data_start, os.SEEK_HOLE)
+        _copy_range(src_fd, dest_fd, data_start, data_end)
+        copied += data_end - data_start
+        offset = data_end
+    return copied
+
+
+def _copy_range(src_fd: int, dest_fd: int, start: int, end: int) -> None:
+    position = start
+    while position < end:
+        try:
+            copied = os.copy_file_range(
+                src_fd, dest_fd, end - position, position, position
+            )
+        except OSError as e:
+            if e.errno not in _NO_COPY_FILE_RANGE:
+                raise
+            length = min(end - position, _COPY_CHUNK_SIZE)
+            copied = _copy_chunk(src_fd, dest_fd, position, length)
+        if copied == 0:
+            return
+        position += copied
+
+
+def _copy_chunk(src_fd: int, dest_fd: int, position: int, length: int) -> int:
+    data = os.pread(src_fd, length, position)
+    written = 0
+    while written < len(data):
+        written += os.pwrite(dest_fd, data[written:], position + written)
+    return len(data)
@@ -0,0 +1,225 @@
+import contextlib
+import dataclasses
+import json
+import sys
+import threading
+import time
+import typing as t
+from collections import defaultdict
+from collections.abc import Iterator, Sequence
+from pathlib import Path
+from types import FrameType
+
+from ._types import CommandEvent, InstrumentationHook
+
+_instrumentation_hooks: list[InstrumentationHook] = []
+_instrumentation_lock = threading.Lock()
+# Programs whose first arguments name a subcommand, and how many of them.
+_SUBCOMMAND_DEPTHS: t.Final[t.Mapping[str, int]] = {
+    "btrfs": 2,
+    "cryptsetup": 1,
+    "dmsetup": 1,
+    "keyctl": 1,
+}
+# The public functions of the package are implemented in its private submodules.
+_SUBMODULE_PREFIX = f"{__package__}._"
+_DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+@contextlib.contextmanager
+def instrumentation(hook: InstrumentationHook) -> Iterator[InstrumentationHook]:
+    """Report every command and costly system call of this package to `hook`
+
+    While this context manager is active, `hook` is called with a CommandEvent
+    after each command executed by this package, including failed ones. Hooks are
+    called synchronously, from the thread that executed the command. Hence, they
+    should be fast and thread-safe. `CommandHistogram` and `JsonLinesExporter`
+    are ready-made hooks.
+
+    Without any hook registered, commands are not measured at all.
+
+    Parameters:
+    -----------
+    hook
+        callable receiving the events
+
+    Returns:
+    --------
+    InstrumentationHook
+        the given hook
+    """
+    with _instrumentation_lock:
+        _instrumentation_hooks.append(hook)
+    try:
+        yield hook
+    finally:
+        with _instrumentation_lock:
+            _instrumentation_hooks.remove(hook)
+
+
+@dataclasses.dataclass
+class _Measurement:
+    bytes_written: int | None = None
+
+
+@contextlib.contextmanager
+def _instrumented(argv: Sequence[str | Path]) -> Iterator[_Measurement]:
+    measurement = _Measurement()
+    if not _instrumentation_hooks:
+        yield measurement
+        return
+    operation = _public_caller()
+    start = time.time()
+    clock = time.perf_counter()
+    exit_code: int | None = 0
+    try:
+        yield measurement
+    except Exception as e:
+        exit_code = getattr(e.__cause__, "returncode", None)
+        raise
+    finally:
+        event = CommandEvent(
+            operation=operation,
+            command=_command_class(argv),
+            device=next((str(arg) for arg in argv if isinstance(arg, Path)), None),
+            start=start,
+            seconds=time.perf_counter() - clock,
+            exit_code=exit_code,
+            bytes_written=measurement.bytes_written,
+        )
+        with _instrumentation_lock:
+            hooks = list(_instrumentation_hooks)
+        for hook in hooks:
+            hook(event)
+
+
+def _public_caller() -> str:
+    frame: FrameType | None = sys._getframe(1)
+    while frame is not None:
+        name = frame.f_code.co_name
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith(_SUBMODULE_PREFIX) and name[0] not in "_<":
+            return name
+        frame = frame.f_back
+    return "unknown"
+
+
+def _command_class(argv: Sequence[str | Path]) -> str:
+    args = [str(arg) for arg in argv]
+    if args[:1] == ["sudo"]:
+        args = args[1:]
+    program = Path(args[0]).name
+    depth = _SUBCOMMAND_DEPTHS.get(program, 0)
+    return " ".join([program, *args[1 : depth + 1]])
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class CommandHistogram:
+    """In-memory histogram of command durations
+
+    Instances are meant to be passed to `instrumentation`. Events are grouped by
+    operation and command class. For each group, the distribution of durations,
+    the number of failures and the bytes written are recorded.
+
+    Parameters:
+    -----------
+    buckets
+        upper bounds of the histogram buckets in seconds
+    """
+
+    def __init__(self, buckets: Sequence[float] = _DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._bucket_counts: dict[tuple[str, str], list[int]] = {}
+        self._sums: dict[tuple[str, str], float] = defaultdict(float)
+        self._failures: dict[tuple[str, str], int] = defaultdict(int)
+        self._bytes_written: dict[tuple[str, str], int] = defaultdict(int)
+
+    def __call__(self, event: CommandEvent) -> None:
+        key = (event.operation, event.command)
+        with self._lock:
+            counts = self._bucket_counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            for idx, bound in enumerate(self.buckets):
+                if event.seconds <= bound:
+                    counts[idx] += 1
+            counts[-1] += 1
+            self._sums[key] += event.seconds
+            self._failures[key] += event.exit_code != 0
+            self._bytes_written[key] += event.bytes_written or 0
+
+    def count(self, operation: str, command: str) -> int:
+        """Number of events recorded for the given operation and command"""
+        with self._lock:
+            return self._bucket_counts.get((operation, command), [0])[-1]
+
+    def to_prometheus(self) -> str:
+        """Render the histogram in the Prometheus text exposition format
+
+        Durations, failures and bytes written are rendered as separate metric
+        families, each with its own `HELP` and `TYPE` lines.
+        """
+        prefix = "storage_device_managers_command"
+        with self._lock:
+            keys = sorted(self._bucket_counts)
+            lines = [
+                f"# HELP {prefix}_duration_seconds Wall time of executed commands.",
+                f"# TYPE {prefix}_duration_seconds histogram",
+            ]
+            for key in keys:
+                lines.extend(self._histogram_lines(f"{prefix}_duration_seconds", key))
+            counters = [
+                ("failures_total", "Commands exiting non-zero.", self._failures),
+                (
+                    "written_bytes_total",
+                    "Bytes written by commands.",
+                    self._bytes_written,
+                ),
+            ]
+            for name, help_text, values in counters:
+                lines.append(f"# HELP {prefix}_{name} {help_text}")
+                lines.append(f"# TYPE {prefix}_{name} counter")
+                lines.extend(
+                    f"{prefix}_{name}{{{_labels(*key)}}} {values[key]}" for key in keys
+                )
+        return "\n".join(lines) + "\n"
+
+    def _histogram_lines(self, name: str, key: tuple[str, str]) -> list[str]:
+        labels = _labels(*key)
+        counts = self._bucket_counts[key]
+        lines = [
+            f'{name}_bucket{{{labels},le="{bound}"}} {count}'
+            for bound, count in zip(self.buckets, counts, strict=False)
+        ]
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {counts[-1]}')
+        lines.append(f"{name}_sum{{{labels}}} {self._sums[key]}")
+        lines.append(f"{name}_count{{{labels}}} {counts[-1]}")
+        return lines
+
+
+def _labels(operation: str, command: str) -> str:
+    return f'operation="{_escape_label(operation)}",command="{_escape_label(command)}"'
+
+
+class JsonLinesExporter:
+    """Write each event as one line of JSON to a text stream
+
+    Instances are meant to be passed to `instrumentation`.
+
+    Parameters:
+    -----------
+    stream
+        text stream to write to, e.g. an opened file or `sys.stderr`
+    """
+
+    def __init__(self, stream: t.TextIO) -> None:
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def __call__(self, event: CommandEvent) -> None:
+        line = json.dumps(dataclasses.asdict(event), separators=(",", ":"))
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
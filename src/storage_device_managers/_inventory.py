@@ -0,0 +1,302 @@
+import contextlib
+import os
+import re
+import socket
+import threading
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from uuid import UUID
+
+from ._log import logger
+from ._types import DeviceNotFoundError
+
+DeviceSpec = Path | UUID | str
+
+_DEV_DISK = Path("/dev/disk")
+_KINDS = {"UUID": "by-uuid", "LABEL": "by-label", "PARTUUID": "by-partuuid"}
+_UDEV_ESCAPE = re.compile(r"\\x([0-9a-fA-F]{2})")
+
+_NETLINK_KOBJECT_UEVENT = 15
+_UEVENT_KERNEL_GROUP = 1
+_UEVENT_BUFFER = 64 * 1024
+_UEVENT_POLL_INTERVAL = 0.2
+
+# Offsets of the on-disk superblocks, cf. the LUKS2 on-disk format specification,
+# `struct ext4_super_block` and `struct btrfs_super_block`.
+_LUKS_MAGIC = b"LUKS\xba\xbe"
+_LUKS_UUID = slice(168, 208)
+_LUKS2_LABEL = slice(24, 72)
+_EXT4_SUPERBLOCK = 1024
+_EXT4_MAGIC = b"\x53\xef"
+_BTRFS_SUPERBLOCK = 64 * 1024
+_BTRFS_MAGIC = b"_BHRfS_M"
+_PROBE_SIZE = _BTRFS_SUPERBLOCK + 4096
+
+Identifiers = dict[str, str]
+
+
+class DeviceInventory:
+    """Index of block devices by UUID, label and partition UUID
+
+    The index is built from the symbolic links udev maintains in
+    `/dev/disk/by-uuid`, `/dev/disk/by-label` and `/dev/disk/by-partuuid`. Files
+    that udev does not know about, e.g. images not attached to a loop device, can
+    be added via `probe`, which reads their LUKS, ext4 or BtrFS superblock.
+
+    The index is rebuilt lazily: on the first lookup, on lookups after
+    `max_age` seconds and whenever a lookup fails or yields a device that
+    vanished. While `watch` is active, kernel uevents of block devices update the
+    index as well.
+
+    Parameters:
+    -----------
+    max_age
+        seconds after which the index is rebuilt, or None to never rebuild it
+        periodically
+    """
+
+    def __init__(self, max_age: float | None = 30.0) -> None:
+        self.max_age = max_age
+        self._index: dict[tuple[str, str], Path] = {}
+        self._probed: dict[Path, Identifiers] = {}
+        self._scanned_at: float | None = None
+        self._lock = threading.Lock()
+
+    def resolve(self, spec: DeviceSpec) -> Path:
+        """Return the device identified by `spec`
+
+        Parameters:
+        -----------
+        spec
+            a path, which is returned as is, a UUID or a string in the notation
+            of fstab, i.e. `UUID=...`, `LABEL=...` or `PARTUUID=...`. Strings
+            without such prefix are treated as paths.
+
+        Returns:
+        --------
+        Path
+            path of the device
+
+        Raises:
+        -------
+        DeviceNotFoundError
+            if no device carries the given identifier
+        """
+        key = _parse_spec(spec)
+        if key is None:
+            return Path(str(spec))
+        with self._lock:
+            if self._is_stale():
+                self._rescan()
+            device = self._index.get(key)
+            if device is None or not device.exists():
+                self._rescan()
+                device = self._index.get(key)
+        if device is None:
+            raise DeviceNotFoundError(f"No device with {key[0]}={key[1]} found!")
+        return device
+
+    def rescan(self) -> None:
+        """Rebuild the index from `/dev/disk` and the probed files"""
+        with self._lock:
+            self._rescan()
+
+    def probe(self, *paths: Path) -> None:
+        """Add files or devices to the index by reading their superblock
+
+        Probed paths stay in the index and are probed again on every rescan,
+        until they vanish.
+
+        Raises:
+        -------
+        OSError
+            if a path cannot be read
+        """
+        identifiers = {Path(os.path.abspath(path)): _probe(path) for path in paths}
+        with self._lock:
+            self._probed.update(identifiers)
+            for path, ids in identifiers.items():
+                self._add(path, ids)
+
+    def identifiers(self, device: Path) -> Identifiers:
+        """Return the identifiers the index knows for `device`"""
+        target = Path(os.path.realpath(device))
+        with self._lock:
+            return {
+                kind: value
+                for (kind, value), dev in self._index.items()
+                if dev == target
+            }
+
+    @contextlib.contextmanager
+    def watch(self) -> Iterator["DeviceInventory"]:
+        """Update the index from kernel uevents while the context is active
+
+        Removed devices are dropped from the index right away. Added and changed
+        devices let the next lookup rebuild the index, since udev creates the
+        symbolic links only after the kernel announced the device.
+
+        Raises:
+        -------
+        OSError
+            if the netlink socket cannot be opened, e.g. outside of Linux
+        """
+        sock = socket.socket(
+            socket.AF_NETLINK, socket.SOCK_DGRAM, _NETLINK_KOBJECT_UEVENT
+        )
+        stop = threading.Event()
+        with sock:
+            sock.bind((0, _UEVENT_KERNEL_GROUP))
+            sock.settimeout(_UEVENT_POLL_INTERVAL)
+            thread = threading.Thread(
+                target=self._receive_uevents, args=(sock, stop), daemon=True
+            )
+            thread.start()
+            try:
+                yield self
+            finally:
+                stop.set()
+                thread.join()
+
+    def _receive_uevents(self, sock: socket.socket, stop: threading.Event) -> None:
+        while not stop.is_set():
+            try:
+                message = sock.recv(_UEVENT_BUFFER)
+            except TimeoutError:
+                continue
+            self._handle_uevent(message)
+
+    def _handle_uevent(self, message: bytes) -> None:
+        fields = (field.partition("=") for field in message.decode().split("\0"))
+        event = {key: value for key, sep, value in fields if sep}
+        if event.get("SUBSYSTEM") != "block" or "DEVNAME" not in event:
+            return
+        device = Path("/dev") / event["DEVNAME"]
+        with self._lock:
+            if event.get("ACTION") == "remove":
+                self._drop(device)
+                self._probed.pop(device, None)
+            else:
+                self._scanned_at = None
+
+    def _is_stale(self) -> bool:
+        if self._scanned_at is None:
+            return True
+        if self.max_age is None:
+            return False
+        return time.monotonic() - self._scanned_at > self.max_age
+
+    def _rescan(self) -> None:
+        self._index = _scan_dev_disk()
+        for path in list(self._probed):
+            try:
+                self._probed[path] = _probe(path)
+            except OSError:
+                del self._probed[path]
+                continue
+            self._add(path, self._probed[path])
+        self._scanned_at = time.monotonic()
+        logger.info(
+            "Geräteverzeichnis mit {n_entries} Einträgen aufgebaut.",
+            n_entries=len(self._index),
+        )
+
+    def _add(self, device: Path, identifiers: Identifiers) -> None:
+        self._drop(device)
+        for kind, value in identifiers.items():
+            self._index[kind, _normalise(kind, value)] = device
+
+    def _drop(self, device: Path) -> None:
+        self._index = {key: dev for key, dev in self._index.items() if dev != device}
+
+
+device_inventory = DeviceInventory()
+
+
+def resolve_device(device: DeviceSpec) -> Path:
+    """Resolve a UUID, label or partition UUID using `device_inventory`
+
+    Refer to `DeviceInventory.resolve` for the accepted notations.
+    """
+    return device_inventory.resolve(device)
+
+
+def _parse_spec(spec: DeviceSpec) -> tuple[str, str] | None:
+    if isinstance(spec, UUID):
+        return "UUID", str(spec)
+    if isinstance(spec, Path):
+        return None
+    kind, sep, value = spec.partition("=")
+    if not sep or kind not in _KINDS:
+        return None
+    return kind, _normalise(kind, value)
+
+
+def _normalise(kind: str, value: str) -> str:
+    return value if kind == "LABEL" else value.lower()
+
+
+def _scan_dev_disk() -> dict[tuple[str, str], Path]:
+    index = {}
+    for kind, folder in _KINDS.items():
+        try:
+            entries = list(os.scandir(_DEV_DISK / folder))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            name = _UDEV_ESCAPE.sub(lambda m: chr(int(m[1], 16)), entry.name)
+            target = Path(os.path.realpath(entry.path))
+            index[kind, _normalise(kind, name)] = target
+    return index
+
+
+def _probe(path: Path) -> Identifiers:
+    with path.open("rb") as fh:
+        head = fh.read(_PROBE_SIZE)
+    for probe in (_probe_luks, _probe_ext4, _probe_btrfs):
+        identifiers = probe(head)
+        if identifiers:
+            return identifiers
+    return {}
+
+
+def _probe_luks(head: bytes) -> Identifiers:
+    if not head.startswith(_LUKS_MAGIC):
+        return {}
+    identifiers = {"UUID": _c_string(head[_LUKS_UUID])}
+    if head[6:8] == b"\x00\x02":
+        identifiers["LABEL"] = _c_string(head[_LUKS2_LABEL])
+    return _without_empty(identifiers)
+
+
+def _probe_ext4(head: bytes) -> Identifiers:
+    superblock = head[_EXT4_SUPERBLOCK : _EXT4_SUPERBLOCK + 1024]
+    if superblock[0x38:0x3A] != _EXT4_MAGIC:
+        return {}
+    return _without_empty(
+        {
+            "UUID": str(UUID(bytes=superblock[0x68:0x78])),
+            "LABEL": _c_string(superblock[0x78:0x88]),
+        }
+    )
+
+
+def _probe_btrfs(head: bytes) -> Identifiers:
+    superblock = head[_BTRFS_SUPERBLOCK:]
+    if superblock[0x40:0x48] != _BTRFS_MAGIC:
+        return {}
+    return _without_empty(
+        {
+            "UUID": str(UUID(bytes=superblock[0x20:0x30])),
+            "LABEL": _c_string(superblock[0x12B:0x22B]),
+        }
+    )
+
+
+def _c_string(raw: bytes) -> str:
+    return raw.split(b"\0", 1)[0].decode(errors="replace")
+
+
+def _without_empty(identifiers: Identifiers) -> Identifiers:
+    return {kind: value for kind, value in identifiers.items() if value}
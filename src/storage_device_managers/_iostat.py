@@ -0,0 +1,249 @@
+import contextlib
+import dataclasses
+import os
+import re
+import threading
+import time
+from collections.abc import Iterator, Sequence
+from pathlib import Path
+
+from ._block import _SYSFS, _loop_device_name
+from ._types import IoStatistics
+
+_PROC_MOUNTINFO = Path("/proc/self/mountinfo")
+_MOUNTINFO_ESCAPE = re.compile(r"\\([0-7]{3})")
+
+# Fields of the `stat` file of block devices, cf. Documentation/block/stat.rst
+_READ_IOS = 0
+_READ_SECTORS = 2
+_READ_TICKS = 3
+_WRITE_IOS = 4
+_WRITE_SECTORS = 6
+_WRITE_TICKS = 7
+_IN_FLIGHT = 8
+_IO_TICKS = 9
+# The kernel counts in units of 512 bytes, independent of the sector size.
+_SECTOR_SIZE = 512
+
+_Counters = dict[str, list[int]]
+
+
+class IoAccounting:
+    """Handle on the I/O counters of a device stack, yielded by `io_accounting`
+
+    Attributes:
+    -----------
+    devices
+        kernel names of the accounted devices, starting with the given device and
+        followed by the devices beneath it
+    """
+
+    def __init__(self, devices: Sequence[str]) -> None:
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._before = _read_counters(devices)
+        self.devices = tuple(name for name in devices if name in self._before)
+        self._peaks = {name: self._before[name][_IN_FLIGHT] for name in self.devices}
+        self._stopped: float | None = None
+        self._after: _Counters | None = None
+
+    def report(self) -> dict[str, IoStatistics]:
+        """Return the I/O of each device since entering the context
+
+        While the context is active, the I/O up to now is reported. Afterwards,
+        the I/O up to leaving the context is reported.
+        """
+        with self._lock:
+            if self._after is None or self._stopped is None:
+                after, now = self._sample(), time.monotonic()
+            else:
+                after, now = self._after, self._stopped
+            return {
+                name: _statistics(
+                    name,
+                    now - self._started,
+                    self._before[name],
+                    after.get(name, self._before[name]),
+                    self._peaks[name],
+                )
+                for name in self.devices
+            }
+
+    def _poll(self) -> None:
+        with self._lock:
+            if self._after is None:
+                self._sample()
+
+    def _stop(self) -> None:
+        with self._lock:
+            self._after = self._sample()
+            self._stopped = time.monotonic()
+
+    def _sample(self) -> _Counters:
+        counters = _read_counters(self.devices)
+        for name, values in counters.items():
+            self._peaks[name] = max(self._peaks[name], values[_IN_FLIGHT])
+        return counters
+
+
+@contextlib.contextmanager
+def io_accounting(
+    device: Path, sample_interval: float | None = 0.1
+) -> Iterator[IoAccounting]:
+    """Account the I/O of a device while the context is active
+
+    This context manager snapshots the counters in `/sys/block/<name>/stat` of
+    `device` and of all devices beneath it, e.g. the physical partition beneath
+    a dm-crypt mapping, upon entry and exit. The yielded handle reports bytes,
+    requests, latencies and service times on demand. No subprocess is started.
+
+    The peak number of requests in flight is sampled every `sample_interval`
+    seconds by a background thread.
+
+    `device` can be given like for `tuned_block_device`, or as the mount
+    directory yielded by `mounted_device`, whose mount source is looked up in
+    `/proc/self/mountinfo`. Hence, it can be nested with `mounted_device` and
+    `decrypted_device` to account the I/O of a backup job:
+
+        with mounted_device(dev) as mount_dir, io_accounting(mount_dir) as io:
+            ...
+        print(io.report())
+
+    Parameters:
+    -----------
+    device
+        block device, regular file attached to a loop device or mount directory
+    sample_interval
+        seconds between two samples of the requests in flight, or None to only
+        sample them upon entry, exit and `IoAccounting.report`
+
+    Returns:
+    --------
+    IoAccounting
+        handle reporting the I/O since entering the context
+
+    Raises:
+    -------
+    ValueError
+        if `device` is neither a block device, nor attached to a loop device,
+        nor a mount point of either
+    """
+    accounting = IoAccounting(_device_stack(_kernel_name(device)))
+    stop = threading.Event()
+    sampler = None
+    if sample_interval is not None:
+        sampler = threading.Thread(
+            target=_sample_periodically, args=(accounting, sample_interval, stop)
+        )
+        sampler.start()
+    try:
+        yield accounting
+    finally:
+        stop.set()
+        if sampler is not None:
+            sampler.join()
+        accounting._stop()
+
+
+def _sample_periodically(
+    accounting: IoAccounting, interval: float, stop: threading.Event
+) -> None:
+    while not stop.wait(interval):
+        accounting._poll()
+
+
+def _kernel_name(device: Path) -> str:
+    if device.is_dir():
+        return _kernel_name(_mount_source(device))
+    if device.is_block_device():
+        rdev = device.stat().st_rdev
+        dev_number = f"{os.major(rdev)}:{os.minor(rdev)}"
+        return (_SYSFS / "dev" / "block" / dev_number).resolve().name
+    return _loop_device_name(device)
+
+
+def _mount_source(mount_dir: Path) -> Path:
+    return Path(_mount_info(mount_dir).source)
+
+
+@dataclasses.dataclass(frozen=True)
+class _MountInfo:
+    mount_id: int
+    parent_id: int
+    target: Path
+    source: str
+    filesystem: str
+
+
+def _mount_info(mount_dir: Path) -> _MountInfo:
+    target = Path(os.path.realpath(mount_dir))
+    found = None
+    for entry in _read_mountinfo():
+        if entry.target == target:
+            # Later lines are mounted on top of earlier ones.
+            found = entry
+    if found is None:
+        raise ValueError(f"{mount_dir} is no mount point!")
+    return found
+
+
+def _read_mountinfo() -> list[_MountInfo]:
+    # Example line, with the source following the separator and file system:
+    # 36 35 98:0 /mnt1 /mnt/parent rw,noatime master:1 - ext3 /dev/root rw
+    entries = []
+    for line in _PROC_MOUNTINFO.read_text().splitlines():
+        fields = line.split()
+        separator = fields.index("-")
+        entries.append(
+            _MountInfo(
+                mount_id=int(fields[0]),
+                parent_id=int(fields[1]),
+                target=Path(_unescape(fields[4])),
+                source=_unescape(fields[separator + 2]),
+                filesystem=fields[separator + 1],
+            )
+        )
+    return entries
+
+
+def _unescape(field: str) -> str:
+    return _MOUNTINFO_ESCAPE.sub(lambda m: chr(int(m[1], 8)), field)
+
+
+def _device_stack(name: str) -> list[str]:
+    stack = [name]
+    slaves_dir = _SYSFS / "class" / "block" / name / "slaves"
+    if slaves_dir.is_dir():
+        for slave in sorted(slaves_dir.iterdir()):
+            stack.extend(_device_stack(slave.name))
+    return stack
+
+
+def _read_counters(devices: Sequence[str]) -> _Counters:
+    counters = {}
+    for name in devices:
+        stat_file = _SYSFS / "class" / "block" / name / "stat"
+        # Devices might vanish, e.g. when a mapping is closed before the context.
+        with contextlib.suppress(FileNotFoundError):
+            counters[name] = [int(value) for value in stat_file.read_text().split()]
+    return counters
+
+
+def _statistics(
+    name: str, seconds: float, before: list[int], after: list[int], peak: int
+) -> IoStatistics:
+    def delta(field: int) -> int:
+        return after[field] - before[field]
+
+    return IoStatistics(
+        device=name,
+        seconds=seconds,
+        read_ios=delta(_READ_IOS),
+        write_ios=delta(_WRITE_IOS),
+        read_bytes=delta(_READ_SECTORS) * _SECTOR_SIZE,
+        write_bytes=delta(_WRITE_SECTORS) * _SECTOR_SIZE,
+        read_seconds=delta(_READ_TICKS) / 1000,
+        write_seconds=delta(_WRITE_TICKS) / 1000,
+        busy_seconds=delta(_IO_TICKS) / 1000,
+        in_flight_peak=peak,
+    )
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import contextlib
+import errno
+import itertools
+import os
+import typing as t
+from collections.abc import Iterator, Sequence
+from pathlib import Path
+
+from ._types import IoPriorityClasses, ResourceLimits
+
+if t.TYPE_CHECKING:
+    import shell_interface as sh
+
+# systemd creates the cgroup of a scope, so that its ownership of the hierarchy is
+# respected. With `--collect`, the scope is removed even if the command fails.
+_SYSTEMD_RUN = ["sudo", "systemd-run", "--scope", "--quiet", "--collect"]
+_scope_ids = itertools.count()
+# Keys of `io.max` and the corresponding resource control properties of systemd
+_IO_MAX_PROPERTIES = {
+    "rbps": "IOReadBandwidthMax",
+    "wbps": "IOWriteBandwidthMax",
+    "riops": "IOReadIOPSMax",
+    "wiops": "IOWriteIOPSMax",
+}
+_SYSTEMD_VALUES = {"max": "infinity"}
+
+# From linux/ioprio.h
+_IOPRIO_CLASS_SHIFT = 13
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASSES = {
+    IoPriorityClasses.REALTIME: 1,
+    IoPriorityClasses.BEST_EFFORT: 2,
+    IoPriorityClasses.IDLE: 3,
+}
+# Numbers of the system calls ioprio_set and ioprio_get per architecture
+_IOPRIO_SYSCALLS = {
+    "x86_64": (251, 252),
+    "i686": (289, 290),
+    "aarch64": (30, 31),
+    "riscv64": (30, 31),
+    "ppc64le": (273, 274),
+    "s390x": (282, 283),
+}
+
+
+@contextlib.contextmanager
+def _io_priority(limits: ResourceLimits) -> Iterator[None]:
+    """Set the I/O priority of the calling thread temporarily
+
+    Processes started meanwhile inherit the priority.
+    """
+    if limits.io_class is None:
+        yield
+        return
+    level = 0 if limits.io_class is IoPriorityClasses.IDLE else limits.io_level
+    previous = _ioprio_syscall(1)
+    _ioprio_syscall(0, _IOPRIO_CLASSES[limits.io_class] << _IOPRIO_CLASS_SHIFT | level)
+    try:
+        yield
+    finally:
+        _ioprio_syscall(0, previous)
+
+
+def _ioprio_syscall(index: int, *args: int) -> int:
+    import ctypes  # noqa: PLC0415
+
+    numbers = _IOPRIO_SYSCALLS.get(os.uname().machine)
+    if numbers is None:
+        raise OSError(errno.ENOSYS, f"ioprio is not supported on {os.uname().machine}")
+    libc = ctypes.CDLL(None, use_errno=True)
+    # who = 0 refers to the calling thread.
+    result: int = libc.syscall(numbers[index], _IOPRIO_WHO_PROCESS, 0, *args)
+    if result < 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+    return result
+
+
+def _check_limits(limits: ResourceLimits) -> None:
+    """Raise errors of the limits before any command of the operation runs"""
+    _scope_properties(limits)
+    if limits.io_class is not IoPriorityClasses.REALTIME:
+        return
+    try:
+        with _io_priority(limits):
+            pass
+    except PermissionError as error:
+        raise PermissionError(
+            "The I/O class REALTIME requires CAP_SYS_ADMIN, e.g. root privileges!"
+        ) from error
+
+
+def _needs_scope(limits: ResourceLimits) -> bool:
+    return bool(
+        limits.io_weight is not None or limits.io_max or limits.cpu_weight is not None
+    )
+
+
+def _scope_properties(limits: ResourceLimits) -> list[str]:
+    properties = []
+    if limits.io_weight is not None:
+        properties.append(f"IOWeight={limits.io_weight}")
+    for device, device_limits in limits.io_max.items():
+        properties.extend(_io_max_properties(device, device_limits))
+    if limits.cpu_weight is not None:
+        properties.append(f"CPUWeight={limits.cpu_weight}")
+    return properties
+
+
+def _io_max_properties(device: Path, device_limits: str) -> Iterator[str]:
+    for limit in device_limits.split():
+        key, _, value = limit.partition("=")
+        if key not in _IO_MAX_PROPERTIES or not value:
+            raise ValueError(f"Invalid io.max limit {limit!r} for {device}!")
+        yield f"{_IO_MAX_PROPERTIES[key]}={device} {_SYSTEMD_VALUES.get(value, value)}"
+
+
+def _in_scope(cmd: sh.StrPathList, properties: Sequence[str]) -> sh.StrPathList:
+    """Wrap `cmd` such that it runs in a transient systemd scope
+
+    Only commands run with root privileges may be placed into a scope of the
+    system manager, so commands not starting with `sudo` are returned unchanged.
+    """
+    if cmd[:1] != ["sudo"]:
+        return cmd
+    unit = f"storage-device-managers-{os.getpid()}-{next(_scope_ids)}"
+    return [
+        *_SYSTEMD_RUN,
+        f"--unit={unit}",
+        *(f"--property={value}" for value in properties),
+        "--",
+        *cmd[1:],
+    ]
+
+
+def _without_scope(cmd: sh.StrPathList) -> sh.StrPathList:
+    """Undo `_in_scope`"""
+    if cmd[: len(_SYSTEMD_RUN)] != _SYSTEMD_RUN:
+        return cmd
+    return ["sudo", *cmd[cmd.index("--") + 1 :]]
@@ -0,0 +1,32 @@
+import functools
+from types import SimpleNamespace
+from typing import Any
+
+__all__ = ["logger"]
+
+
+@functools.cache
+def _load_logger() -> Any:
+    try:
+        from loguru import logger  # noqa: PLC0415
+
+        logger.disable("storage_device_managers")
+    except ModuleNotFoundError:
+        logger = SimpleNamespace()  # type: ignore[assignment, unused-ignore]
+        logger.success = lambda msg, *args, **kwargs: None  # type: ignore[assignment, unused-ignore]
+        logger.info = lambda msg, *args, **kwargs: None  # type: ignore[assignment, unused-ignore]
+        logger.warning = lambda msg, *args, **kwargs: None  # type: ignore[assignment, unused-ignore]
+    return logger
+
+
+class _LazyLogger:
+    """Logger of loguru, which is only imported once the first message is logged
+
+    Importing loguru takes longer than importing this package.
+    """
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(_load_logger(), name)
+
+
+logger = _LazyLogger()
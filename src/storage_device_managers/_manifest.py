@@ -0,0 +1,281 @@
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import time
+import typing as t
+from collections.abc import Callable, Iterator, Mapping
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+from pathlib import Path
+
+from ._log import logger
+from ._types import ManifestStatistics
+
+_MANIFEST_NAME = ".storage-device-managers-manifest.json.gz"
+_MANIFEST_VERSION = 1
+# Chunks keep the memory handed to the hash bounded while reading via mmap.
+_CHUNK_SIZE = 8 * 1024**2
+
+
+class _Hash(t.Protocol):
+    def update(self, data: memoryview, /) -> object: ...
+
+    def hexdigest(self) -> str: ...
+
+
+# All hashes release the GIL while hashing, so threads hash in parallel.
+_HASHES: dict[str, Callable[[], _Hash]] = {"blake2b": hashlib.blake2b}
+try:
+    import xxhash  # type: ignore[import-not-found, unused-ignore]
+
+    _HASHES["xxh3_128"] = xxhash.xxh3_128
+except ModuleNotFoundError:
+    pass
+try:
+    import blake3  # type: ignore[import-not-found, unused-ignore]
+
+    _HASHES["blake3"] = blake3.blake3
+except ModuleNotFoundError:
+    pass
+_DEFAULT_HASH = next(
+    name for name in ("blake3", "xxh3_128", "blake2b") if name in _HASHES
+)
+
+# Relative path -> (inode, size, mtime in ns, digest)
+_Entries = dict[str, tuple[int, int, int, str]]
+
+
+def update_manifest(
+    root: Path, *, manifest: Path | None = None, jobs: int | None = None
+) -> ManifestStatistics:
+    """Create or update the content manifest of a directory tree
+
+    The manifest lists the hash of every regular file below `root`. It is
+    stored as compressed JSON, by default in `root` itself, so that it travels
+    with the backup on the device.
+
+    Only files whose inode, size or modification time differ from the manifest
+    are hashed, so updating the manifest after an incremental backup takes time
+    proportional to the data written. The tree is walked and hashed by a pool of
+    threads reading the files via `mmap`. BLAKE3 or XXH3 are used if `blake3` or
+    `xxhash` are installed, BLAKE2b otherwise. If the manifest was created with
+    a different hash, all files are hashed again.
+
+    Symbolic links are not followed and, as all other special files, not listed.
+    The tree must not be modified while the manifest is updated.
+
+    Parameters:
+    -----------
+    root
+        directory to create the manifest of, e.g. as yielded by `mounted_device`
+    manifest
+        path of the manifest; defaults to a file named
+        `.storage-device-managers-manifest.json.gz` in `root`
+    jobs
+        number of threads; defaults to the default of `ThreadPoolExecutor`
+
+    Returns:
+    --------
+    ManifestStatistics
+        number of files listed and hashed, and the throughput of hashing
+    """
+    manifest = manifest or root / _MANIFEST_NAME
+    start = time.monotonic()
+    algorithm, old_entries = _read_manifest(manifest)
+    if algorithm != _DEFAULT_HASH:
+        old_entries = {}
+    exclude = os.path.relpath(manifest, root)
+    with ThreadPoolExecutor(jobs) as executor:
+        pending: dict[str, tuple[os.stat_result, Future[str]]] = {}
+        entries: _Entries = {}
+        for rel_path, stat in _walk(root, executor):
+            key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            old_entry = old_entries.get(rel_path)
+            if old_entry is not None and old_entry[:3] == key:
+                entries[rel_path] = old_entry
+            elif rel_path != exclude:
+                future = executor.submit(_hash_file, root / rel_path, _DEFAULT_HASH)
+                pending[rel_path] = (stat, future)
+        for rel_path, (stat, future) in pending.items():
+            key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            entries[rel_path] = (*key, future.result())
+    _write_manifest(manifest, _DEFAULT_HASH, entries)
+    statistics = ManifestStatistics(
+        manifest=manifest,
+        n_files=len(entries),
+        n_hashed=len(pending),
+        bytes_hashed=sum(stat.st_size for stat, _ in pending.values()),
+        seconds=time.monotonic() - start,
+    )
+    _log_statistics("Manifest {manifest} aktualisiert", statistics)
+    return statistics
+
+
+def verify_manifest(
+    root: Path, *, manifest: Path | None = None, jobs: int | None = None
+) -> ManifestStatistics:
+    """Hash all files listed in a manifest and compare them to it
+
+    In contrast to `update_manifest`, every listed file is read, so that silent
+    corruption of the data is detected. Files not listed in the manifest are
+    ignored.
+
+    Parameters:
+    -----------
+    root
+        directory the manifest was created of
+    manifest
+        path of the manifest; defaults to a file named
+        `.storage-device-managers-manifest.json.gz` in `root`
+    jobs
+        number of threads; defaults to the default of `ThreadPoolExecutor`
+
+    Returns:
+    --------
+    ManifestStatistics
+        throughput of hashing and the files that are missing or whose content
+        does not match
+
+    Raises:
+    -------
+    FileNotFoundError
+        if the manifest does not exist
+    ValueError
+        if the manifest uses a hash that is not installed
+    """
+    manifest = manifest or root / _MANIFEST_NAME
+    start = time.monotonic()
+    algorithm, entries = _read_manifest(manifest)
+    if algorithm is None:
+        raise FileNotFoundError(manifest)
+    if algorithm not in _HASHES:
+        raise ValueError(f"Hash {algorithm} of manifest {manifest} is not installed!")
+    with ThreadPoolExecutor(jobs) as executor:
+        futures = {
+            rel_path: executor.submit(_hash_file, root / rel_path, algorithm)
+            for rel_path in entries
+        }
+        missing, mismatched = _compare(entries, futures)
+    present = entries.keys() - set(missing)
+    statistics = ManifestStatistics(
+        manifest=manifest,
+        n_files=len(entries),
+        n_hashed=len(present),
+        bytes_hashed=sum(entries[rel_path][1] for rel_path in present),
+        seconds=time.monotonic() - start,
+        missing=missing,
+        mismatched=mismatched,
+    )
+    _log_statistics("Manifest {manifest} geprüft", statistics)
+    if missing or mismatched:
+        logger.warning(
+            "{n_missing} Dateien fehlen, {n_mismatched} Dateien weichen ab.",
+            n_missing=len(missing),
+            n_mismatched=len(mismatched),
+        )
+    return statistics
+
+
+def _compare(
+    entries: _Entries, futures: Mapping[str, Future[str]]
+) -> tuple[tuple[str, ...], tuple[str, ...]]:
+    missing = []
+    mismatched = []
+    for rel_path, future in futures.items():
+        try:
+            digest = future.result()
+        except FileNotFoundError:
+            missing.append(rel_path)
+            continue
+        if digest != entries[rel_path][3]:
+            mismatched.append(rel_path)
+    return tuple(missing), tuple(mismatched)
+
+
+def _walk(root: Path, executor: Executor) -> Iterator[tuple[str, os.stat_result]]:
+    """Yield relative path and status of all regular files below `root`
+
+    Each directory is listed by a task of `executor`, so that the latency of
+    listing directories on rotating disks overlaps.
+    """
+    pending = {executor.submit(_scan_directory, root, "")}
+    while pending:
+        done, pending = wait_futures(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            files, subdirs = future.result()
+            yield from files
+            pending.update(
+                executor.submit(_scan_directory, root, subdir) for subdir in subdirs
+            )
+
+
+def _scan_directory(
+    root: Path, rel_dir: str
+) -> tuple[list[tuple[str, os.stat_result]], list[str]]:
+    files = []
+    subdirs = []
+    with os.scandir(root / rel_dir) as entries:
+        for entry in entries:
+            rel_path = os.path.join(rel_dir, entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(rel_path)
+            elif entry.is_file(follow_symlinks=False):
+                files.append((rel_path, entry.stat(follow_symlinks=False)))
+    return files, subdirs
+
+
+def _hash_file(path: Path, algorithm: str) -> str:
+    hasher = _HASHES[algorithm]()
+    with path.open("rb") as fh:
+        # Empty files cannot be mapped.
+        if os.fstat(fh.fileno()).st_size == 0:
+            return hasher.hexdigest()
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mapped) as view:
+                for offset in range(0, len(view), _CHUNK_SIZE):
+                    with view[offset : offset + _CHUNK_SIZE] as chunk:
+                        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _read_manifest(manifest: Path) -> tuple[str | None, _Entries]:
+    try:
+        with gzip.open(manifest, "rt", encoding="utf-8") as fh:
+            document = json.load(fh)
+    except FileNotFoundError:
+        return None, {}
+    if document.get("version") != _MANIFEST_VERSION:
+        raise ValueError(f"Unsupported version of manifest {manifest}!")
+    entries = {
+        rel_path: (inode, size, mtime_ns, digest)
+        for rel_path, (inode, size, mtime_ns, digest) in document["files"].items()
+    }
+    return document["hash"], entries
+
+
+def _write_manifest(manifest: Path, algorithm: str, entries: _Entries) -> None:
+    document = {
+        "version": _MANIFEST_VERSION,
+        "hash": algorithm,
+        "files": dict(sorted(entries.items())),
+    }
+    tmp_manifest = manifest.with_name(f"{manifest.name}.tmp")
+    with tmp_manifest.open("wb") as raw:
+        with gzip.open(raw, "wt", encoding="utf-8") as fh:
+            json.dump(document, fh, separators=(",", ":"))
+        raw.flush()
+        os.fsync(raw.fileno())
+    tmp_manifest.replace(manifest)
+
+
+def _log_statistics(message: str, statistics: ManifestStatistics) -> None:
+    logger.success(
+        message + ": {n_hashed} von {n_files} Dateien gehasht, {mib_per_s:.1f} MiB/s.",
+        manifest=statistics.manifest,
+        n_hashed=statistics.n_hashed,
+        n_files=statistics.n_files,
+        mib_per_s=statistics.bytes_per_second / 1024**2,
+    )
@@ -0,0 +1,450 @@
+from __future__ import annotations
+
+import contextlib
+import os
+import typing as t
+from collections import defaultdict
+from collections.abc import Iterator
+from pathlib import Path
+
+from ._backend import _run_cmd
+from ._filesystems import get_filesystem
+from ._log import logger
+from ._operation import (
+    _MOUNTS_CACHE,
+    _cached,
+    _current_operation,
+    _forget_operation_state,
+    operation,
+)
+from ._types import (
+    BlockQueueTuning,
+    Devices,
+    MountDirectory,
+    MountOptions,
+    TrimRange,
+    UnmountError,
+    ValidCompressions,
+    _as_device_list,
+)
+
+# Modules only needed by few functions, as well as shell_interface, are imported
+# within them, so that looking up e.g. `is_mounted` does not load them.
+if t.TYPE_CHECKING:
+    import shell_interface as sh
+
+    from ._inventory import DeviceSpec
+
+
+@contextlib.contextmanager
+def mounted_device(
+    device: Devices | DeviceSpec,
+    compression: ValidCompressions | None = None,
+    subvol: str | None = None,
+    *,
+    tuning: BlockQueueTuning | None = None,
+    directory: MountDirectory | None = None,
+) -> Iterator[Path]:
+    """Mount a given BtrFS device
+
+    Given a path pointing to a file-like object, this context manager will
+    mount it to some temporary directory and return its path. Upon exit, the
+    file-like object is unmounted again.
+
+    If several paths are given, they are mounted as one multi-device BtrFS. In
+    this case, the file system is unmounted via its mount directory, since the
+    kernel reports only one of the member devices as mount source.
+
+    A single device can also be given by UUID or as `UUID=...`, `LABEL=...` or
+    `PARTUUID=...`. Refer to `DeviceInventory` for how these are resolved.
+
+    If `compression` is provided, a mount option specifying the transparent
+    file system compression is set. Compression is only supported for BtrFS
+    devices. If `compression` is given for a non-BtrFS device, it is silently
+    ignored.
+
+    If `subvol` is provided, only the given BtrFS subvolume is mounted.
+
+    If `tuning` is given, it is applied to the mounted devices for as long as they
+    are mounted. Refer to `tuned_block_device` for details.
+
+    The mount directory is created below `/run/storage-device-managers` by
+    default. Via `directory`, another base directory and a fixed name, or a name
+    derived from the device's UUID, can be chosen. This makes mount points
+    predictable. An empty mount directory left over by a previous run is reused.
+    Like with `temporary_directory`, the mount directory is only removed if it is
+    empty.
+
+    Parameters:
+    -----------
+    device
+        file-like object or objects to be mounted, or the identifier of one
+    compression
+        compression level to be used by BtrFS
+    subvol
+        path of the BtrFS subvolume to be mounted, relative to the top level
+    tuning
+        block layer settings to apply while the device is mounted
+    directory
+        location and name of the mount directory
+
+    Returns:
+    --------
+    Path
+        directory to which `device` was mounted
+
+    Raises:
+    -------
+    DeviceNotFoundError
+        if no device carries the given identifier
+    """
+    from uuid import UUID  # noqa: PLC0415
+
+    from ._block import _maybe_tuned_block_devices  # noqa: PLC0415
+    from ._inventory import resolve_device  # noqa: PLC0415
+
+    if isinstance(device, UUID | str):
+        device = resolve_device(device)
+    devices = _as_device_list(device)
+    with operation():
+        for member in devices:
+            if is_mounted(member):
+                unmount_device(member)
+    with _mount_directory(devices[0], directory or MountDirectory()) as mount_dir:
+        mount_device(device, mount_dir, compression, subvol)
+        logger.success(
+            "Speichermedium {device} erfolgreich nach {mount_dir} gemountet.",
+            device=device,
+            mount_dir=mount_dir,
+        )
+        try:
+            with _maybe_tuned_block_devices(devices, tuning):
+                yield Path(mount_dir)
+        finally:
+            _forget_operation_state()
+            unmount_device(devices[0] if len(devices) == 1 else mount_dir)
+            logger.success(
+                "Speichermedium {device} erfolgreich ausgehangen.", device=device
+            )
+
+
+def _mount_directory(device: Path, directory: MountDirectory) -> t.ContextManager[Path]:
+    from ._files import _default_mount_base, temporary_directory  # noqa: PLC0415
+
+    base_dir = directory.base_dir or _default_mount_base()
+    name = directory.name
+    if directory.by_uuid:
+        name = _query_uuid(device)
+    return temporary_directory(base_dir, name)
+
+
+def _query_uuid(device: Path) -> str:
+    cmd: sh.StrPathList = ["sudo", "blkid", "-o", "value", "-s", "UUID", device]
+    uuid = _run_cmd(cmd, capture_output=True).stdout.decode().strip()
+    if not uuid:
+        raise ValueError(f"Device {device} has no UUID!")
+    return uuid
+
+
+def mount_btrfs_device(
+    device: Devices,
+    mount_dir: Path,
+    compression: ValidCompressions | None = None,
+    subvol: str | None = None,
+) -> None:
+    """
+    Mount a given BtrFS device
+
+    Given a path pointing to a file-like object and a target directory, this function
+    will mount the device to the target directory.
+
+    The filesystem of `device` must be BtrFS. While technically other file systems
+    might work too, this behaviour is not guaranteed and might be broken without
+    further notice!
+
+    If several paths are given, they are treated as members of one multi-device
+    BtrFS. They are registered with the kernel using `btrfs device scan` and passed
+    as `device=` mount options, so that the file system can be assembled even if
+    some members have not been seen by udev.
+
+    If `compression` is provided, a mount option specifying the transparent file
+    system compression is set.
+
+    If `subvol` is provided, only the given subvolume is mounted instead of the top
+    level of the file system.
+
+    Parameters:
+    -----------
+    device
+        file-like object or objects to be mounted
+    mount_dir
+        directory to which `device` is mounted
+    compression
+        compression level to be used by BtrFS
+    subvol
+        path of the subvolume to be mounted, relative to the top level
+    """
+    devices = _as_device_list(device)
+    options = [f"device={member}" for member in devices[1:]]
+    if options:
+        scan_cmd: sh.StrPathList = ["sudo", "btrfs", "device", "scan", *devices]
+        _run_cmd(scan_cmd)
+    if subvol is not None:
+        options.insert(0, f"subvol={subvol}")
+    if compression is not None:
+        options.insert(0, f"compress={compression}")
+    cmd: sh.StrPathList = ["sudo", "mount", devices[0], mount_dir]
+    if options:
+        cmd.extend(["-o", ",".join(options)])
+    _run_cmd(cmd)
+
+
+def mount_ext4_device(device: Path, mount_dir: Path) -> None:
+    """
+    Mount a given ext4 device
+
+    Given a path pointing to a file-like object and a target directory, this function
+    will mount the device to the target directory.
+
+    The filesystem of `device` must be ext4. While technically other file systems
+    might work too, this behaviour is not guaranteed and might be broken without
+    further notice!
+
+    Parameters:
+    -----------
+    device
+        file-like object to be mounted
+    mount_dir
+        directory to which `device` is mounted
+    """
+    cmd: sh.StrPathList = ["sudo", "mount", "-t", "ext4", device, mount_dir]
+    _run_cmd(cmd)
+
+
+def mount_device(
+    device: Devices,
+    mount_dir: Path,
+    compression: ValidCompressions | None = None,
+    subvol: str | None = None,
+) -> None:
+    """Mount a device without knowing its file system type
+
+    Given a path pointing to a file-like object and a target directory, this
+    function will detect the file system of the device and mount it to the
+    target directory using the appropriate mount function.
+
+    Several paths can only be given for multi-device BtrFS. The file system type is
+    detected from the first of them.
+
+    If `compression` is provided and the file system of `device` is BtrFS, a mount
+    option specifying the transparent file system compression is set. For other file
+    systems, `compression` is silently ignored.
+
+    Parameters:
+    -----------
+    device
+        file-like object or objects to be mounted
+    mount_dir
+        directory to which `device` is mounted
+    compression
+        compression level to be used by BtrFS
+    subvol
+        BtrFS subvolume to be mounted instead of the top level
+
+    Raises:
+    -------
+    ValueError
+        if several devices or a subvolume are given for a file system other than
+        BtrFS
+    """
+    devices = _as_device_list(device)
+    fs = get_filesystem(devices[0])
+    if fs != "btrfs" and (len(devices) > 1 or subvol is not None):
+        raise ValueError(f"Multiple devices and subvolumes are not supported for {fs}!")
+    match fs:
+        case "btrfs":
+            mount_btrfs_device(devices, mount_dir, compression, subvol)
+        case "ext4":
+            mount_ext4_device(devices[0], mount_dir)
+        case _:
+            cmd: sh.StrPathList = ["sudo", "mount", devices[0], mount_dir]
+            _run_cmd(cmd)
+
+
+def is_mounted(device: Path) -> bool:
+    """Check whether a given device is mounted
+
+    Parameters:
+    -----------
+    device
+        file-like object to be checked
+
+    Returns:
+    --------
+    bool
+        True if `device` is mounted, False otherwise
+    """
+    device_as_str = str(device)
+    try:
+        mount_dest = get_mounted_devices()[device_as_str]
+        logger.info(
+            "Mount des Speichermediums {device} in {mount_dest} gefunden.",
+            device=device,
+            mount_dest=mount_dest,
+        )
+    except KeyError:
+        logger.info(
+            "Kein Mountpunkt für Speichermedium {device} gefunden.", device=device
+        )
+        return False
+    return True
+
+
+def get_mounted_devices() -> t.Mapping[str, t.Mapping[Path, MountOptions]]:
+    """Get all mounted devices
+
+    This function will parse the output of `mount` and return everything that is mounted
+    to somewhere. The returned mapping maps device names (i.e. mount sources) to their
+    destinations and mount options.
+
+    Since a source can be mounted to multiple (e.g. /dev/sda1 can be mounted to
+    /home/{user1,user2}/Videos), the value of the mapping is another mapping. This inner
+    mapping maps mount destinations to their mount options.
+
+    Returns:
+    --------
+    t.Mapping[str, t.Mapping[Path, MountOptions]]
+        A mapping that maps mount sources (i.e. device names) to their
+        destinations and mount options.
+
+    Example Return Value:
+    ---------------------
+    {
+        "/dev/nvme0n1p2": {
+            Path("/boot"): frozenset({"rw", "relatime"}),
+            Path("/media/backup"): frozenset({"rw", "relatime", "compress=zstd:3"}),
+        },
+    }
+    """
+    # Example line:
+    # /dev/nvme0n1p2 on /boot type ext2 (rw,relatime)
+    return _cached(_MOUNTS_CACHE, "", _query_mounted_devices)
+
+
+def _query_mounted_devices() -> dict[str, dict[Path, MountOptions]]:
+    raw_mounts = _run_cmd(["mount"], capture_output=True)
+    mount_lines = raw_mounts.stdout.decode().splitlines()
+    mount_points: dict[str, dict[Path, MountOptions]] = defaultdict(dict)
+    for line in mount_lines:
+        device = line.split()[0]
+        dest = Path(line.split()[2])
+        raw_options = line.split()[5]
+        options = frozenset(raw_options.strip("()").split(","))
+        mount_points[device][dest] = options
+    return dict(mount_points)
+
+
+def sync_device(device: Path) -> None:
+    """Sync a device's filesystem
+
+    This function flushes pending writes to the given device. For BtrFS
+    devices, it additionally performs a BtrFS-specific filesystem sync on one
+    of the device's mount points. Since all mount points of a device share the
+    same file system, syncing one of them suffices.
+
+    Within an `operation`, a device is not synced again as long as this package
+    did not execute any other command since the last sync.
+
+    Parameters:
+    -----------
+    device
+        The device to be synced.
+    """
+    with operation() as statistics:
+        current = _current_operation.get()
+        assert current is not None
+        if str(device) in current.synced:
+            statistics.skipped_syncs += 1
+            return
+        _sync_device(device)
+        current.synced.add(str(device))
+
+
+def _sync_device(device: Path) -> None:
+    import shell_interface as sh  # noqa: PLC0415
+
+    sync_cmd: sh.StrPathList = ["sudo", "sync", "-f", device]
+
+    try:
+        fs = get_filesystem(device)
+    except sh.ShellInterfaceError:
+        fs = None
+    if fs == "btrfs":
+        mounted = get_mounted_devices()
+        for mount_dir in list(mounted.get(str(device), {}))[:1]:
+            btrfs_sync_cmd: sh.StrPathList = [
+                "sudo",
+                "btrfs",
+                "filesystem",
+                "sync",
+                mount_dir,
+            ]
+            _run_cmd(btrfs_sync_cmd)
+    _run_cmd(sync_cmd)
+
+
+def unmount_device(device: Path, *, trim: TrimRange | None = None) -> None:
+    """Unmount a given device
+
+    This function will unmount a given device. It relies on the system's
+    `umount` program to do so. Before unmounting, the device's filesystem is
+    synced to flush any pending writes.
+
+    If `trim` is given, the given range of the file system is trimmed before
+    unmounting. Refer to `trim_filesystem` for details. Since trimming is only
+    an optimisation, failing to trim is logged, but does not prevent unmounting.
+
+    Parameters:
+    -----------
+    device
+        The device to be unmounted.
+    trim
+        part of the file system to trim before unmounting
+
+    Raises:
+    -------
+    UnmountError
+        if `umount` returns a non-zero exit code
+    """
+    import shell_interface as sh  # noqa: PLC0415
+
+    cmd: sh.StrPathList = ["sudo", "umount", device]
+    with operation():
+        if trim is not None:
+            _trim_before_unmount(device, trim)
+        sync_device(device)
+        try:
+            _run_cmd(cmd)
+        except sh.ShellInterfaceError as e:
+            raise UnmountError from e
+
+
+def _trim_before_unmount(device: Path, trim: TrimRange) -> None:
+    import shell_interface as sh  # noqa: PLC0415
+
+    from ._trim import trim_filesystem  # noqa: PLC0415
+
+    if os.path.ismount(device):
+        mount_dir: Path | None = device
+    else:
+        mount_dir = next(iter(get_mounted_devices().get(str(device), {})), None)
+    if mount_dir is None:
+        return
+    try:
+        trim_filesystem(mount_dir, trim)
+    except (OSError, sh.ShellInterfaceError) as e:
+        logger.warning(
+            "Trimmen von {mount_dir} fehlgeschlagen: {error}",
+            mount_dir=mount_dir,
+            error=e,
+        )
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import dataclasses
+import threading
+import typing as t
+from collections.abc import Callable, Iterator, Sequence
+from pathlib import Path
+
+from ._limits import _check_limits
+from ._types import OperationStatistics, ResourceLimits
+
+if t.TYPE_CHECKING:
+    import shell_interface as sh
+
+
+@dataclasses.dataclass
+class _Operation:
+    statistics: OperationStatistics = dataclasses.field(
+        default_factory=OperationStatistics
+    )
+    cache: dict[tuple[str, str], object] = dataclasses.field(default_factory=dict)
+    synced: set[str] = dataclasses.field(default_factory=set)
+    generation: int = 0
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock)
+
+
+_current_operation: contextvars.ContextVar[_Operation | None] = contextvars.ContextVar(
+    "storage_device_managers_operation", default=None
+)
+
+_FILESYSTEM_CACHE = "filesystem"
+_MOUNTS_CACHE = "mounts"
+_ALL_CACHES = frozenset({_FILESYSTEM_CACHE, _MOUNTS_CACHE})
+# Programs not listed here might change anything and invalidate all caches.
+_INVALIDATED_CACHES: t.Final[t.Mapping[str, frozenset[str]]] = {
+    "mount": frozenset({_MOUNTS_CACHE}),
+    "umount": frozenset({_MOUNTS_CACHE}),
+    "mkfs.btrfs": frozenset({_FILESYSTEM_CACHE}),
+    "mkfs.ext4": frozenset({_FILESYSTEM_CACHE}),
+    "cryptsetup": frozenset({_FILESYSTEM_CACHE}),
+    "chown": frozenset(),
+    "ln": frozenset(),
+    "rm": frozenset(),
+}
+
+
+@contextlib.contextmanager
+def operation(limits: ResourceLimits | None = None) -> Iterator[OperationStatistics]:
+    """Group the commands run by this package into one operation
+
+    Within an operation, the results of `get_filesystem` and
+    `get_mounted_devices` are reused until this package runs a command that might
+    change them, e.g. `mount` or `mkfs`. Syncing a device that was synced already,
+    without any command run in between, is skipped. The yielded statistics count
+    the executed commands, so that regressions in the number of shell-outs become
+    visible.
+
+    Nested operations join the outermost one. Most functions of this package open
+    an operation internally, so that repeated queries within one call are
+    answered from the cache. The context managers of this package discard all
+    cached results whenever they regain control from the caller.
+
+    Changes made without this package, e.g. writing files or mounting devices
+    manually, are not noticed. Therefore, an explicit operation should not span
+    such changes unless they happen within a context manager of this package.
+
+    With `limits`, all commands of the operation run with the given I/O priority,
+    e.g. `IoPriorityClasses.IDLE` for a recursive `chown` or a large `mkfs` on a
+    shared host. Weights and bandwidth limits are enforced by running each command
+    that requires root privileges in a transient scope of systemd via
+    `systemd-run --scope`, so that systemd keeps managing the cgroup hierarchy.
+
+    Parameters:
+    -----------
+    limits
+        priorities and limits for the commands of the operation
+
+    Returns:
+    --------
+    OperationStatistics
+        statistics of the operation, updated as commands are executed
+
+    Raises:
+    -------
+    ValueError
+        if a nested operation asks for limits other than those of the outermost
+        operation, or if `io_max` contains an invalid limit
+    PermissionError
+        if `IoPriorityClasses.REALTIME` is requested without the privilege to
+        set it
+    """
+    current = _current_operation.get()
+    if current is not None:
+        if limits is not None and limits != current.statistics.limits:
+            raise ValueError("Nested operations cannot change resource limits!")
+        yield current.statistics
+        return
+    if limits is not None:
+        _check_limits(limits)
+    new = _Operation(statistics=OperationStatistics(limits=limits))
+    token = _current_operation.set(new)
+    try:
+        yield new.statistics
+    finally:
+        _current_operation.reset(token)
+
+
+def _record_command(cmd: sh.StrPathList) -> None:
+    current = _current_operation.get()
+    if current is None:
+        return
+    args = [str(arg) for arg in cmd]
+    if args[:1] == ["sudo"]:
+        args = args[1:]
+    with current.lock:
+        current.statistics.commands += 1
+        if _is_read_only_command(args):
+            return
+        current.synced.clear()
+        current.generation += 1
+        invalidated = _INVALIDATED_CACHES.get(Path(args[0]).name, _ALL_CACHES)
+        for key in [key for key in current.cache if key[0] in invalidated]:
+            del current.cache[key]
+
+
+def _is_read_only_command(args: Sequence[str]) -> bool:
+    return (
+        args == ["mount"]
+        or args[:1] in (["blkid"], ["sync"])
+        or args[:3] == ["btrfs", "filesystem", "sync"]
+    )
+
+
+def _forget_operation_state() -> None:
+    current = _current_operation.get()
+    if current is None:
+        return
+    with current.lock:
+        current.cache.clear()
+        current.synced.clear()
+        current.generation += 1
+
+
+_T = t.TypeVar("_T")
+
+
+def _cached(kind: str, key: str, query: Callable[[], _T]) -> _T:
+    current = _current_operation.get()
+    if current is None:
+        return query()
+    with current.lock:
+        if (kind, key) in current.cache:
+            current.statistics.cache_hits += 1
+            return t.cast(_T, current.cache[(kind, key)])
+        generation = current.generation
+    result = query()
+    with current.lock:
+        # Do not store results that might have been outdated while querying.
+        if current.generation == generation:
+            current.cache[(kind, key)] = result
+    return result
@@ -0,0 +1,226 @@
+import contextlib
+import contextvars
+import dataclasses
+import time
+from collections.abc import Callable, Iterator, Sequence
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from ._crypt import decrypted_device, encrypt_device
+from ._files import chown, symbolic_link
+from ._filesystems import mkfs
+from ._log import logger
+from ._mounts import mounted_device
+from ._operation import _forget_operation_state
+from ._types import DeviceStack, PlanReport, StepTiming
+
+_StepFunction = Callable[[DeviceStack, PlanReport, contextlib.ExitStack], None]
+
+
+@dataclasses.dataclass(frozen=True)
+class _Step:
+    name: str
+    run: _StepFunction
+    stack: DeviceStack
+    dependencies: tuple[str, ...] = ()
+
+
+@contextlib.contextmanager
+def storage_stacks(
+    stacks: Sequence[DeviceStack], max_workers: int = 4
+) -> Iterator[PlanReport]:
+    """Set up storage stacks on several devices concurrently
+
+    This context manager will set up all layers described by `stacks`. The layers
+    of one device depend on each other, but stacks of different devices are
+    independent. Therefore, independent steps are executed concurrently, using at
+    most `max_workers` threads.
+
+    If any step fails, no further steps are started. All completed steps are
+    undone in reverse order, e.g. unmounting before closing the decrypted device,
+    and the error is re-raised. Upon exit, all steps are undone the same way.
+    Encrypting, formatting and changing the owner cannot be undone.
+
+    The yielded report contains the resulting decrypted devices and mount
+    directories as well as the duration of each step and the critical path, i.e.
+    the chain of steps that determined the total duration.
+
+    Parameters:
+    -----------
+    stacks
+        storage stacks to set up
+    max_workers
+        maximum number of steps to execute concurrently
+
+    Returns:
+    --------
+    PlanReport
+        decrypted devices, mount directories and timings
+
+    Raises:
+    -------
+    ValueError
+        if a stack is inconsistent, e.g. requests a symbolic link without mount,
+        or if several stacks share a device
+    """
+    devices = [stack.device for stack in stacks]
+    duplicates = sorted({str(dev) for dev in devices if devices.count(dev) > 1})
+    if duplicates:
+        raise ValueError(f"Devices {duplicates} are part of several stacks!")
+    report = PlanReport()
+    steps = [step for stack in stacks for step in _stack_steps(stack)]
+    with contextlib.ExitStack() as undo_stack:
+        _execute_steps(steps, undo_stack, report, max_workers)
+        report.critical_path = _critical_path(steps, report.timings)
+        logger.success(
+            "Speicher-Stapel für {n_stacks} Speichermedien erfolgreich aufgebaut.",
+            n_stacks=len(stacks),
+        )
+        try:
+            yield report
+        finally:
+            _forget_operation_state()
+
+
+def _stack_steps(stack: DeviceStack) -> list[_Step]:
+    if stack.encrypt and stack.pass_cmd is None:
+        raise ValueError(f"Encrypting {stack.device} requires a password command!")
+    if (stack.owner is not None or stack.symlink is not None) and not stack.mount:
+        raise ValueError(f"Owner and symbolic link of {stack.device} require mount!")
+    layers: list[tuple[bool, str, _StepFunction]] = [
+        (stack.encrypt, "encrypt", _encrypt_step),
+        (stack.pass_cmd is not None, "decrypt", _decrypt_step),
+        (stack.filesystem is not None, "mkfs", _mkfs_step),
+        (stack.mount, "mount", _mount_step),
+        (stack.owner is not None, "chown", _chown_step),
+        (stack.symlink is not None, "symlink", _symlink_step),
+    ]
+    steps: list[_Step] = []
+    for requested, layer, run in layers:
+        if requested:
+            dependencies = (steps[-1].name,) if steps else ()
+            steps.append(_Step(f"{stack.device}:{layer}", run, stack, dependencies))
+    return steps
+
+
+def _top_device(stack: DeviceStack, report: PlanReport) -> Path:
+    return report.decrypted.get(stack.device, stack.device)
+
+
+def _encrypt_step(
+    stack: DeviceStack, report: PlanReport, undo: contextlib.ExitStack
+) -> None:
+    assert stack.pass_cmd is not None
+    encrypt_device(stack.device, stack.pass_cmd)
+
+
+def _decrypt_step(
+    stack: DeviceStack, report: PlanReport, undo: contextlib.ExitStack
+) -> None:
+    assert stack.pass_cmd is not None
+    decrypted = decrypted_device(stack.device, stack.pass_cmd)
+    report.decrypted[stack.device] = undo.enter_context(decrypted)
+
+
+def _mkfs_step(
+    stack: DeviceStack, report: PlanReport, undo: contextlib.ExitStack
+) -> None:
+    assert stack.filesystem is not None
+    mkfs(_top_device(stack, report), stack.filesystem)
+
+
+def _mount_step(
+    stack: DeviceStack, report: PlanReport, undo: contextlib.ExitStack
+) -> None:
+    mounted = mounted_device(_top_device(stack, report), stack.compression)
+    report.mount_points[stack.device] = undo.enter_context(mounted)
+
+
+def _chown_step(
+    stack: DeviceStack, report: PlanReport, undo: contextlib.ExitStack
+) -> None:
+    assert stack.owner is not None
+    chown(report.mount_points[stack.device], stack.owner, recursive=False)
+
+
+def _symlink_step(
+    stack: DeviceStack, report: PlanReport, undo: contextlib.ExitStack
+) -> None:
+    assert stack.symlink is not None
+    link = symbolic_link(report.mount_points[stack.device], stack.symlink)
+    undo.enter_context(link)
+
+
+def _execute_steps(
+    steps: Sequence[_Step],
+    undo_stack: contextlib.ExitStack,
+    report: PlanReport,
+    max_workers: int,
+) -> None:
+    pending = {step.name: step for step in steps}
+    completed: set[str] = set()
+    running: dict[Future[contextlib.ExitStack], _Step] = {}
+    errors: list[BaseException] = []
+    origin = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            running.update(
+                (
+                    executor.submit(
+                        contextvars.copy_context().run, _run_step, step, origin, report
+                    ),
+                    step,
+                )
+                for step in _pop_ready_steps(pending, completed)
+            )
+            if not running:
+                raise ValueError(f"Steps {sorted(pending)} cannot be scheduled!")
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                if (error := future.exception()) is not None:
+                    errors.append(error)
+                    # Let running steps finish, but do not start new ones.
+                    pending.clear()
+                else:
+                    undo_stack.enter_context(future.result())
+                    completed.add(step.name)
+    if errors:
+        raise errors[0]
+
+
+def _pop_ready_steps(pending: dict[str, _Step], completed: set[str]) -> list[_Step]:
+    ready = [
+        step
+        for step in pending.values()
+        if all(dependency in completed for dependency in step.dependencies)
+    ]
+    for step in ready:
+        del pending[step.name]
+    return ready
+
+
+def _run_step(step: _Step, origin: float, report: PlanReport) -> contextlib.ExitStack:
+    start = time.monotonic()
+    with contextlib.ExitStack() as undo:
+        step.run(step.stack, report, undo)
+        seconds = time.monotonic() - start
+        report.timings.append(StepTiming(step.name, start - origin, seconds))
+        logger.info(
+            "Schritt {step} nach {seconds:.3f}s abgeschlossen.",
+            step=step.name,
+            seconds=seconds,
+        )
+        return undo.pop_all()
+
+
+def _critical_path(steps: Sequence[_Step], timings: Sequence[StepTiming]) -> list[str]:
+    dependencies = {step.name: step.dependencies for step in steps}
+    # Timings are ordered by completion, which is a topological order.
+    longest: dict[str, tuple[float, list[str]]] = {}
+    for timing in timings:
+        predecessors = [longest[dep] for dep in dependencies[timing.name]]
+        length, path = max(predecessors, default=(0.0, []), key=lambda lp: lp[0])
+        longest[timing.name] = (length + timing.seconds, [*path, timing.name])
+    _, critical = max(longest.values(), default=(0.0, []), key=lambda lp: lp[0])
+    return critical
@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import collections
+import contextvars
+import functools
+import typing as t
+from collections.abc import Callable, Collection, Iterable, Mapping, Sequence
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+from pathlib import Path
+
+import shell_interface as sh
+
+from ._backend import _run_cmd
+from ._crypt import close_decrypted_device
+from ._log import logger
+from ._mounts import get_mounted_devices, sync_device
+from ._operation import operation
+from ._types import InvalidDecryptedDevice, UnmountError
+
+if t.TYPE_CHECKING:
+    from ._iostat import _MountInfo
+
+
+def unmount_all(devices: Iterable[Path], *, jobs: int | None = None) -> None:
+    """Unmount several devices in parallel
+
+    This function unmounts all mount points of the given devices, like calling
+    `unmount_device` for each of them, but tears them down concurrently. Instead
+    of mount sources, mount directories can be given as well.
+
+    Each file system is synced once before unmounting, and all file systems are
+    synced in parallel. Failing to sync does not prevent unmounting, since
+    `umount` writes pending data back as well.
+
+    The mount points are ordered by the hierarchy of `/proc/self/mountinfo`, so
+    that mounts nested into others are unmounted first. Mount points that do not
+    contain each other are unmounted concurrently. If a nested mount cannot be
+    unmounted, the mount containing it is not unmounted either.
+
+    Parameters:
+    -----------
+    devices
+        devices or mount directories to be unmounted
+    jobs
+        maximum number of concurrent commands; defaults to one per mount point
+
+    Raises:
+    -------
+    ExceptionGroup
+        if any device could not be synced or unmounted, containing all errors,
+        e.g. an `UnmountError` per mount point that is still mounted
+    """
+    devices = list(devices)
+    with operation():
+        errors = _unmount_all(devices, jobs)
+    if errors:
+        raise ExceptionGroup("Failed to unmount devices", errors)
+    logger.success("Speichermedien {devices} erfolgreich ausgehängt.", devices=devices)
+
+
+def close_all(
+    devices: Iterable[Path], *, revoke_key: bool = False, jobs: int | None = None
+) -> None:
+    """Unmount and close several decrypted devices in parallel
+
+    Mounted devices are unmounted first, as done by `unmount_all`. Afterwards, all
+    devices are closed concurrently, as done by `close_decrypted_device`. Devices
+    that could not be unmounted are not closed.
+
+    Parameters:
+    -----------
+    devices
+        decrypted devices, i.e. paths in `/dev/mapper`
+    revoke_key
+        whether to revoke the volume keys cached in the kernel keyring
+    jobs
+        maximum number of concurrent commands; defaults to one per device or
+        mount point
+
+    Raises:
+    -------
+    ExceptionGroup
+        if any device could not be unmounted or closed, containing all errors,
+        e.g. `UnmountError`, `InvalidDecryptedDevice` or
+        `shell_interface.ShellInterfaceError`
+    """
+    devices = list(devices)
+    with operation():
+        mounted = get_mounted_devices()
+        to_unmount = [dev for dev in devices if str(dev) in mounted]
+        errors = _unmount_all(to_unmount, jobs)
+        busy = {str(dev) for dev in to_unmount if str(dev) in get_mounted_devices()}
+        errors.extend(
+            _run_parallel(
+                functools.partial(close_decrypted_device, revoke_key=revoke_key),
+                [dev for dev in devices if str(dev) not in busy],
+                jobs,
+                (InvalidDecryptedDevice, sh.ShellInterfaceError),
+            )
+        )
+    if errors:
+        raise ExceptionGroup("Failed to close devices", errors)
+    logger.success(
+        "Verschlüsselung der Speichermedien {devices} erfolgreich geschlossen.",
+        devices=devices,
+    )
+
+
+def _unmount_all(devices: Sequence[Path], jobs: int | None) -> list[Exception]:
+    mounted = get_mounted_devices()
+    sources = {}
+    errors: list[Exception] = []
+    for device in devices:
+        device_sources = _mount_sources(device, mounted)
+        if not device_sources:
+            errors.append(UnmountError(f"{device} is not mounted!"))
+        sources.update(device_sources)
+    errors.extend(
+        _run_parallel(
+            sync_device,
+            [Path(src) for src in set(sources.values())],
+            jobs,
+            (sh.ShellInterfaceError,),
+        )
+    )
+    parents = _parent_mounts(sources)
+    with ThreadPoolExecutor(max_workers=jobs or max(len(parents), 1)) as executor:
+        errors.extend(_UnmountScheduler(parents, executor).run().values())
+    return errors
+
+
+def _mount_sources(
+    device: Path, mounted: Mapping[str, Mapping[Path, object]]
+) -> dict[Path, str]:
+    """Map the mount points of `device` to their mount source"""
+    if str(device) in mounted:
+        return dict.fromkeys(mounted[str(device)], str(device))
+    return {
+        mount_dir: source
+        for source, mount_dirs in mounted.items()
+        for mount_dir in mount_dirs
+        if mount_dir == device
+    }
+
+
+def _run_parallel(
+    function: Callable[[Path], object],
+    devices: Sequence[Path],
+    jobs: int | None,
+    expected: tuple[type[Exception], ...],
+) -> list[Exception]:
+    with ThreadPoolExecutor(max_workers=jobs or max(len(devices), 1)) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, function, device)
+            for device in devices
+        ]
+    errors = []
+    for future in futures:
+        error = future.exception()
+        if isinstance(error, expected):
+            errors.append(error)
+        elif error is not None:
+            raise error
+    return errors
+
+
+def _parent_mounts(mount_dirs: Collection[Path]) -> dict[Path, Path | None]:
+    """Map each mount point to the closest of `mount_dirs` it is nested into
+
+    Mount points missing from `/proc/self/mountinfo` are treated as not nested.
+    """
+    from ._iostat import _read_mountinfo  # noqa: PLC0415
+
+    entries = _read_mountinfo()
+    by_id = {entry.mount_id: entry for entry in entries}
+    # Later lines are mounted on top of earlier ones.
+    topmost = {entry.target: entry for entry in entries}
+    return {
+        mount_dir: _nested_into(topmost.get(mount_dir), by_id, mount_dirs)
+        for mount_dir in mount_dirs
+    }
+
+
+def _nested_into(
+    entry: _MountInfo | None,
+    by_id: Mapping[int, _MountInfo],
+    mount_dirs: Collection[Path],
+) -> Path | None:
+    if entry is None:
+        return None
+    seen = {entry.mount_id}
+    parent = by_id.get(entry.parent_id)
+    # The parent of the root mount is not listed or the root mount itself.
+    while parent is not None and parent.mount_id not in seen:
+        if parent.target != entry.target and parent.target in mount_dirs:
+            return parent.target
+        seen.add(parent.mount_id)
+        parent = by_id.get(parent.parent_id)
+    return None
+
+
+def _unmount(mount_dir: Path) -> None:
+    cmd: sh.StrPathList = ["sudo", "umount", mount_dir]
+    try:
+        _run_cmd(cmd)
+    except sh.ShellInterfaceError as e:
+        raise UnmountError(f"Failed to unmount {mount_dir}!") from e
+
+
+def _unmount_error(future: Future[None]) -> UnmountError | None:
+    error = future.exception()
+    if error is not None and not isinstance(error, UnmountError):
+        raise error
+    return error
+
+
+class _UnmountScheduler:
+    """Unmount mount points as soon as all mounts nested into them are unmounted"""
+
+    def __init__(self, parents: Mapping[Path, Path | None], executor: Executor) -> None:
+        self._parents = parents
+        self._executor = executor
+        self._waiting = collections.Counter(
+            parent for parent in parents.values() if parent is not None
+        )
+        self._blocked: set[Path] = set()
+        self._pending: dict[Future[None], Path] = {}
+        self._errors: dict[Path, UnmountError] = {}
+
+    def run(self) -> dict[Path, UnmountError]:
+        for mount_dir in self._parents:
+            if not self._waiting[mount_dir]:
+                self._submit(mount_dir)
+        while self._pending:
+            done, _ = wait_futures(self._pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                self._finish(self._pending.pop(future), _unmount_error(future))
+        return self._errors
+
+    def _submit(self, mount_dir: Path) -> None:
+        future = self._executor.submit(
+            contextvars.copy_context().run, _unmount, mount_dir
+        )
+        self._pending[future] = mount_dir
+
+    def _finish(self, mount_dir: Path, error: UnmountError | None) -> None:
+        if error is not None:
+            self._errors[mount_dir] = error
+        parent = self._parents[mount_dir]
+        if parent is None:
+            return
+        if error is not None:
+            self._blocked.add(parent)
+        self._waiting[parent] -= 1
+        if self._waiting[parent]:
+            return
+        if parent in self._blocked:
+            blocked = UnmountError(f"Nested mounts of {parent} are still mounted!")
+            self._finish(parent, blocked)
+        else:
+            self._submit(parent)
@@ -0,0 +1,189 @@
+import fcntl
+import os
+import re
+import struct
+import time
+from pathlib import Path
+
+import shell_interface as sh
+
+from ._backend import _run_cmd
+from ._instrumentation import _instrumented
+from ._iostat import _mount_info
+from ._log import logger
+from ._types import TrimRange, TrimStatistics
+
+# From linux/fs.h: _IOWR('X', 121, struct fstrim_range)
+_FITRIM = 0xC0185879
+# struct fstrim_range { __u64 start; __u64 len; __u64 minlen; }
+_FSTRIM_RANGE = struct.Struct("QQQ")
+_UNLIMITED = 2**64 - 1
+# From linux/fs.h: _IOR(0x12, 114, size_t)
+_BLKGETSIZE64 = 0x80081272
+_DEVICE_SIZE = struct.Struct("Q")
+_FSTRIM_OUTPUT = re.compile(rb"\((\d+) bytes\)")
+# e.g. "item 2 key (FIRST_CHUNK_TREE CHUNK_ITEM 22020096) itemoff 15975 ..."
+#      "        length 8388608 owner 2 stripe_len 65536 type SYSTEM|DUP"
+_CHUNK_ITEM = re.compile(rb"CHUNK_ITEM (\d+)\).*\n\s+length (\d+)")
+
+
+def trim_filesystem(
+    mount_dir: Path, trim_range: TrimRange | None = None
+) -> TrimStatistics:
+    """Discard the unused blocks of a mounted file system
+
+    This function issues `FITRIM` on `mount_dir`, telling the underlying devices
+    which blocks are unused. This keeps the write performance of SSDs up without
+    mounting with `discard`, which slows down every write.
+
+    Trimming a large file system can take long. To bound the duration of a pass,
+    only a part of the file system can be trimmed via `trim_range`. The returned
+    `next_offset` allows to continue with the next part in a later pass, e.g.
+    after each backup job or from a timer. Once a range reaches the end of the
+    file system, the cycle starts over at offset 0.
+
+    Offsets are interpreted by the file system. For BtrFS, they are logical
+    addresses of its block groups, not positions on the device. Logical
+    addresses only grow when block groups are reallocated, e.g. by a balance, so
+    they can exceed the device size. Therefore, the cycle of BtrFS ends at the
+    end of its last block group, read from the chunk tree. For other file
+    systems, it ends at the size of the mounted block device, or at the size
+    reported by `statvfs` if the source is no block device, e.g. for tmpfs.
+
+    The ioctl requires root privileges. If they are missing, `fstrim` is run via
+    `sudo` instead.
+
+    Discards only reach the physical device if every layer passes them on. In
+    particular, dm-crypt mappings must be opened with `allow_discards=True`.
+
+    Parameters:
+    -----------
+    mount_dir
+        mount point of the file system to trim
+    trim_range
+        part of the file system to trim; the whole file system by default
+
+    Returns:
+    --------
+    TrimStatistics
+        bytes trimmed, duration and where to continue
+
+    Raises:
+    -------
+    OSError
+        if the file system or a device beneath it does not support discards
+    shell_interface.ShellInterfaceError
+        if `fstrim` fails
+    """
+    trim_range = trim_range or TrimRange()
+    start = time.perf_counter()
+    try:
+        trimmed = _fitrim(mount_dir, trim_range)
+    except PermissionError:
+        trimmed = _fstrim(mount_dir, trim_range)
+    statistics = TrimStatistics(
+        mount_dir=mount_dir,
+        bytes_trimmed=trimmed,
+        seconds=time.perf_counter() - start,
+        next_offset=_next_offset(mount_dir, trim_range),
+    )
+    logger.success(
+        "{n_bytes} Bytes von {mount_dir} in {seconds:.2f}s getrimmt.",
+        n_bytes=statistics.bytes_trimmed,
+        mount_dir=mount_dir,
+        seconds=statistics.seconds,
+    )
+    return statistics
+
+
+def _fitrim(mount_dir: Path, trim_range: TrimRange) -> int:
+    length = _UNLIMITED if trim_range.length is None else trim_range.length
+    buffer = bytearray(
+        _FSTRIM_RANGE.pack(trim_range.offset, length, trim_range.minimum)
+    )
+    fd = os.open(mount_dir, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        with _instrumented(["ioctl FITRIM", mount_dir]):
+            fcntl.ioctl(fd, _FITRIM, buffer)
+    finally:
+        os.close(fd)
+    # The kernel replaces `len` by the number of bytes trimmed.
+    return int(_FSTRIM_RANGE.unpack(buffer)[1])
+
+
+def _fstrim(mount_dir: Path, trim_range: TrimRange) -> int:
+    cmd: sh.StrPathList = [
+        "sudo",
+        "fstrim",
+        "--verbose",
+        "--offset",
+        str(trim_range.offset),
+        "--minimum",
+        str(trim_range.minimum),
+        mount_dir,
+    ]
+    if trim_range.length is not None:
+        cmd.extend(["--length", str(trim_range.length)])
+    output = _run_cmd(cmd, capture_output=True).stdout
+    match = _FSTRIM_OUTPUT.search(output)
+    return 0 if match is None else int(match[1])
+
+
+def _next_offset(mount_dir: Path, trim_range: TrimRange) -> int:
+    if trim_range.length is None:
+        return 0
+    end = trim_range.offset + trim_range.length
+    # FITRIM only reports the bytes trimmed, so the end of the file system is
+    # looked up separately.
+    return 0 if end >= _filesystem_end(mount_dir) else end
+
+
+def _filesystem_end(mount_dir: Path) -> int:
+    try:
+        mount = _mount_info(mount_dir)
+    except ValueError:
+        # A directory within a file system, which FITRIM accepts as well.
+        return _statvfs_size(mount_dir)
+    source = Path(mount.source)
+    if mount.filesystem == "btrfs":
+        return _btrfs_logical_end(source) or _statvfs_size(mount_dir)
+    if source.is_block_device():
+        # File system statistics understate the device size by the metadata.
+        return _device_size(source)
+    return _statvfs_size(mount_dir)
+
+
+def _btrfs_logical_end(device: Path) -> int:
+    cmd: sh.StrPathList = [
+        "sudo",
+        "btrfs",
+        "inspect-internal",
+        "dump-tree",
+        "-t",
+        "chunk",
+        device,
+    ]
+    output = _run_cmd(cmd, capture_output=True).stdout
+    return max(
+        (int(start) + int(length) for start, length in _CHUNK_ITEM.findall(output)),
+        default=0,
+    )
+
+
+def _statvfs_size(mount_dir: Path) -> int:
+    stat = os.statvfs(mount_dir)
+    return stat.f_blocks * stat.f_frsize
+
+
+def _device_size(device: Path) -> int:
+    try:
+        fd = os.open(device, os.O_RDONLY)
+    except PermissionError:
+        cmd: sh.StrPathList = ["sudo", "blockdev", "--getsize64", device]
+        return int(_run_cmd(cmd, capture_output=True).stdout)
+    buffer = bytearray(_DEVICE_SIZE.size)
+    try:
+        fcntl.ioctl(fd, _BLKGETSIZE64, buffer)
+    finally:
+        os.close(fd)
+    return int(_DEVICE_SIZE.unpack(buffer)[0])
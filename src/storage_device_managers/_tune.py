@@ -0,0 +1,160 @@
+import contextlib
+from collections.abc import Iterator
+from pathlib import Path
+
+import shell_interface as sh
+
+from ._backend import _run_cmd
+from ._filesystems import get_filesystem
+from ._log import logger
+from ._mounts import get_mounted_devices, mounted_device
+from ._types import (
+    BtrfsTuneSettings,
+    Ext4TuneSettings,
+    FilesystemMountedError,
+    TuneSettings,
+)
+
+
+def tune_btrfs(device: Path, settings: BtrfsTuneSettings) -> None:
+    """Change properties of an existing BtrFS
+
+    The compression properties are set via `btrfs property`, copy-on-write is
+    disabled via `chattr +C`. Both require the file system to be mounted. If it
+    is not, it is mounted for the duration of the changes.
+
+    Parameters:
+    -----------
+    device
+        device carrying the file system
+    settings
+        properties to change
+    """
+    if not settings.compression and not settings.nodatacow:
+        return
+    with _mount_point(device) as mount_dir:
+        for rel_path, compression in settings.compression.items():
+            cmd: sh.StrPathList = [
+                "sudo",
+                "btrfs",
+                "property",
+                "set",
+                mount_dir / rel_path,
+                "compression",
+                compression,
+            ]
+            _run_cmd(cmd)
+        if settings.nodatacow:
+            paths = [mount_dir / rel_path for rel_path in settings.nodatacow]
+            _run_cmd(["sudo", "chattr", "+C", *paths])
+    logger.success(
+        "Eigenschaften des Dateisystems auf {device} erfolgreich geändert.",
+        device=device,
+    )
+
+
+def tune_ext4(device: Path, settings: Ext4TuneSettings) -> None:
+    """Change settings of an existing ext4 using `tune2fs`
+
+    The journalling mode and reserved blocks can be changed while the file system
+    is mounted. Enabling fast commits and resizing the journal require it to be
+    unmounted.
+
+    Parameters:
+    -----------
+    device
+        device carrying the file system
+    settings
+        settings to change
+
+    Raises:
+    -------
+    FilesystemMountedError
+        if the settings require the file system to be unmounted, but it is
+        mounted
+    """
+    needs_unmount = (
+        settings.fast_commit is not None or settings.journal_size is not None
+    )
+    if needs_unmount and str(device) in get_mounted_devices():
+        raise FilesystemMountedError(
+            f"Device {device} must be unmounted to change its journal!"
+        )
+    for args in _tune2fs_args(settings):
+        cmd: sh.StrPathList = ["sudo", "tune2fs", *args, device]
+        _run_cmd(cmd)
+    logger.success(
+        "Einstellungen des Dateisystems auf {device} erfolgreich geändert.",
+        device=device,
+    )
+
+
+def tune_filesystem(device: Path, settings: TuneSettings) -> None:
+    """Change settings of an existing file system without knowing its type
+
+    This function detects the file system of `device` and applies `settings`
+    using the appropriate tune function.
+
+    Parameters:
+    -----------
+    device
+        device carrying the file system
+    settings
+        settings to change; must match the file system of `device`
+
+    Raises:
+    -------
+    TypeError
+        if `settings` are not meant for the file system of `device`
+    ValueError
+        if the file system of `device` cannot be tuned
+    FilesystemMountedError
+        if the settings require the file system to be unmounted, but it is
+        mounted
+    """
+    fs = get_filesystem(device)
+    match fs:
+        case "btrfs":
+            if isinstance(settings, Ext4TuneSettings):
+                raise TypeError(f"Settings {settings} cannot be used for BtrFS!")
+            tune_btrfs(device, settings)
+        case "ext4":
+            if isinstance(settings, BtrfsTuneSettings):
+                raise TypeError(f"Settings {settings} cannot be used for ext4!")
+            tune_ext4(device, settings)
+        case _:
+            raise ValueError(f"Tuning {fs} is not supported!")
+
+
+@contextlib.contextmanager
+def _mount_point(device: Path) -> Iterator[Path]:
+    mount_dirs = get_mounted_devices().get(str(device))
+    if mount_dirs:
+        yield next(iter(mount_dirs))
+        return
+    with mounted_device(device) as mount_dir:
+        yield mount_dir
+
+
+def _tune2fs_args(settings: Ext4TuneSettings) -> list[list[str]]:
+    """Translate `settings` into the arguments of consecutive `tune2fs` calls
+
+    The journal has to be removed and created again in separate calls before
+    features relying on it, like `fast_commit`, can be enabled.
+    """
+    calls = []
+    if settings.journal_size is not None:
+        calls.append(["-O", "^has_journal"])
+        calls.append(["-J", f"size={settings.journal_size}"])
+    args = []
+    if settings.fast_commit is not None:
+        args.extend(["-O", "fast_commit" if settings.fast_commit else "^fast_commit"])
+    if settings.journal_mode is not None:
+        # The modes share a bit field, which is cleared by removing the mode
+        # setting all its bits.
+        args.extend(["-o", f"^journal_data_writeback,{settings.journal_mode}"])
+    if settings.reserved_blocks_percentage is not None:
+        args.extend(["-m", str(settings.reserved_blocks_percentage)])
+    if args:
+        calls.append(args)
+    return calls
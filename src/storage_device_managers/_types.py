@@ -0,0 +1,755 @@
+from __future__ import annotations
+
+import dataclasses
+import enum
+import typing as t
+from collections.abc import Callable, Sequence
+from pathlib import Path
+
+if t.TYPE_CHECKING:
+    from uuid import UUID
+
+Devices = Path | Sequence[Path]
+MountOptions = frozenset[str]
+
+
+ValidFileSystems = t.Literal["btrfs", "ext4"]
+BtrfsPropertyCompressions = t.Literal["lzo", "zlib", "zstd", "none"]
+
+
+class DeviceDecryptionError(RuntimeError):
+    pass
+
+
+class DeviceNotFoundError(RuntimeError):
+    pass
+
+
+class InvalidDecryptedDevice(ValueError):
+    pass
+
+
+class UnmountError(RuntimeError):
+    pass
+
+
+class SubvolumeDeletionError(RuntimeError):
+    pass
+
+
+class SendReceiveError(RuntimeError):
+    pass
+
+
+class FilesystemMountedError(RuntimeError):
+    pass
+
+
+class ValidCompressions(enum.StrEnum):
+    LZO = "lzo"
+    ZLIB = "zlib"
+    ZLIB1 = "zlib:1"
+    ZLIB2 = "zlib:2"
+    ZLIB3 = "zlib:3"
+    ZLIB4 = "zlib:4"
+    ZLIB5 = "zlib:5"
+    ZLIB6 = "zlib:6"
+    ZLIB7 = "zlib:7"
+    ZLIB8 = "zlib:8"
+    ZLIB9 = "zlib:9"
+    ZSTD = "zstd"
+    ZSTD1 = "zstd:1"
+    ZSTD2 = "zstd:2"
+    ZSTD3 = "zstd:3"
+    ZSTD4 = "zstd:4"
+    ZSTD5 = "zstd:5"
+    ZSTD6 = "zstd:6"
+    ZSTD7 = "zstd:7"
+    ZSTD8 = "zstd:8"
+    ZSTD9 = "zstd:9"
+    ZSTD10 = "zstd:10"
+    ZSTD11 = "zstd:11"
+    ZSTD12 = "zstd:12"
+    ZSTD13 = "zstd:13"
+    ZSTD14 = "zstd:14"
+    ZSTD15 = "zstd:15"
+
+
+class ChecksumAlgorithms(enum.StrEnum):
+    CRC32C = "crc32c"
+    XXHASH = "xxhash"
+    SHA256 = "sha256"
+    BLAKE2 = "blake2"
+
+
+class BtrfsProfiles(enum.StrEnum):
+    SINGLE = "single"
+    DUP = "dup"
+    RAID0 = "raid0"
+    RAID1 = "raid1"
+    RAID1C3 = "raid1c3"
+    RAID1C4 = "raid1c4"
+    RAID10 = "raid10"
+    RAID5 = "raid5"
+    RAID6 = "raid6"
+
+
+class MkfsProfiles(enum.StrEnum):
+    """Named sets of file system creation options
+
+    FAST_PROVISION
+        Make the file system usable at full speed right after the first mount.
+        Discarding the whole device is skipped. Inode tables and journal of ext4
+        are zeroed by `mkfs` instead of by the kernel in the background.
+    LARGE_FILES
+        Tune the file system for few, big files like backup archives or disk images.
+    """
+
+    FAST_PROVISION = "fast_provision"
+    LARGE_FILES = "large_files"
+
+
+@dataclasses.dataclass(frozen=True)
+class BtrfsMkfsOptions:
+    """Options passed to `mkfs.btrfs`
+
+    All options default to the choice of `mkfs.btrfs`.
+
+    Attributes:
+    -----------
+    label
+        label of the new file system
+    uuid
+        UUID of the new file system
+    nodesize
+        size of B-tree nodes in bytes
+    sectorsize
+        size of data blocks in bytes
+    nodiscard
+        whether to skip discarding the whole device before formatting
+    checksum
+        checksum algorithm for data and metadata
+    block_group_tree
+        whether to store block group items in a separate tree, which speeds up
+        mounting large file systems considerably
+    data_profile
+        how data is spread over the devices of a multi-device file system
+    metadata_profile
+        how metadata is spread over the devices of a multi-device file system
+    """
+
+    label: str | None = None
+    uuid: UUID | None = None
+    nodesize: int | None = None
+    sectorsize: int | None = None
+    nodiscard: bool = False
+    checksum: ChecksumAlgorithms | None = None
+    block_group_tree: bool = False
+    data_profile: BtrfsProfiles | None = None
+    metadata_profile: BtrfsProfiles | None = None
+
+
+@dataclasses.dataclass(frozen=True)
+class Ext4MkfsOptions:
+    """Options passed to `mkfs.ext4`
+
+    All options default to the choice of `mkfs.ext4`.
+
+    Attributes:
+    -----------
+    label
+        label of the new file system
+    uuid
+        UUID of the new file system
+    lazy_itable_init
+        whether inode tables are zeroed lazily by the kernel after mounting instead
+        of by `mkfs.ext4`
+    lazy_journal_init
+        whether zeroing the journal is skipped
+    nodiscard
+        whether to skip discarding the whole device before formatting
+    journal
+        whether to create a journal; `False` translates to `-O ^has_journal`
+    stride
+        RAID stride in file system blocks
+    stripe_width
+        RAID stripe width in file system blocks
+    bytes_per_inode
+        bytes per inode; large values reserve less space for inodes
+    """
+
+    label: str | None = None
+    uuid: UUID | None = None
+    lazy_itable_init: bool | None = None
+    lazy_journal_init: bool | None = None
+    nodiscard: bool = False
+    journal: bool = True
+    stride: int | None = None
+    stripe_width: int | None = None
+    bytes_per_inode: int | None = None
+
+
+MkfsOptions = BtrfsMkfsOptions | Ext4MkfsOptions
+
+
+class Ext4JournalModes(enum.StrEnum):
+    """Journalling modes of ext4, as default mount options set by `tune2fs -o`
+
+    JOURNAL
+        Journal data and metadata; safest and slowest.
+    ORDERED
+        Journal metadata after the data was written; the default of ext4.
+    WRITEBACK
+        Journal metadata only, without ordering it after the data.
+    """
+
+    JOURNAL = "journal_data"
+    ORDERED = "journal_data_ordered"
+    WRITEBACK = "journal_data_writeback"
+
+
+@dataclasses.dataclass(frozen=True)
+class BtrfsTuneSettings:
+    """Settings of an existing BtrFS changed by `tune_btrfs`
+
+    Paths are relative to the mount point of the file system. If it is not
+    mounted, it is mounted temporarily, exposing its default subvolume. Options
+    left empty are not changed.
+
+    Attributes:
+    -----------
+    compression
+        compression property per subvolume, directory or file; applies to data
+        written afterwards. Compression levels can only be set as mount option.
+    nodatacow
+        directories or empty files to disable copy-on-write and checksums for,
+        e.g. folders of VM images. Files created in such directories inherit the
+        setting.
+    """
+
+    compression: t.Mapping[str, BtrfsPropertyCompressions] = dataclasses.field(
+        default_factory=dict
+    )
+    nodatacow: Sequence[str] = ()
+
+
+@dataclasses.dataclass(frozen=True)
+class Ext4TuneSettings:
+    """Settings of an existing ext4 changed by `tune_ext4`
+
+    Options left at None are not changed. Changing `fast_commit` or
+    `journal_size` requires the file system to be unmounted.
+
+    Attributes:
+    -----------
+    fast_commit
+        whether to log small metadata changes in a compact format, which speeds
+        up `fsync` considerably
+    journal_size
+        size of the journal in MiB; the journal is removed and created again
+    journal_mode
+        default journalling mode, which can still be overridden on mount
+    reserved_blocks_percentage
+        percentage of blocks reserved for root
+    """
+
+    fast_commit: bool | None = None
+    journal_size: int | None = None
+    journal_mode: Ext4JournalModes | None = None
+    reserved_blocks_percentage: float | None = None
+
+
+TuneSettings = BtrfsTuneSettings | Ext4TuneSettings
+
+
+@dataclasses.dataclass(frozen=True)
+class VolumeKeyCache:
+    """Caching of LUKS2 volume keys in the kernel keyring
+
+    When opening a device with a cache, the volume key is linked into `keyring`
+    as `user` key named after the device's LUKS UUID and expires after `ttl`
+    seconds. Until then, the device can be opened again without running the
+    password command and without the costly key derivation.
+
+    This requires LUKS2, cryptsetup 2.7 or newer and `keyctl` from keyutils.
+    Note that any process of root can use the cached key while it is valid.
+
+    Attributes:
+    -----------
+    ttl
+        seconds after which the cached key expires
+    keyring
+        keyring to link the key into, in the notation of `keyctl`; the user
+        keyring of root by default, which outlives single `sudo` invocations
+    """
+
+    ttl: int = 300
+    keyring: str = "@u"
+
+
+@dataclasses.dataclass(frozen=True)
+class TransferStatistics:
+    """Amount and duration of a data transfer
+
+    Attributes:
+    -----------
+    total_bytes
+        number of bytes transferred
+    seconds
+        wall clock time the transfer took
+    """
+
+    total_bytes: int
+    seconds: float
+
+    @property
+    def bytes_per_second(self) -> float:
+        if self.seconds <= 0:
+            return 0.0
+        return self.total_bytes / self.seconds
+
+
+@dataclasses.dataclass(frozen=True)
+class ManifestStatistics:
+    """Outcome of updating or verifying a content manifest
+
+    Attributes:
+    -----------
+    manifest
+        path of the manifest
+    n_files
+        number of files listed in the manifest
+    n_hashed
+        number of files whose content was hashed
+    bytes_hashed
+        number of bytes hashed
+    seconds
+        wall clock time the run took
+    missing
+        relative paths of listed files that no longer exist; only set by
+        `verify_manifest`
+    mismatched
+        relative paths of files whose content does not match the manifest; only
+        set by `verify_manifest`
+    """
+
+    manifest: Path
+    n_files: int
+    n_hashed: int
+    bytes_hashed: int
+    seconds: float
+    missing: tuple[str, ...] = ()
+    mismatched: tuple[str, ...] = ()
+
+    @property
+    def bytes_per_second(self) -> float:
+        if self.seconds <= 0:
+            return 0.0
+        return self.bytes_hashed / self.seconds
+
+
+@dataclasses.dataclass(frozen=True)
+class BtrfsSpaceInfo:
+    """Allocation of one kind of BtrFS block group with one profile
+
+    Attributes:
+    -----------
+    kind
+        `"data"`, `"metadata"`, `"system"`, `"data+metadata"` for mixed block
+        groups, or `"global reserve"`
+    profile
+        replication profile of the block groups
+    total_bytes
+        bytes allocated to block groups of this kind and profile
+    used_bytes
+        bytes used within these block groups
+    """
+
+    kind: str
+    profile: BtrfsProfiles
+    total_bytes: int
+    used_bytes: int
+
+
+@dataclasses.dataclass(frozen=True)
+class DeviceUsage:
+    """Size and free space of a mounted file system
+
+    Attributes:
+    -----------
+    mount_dir
+        mount point the values were read from
+    total_bytes
+        size of the file system
+    free_bytes
+        free bytes, including those reserved for root
+    available_bytes
+        free bytes available to unprivileged users
+    btrfs_spaces
+        allocation per block group kind and profile; empty for other file systems
+    """
+
+    mount_dir: Path
+    total_bytes: int
+    free_bytes: int
+    available_bytes: int
+    btrfs_spaces: tuple[BtrfsSpaceInfo, ...] = ()
+
+    @property
+    def used_bytes(self) -> int:
+        return self.total_bytes - self.free_bytes
+
+
+@dataclasses.dataclass(frozen=True)
+class TrimRange:
+    """Part of a file system whose free space is discarded by one trim pass
+
+    Attributes:
+    -----------
+    offset
+        byte offset within the file system at which to start
+    length
+        number of bytes to cover; the whole file system after `offset` if None
+    minimum
+        smallest contiguous free range to discard, in bytes; smaller ranges are
+        skipped, which speeds up trimming fragmented file systems
+    """
+
+    offset: int = 0
+    length: int | None = None
+    minimum: int = 0
+
+
+@dataclasses.dataclass(frozen=True)
+class TrimStatistics:
+    """Result of one trim pass
+
+    Attributes:
+    -----------
+    mount_dir
+        mount point of the trimmed file system
+    bytes_trimmed
+        number of bytes discarded, as reported by the file system
+    seconds
+        wall clock time the pass took
+    next_offset
+        offset at which the next pass should start to continue where this one
+        stopped; 0 once the end of the file system was reached
+    """
+
+    mount_dir: Path
+    bytes_trimmed: int
+    seconds: float
+    next_offset: int
+
+
+@dataclasses.dataclass(frozen=True)
+class BlockQueueTuning:
+    """Tunables of the block layer that affect a device's throughput
+
+    Every attribute left at `None` is not changed.
+
+    Attributes:
+    -----------
+    read_ahead_kb
+        maximum number of kilobytes to read ahead, written to
+        `queue/read_ahead_kb`
+    scheduler
+        I/O scheduler, e.g. `"mq-deadline"`, `"bfq"` or `"none"`, written to
+        `queue/scheduler` of the underlying physical devices
+    nr_requests
+        number of requests that can be queued, written to `queue/nr_requests` of
+        the underlying physical devices
+    max_ratio
+        maximum percentage of the write back cache the device may use, written to
+        the device's `bdi/max_ratio`
+    strict_limit
+        whether `max_ratio` is enforced even if the system is below its global
+        dirty limits, written to the device's `bdi/strict_limit`
+    """
+
+    read_ahead_kb: int | None = None
+    scheduler: str | None = None
+    nr_requests: int | None = None
+    max_ratio: int | None = None
+    strict_limit: bool | None = None
+
+
+@dataclasses.dataclass(frozen=True)
+class IoStatistics:
+    """I/O a block device performed during a period of time
+
+    The values are differences of the counters in `/sys/block/<name>/stat`.
+
+    Attributes:
+    -----------
+    device
+        kernel name of the device, e.g. `"dm-0"` or `"sda2"`
+    seconds
+        wall clock time the statistics cover
+    read_ios
+        number of completed read requests
+    write_ios
+        number of completed write requests
+    read_bytes
+        number of bytes read
+    write_bytes
+        number of bytes written
+    read_seconds
+        time read requests spent waiting and being serviced, summed up
+    write_seconds
+        time write requests spent waiting and being serviced, summed up
+    busy_seconds
+        time the device had requests in flight
+    in_flight_peak
+        largest number of requests in flight observed
+    """
+
+    device: str
+    seconds: float
+    read_ios: int
+    write_ios: int
+    read_bytes: int
+    write_bytes: int
+    read_seconds: float
+    write_seconds: float
+    busy_seconds: float
+    in_flight_peak: int
+
+    @property
+    def iops(self) -> float:
+        if self.seconds <= 0:
+            return 0.0
+        return (self.read_ios + self.write_ios) / self.seconds
+
+    @property
+    def service_time(self) -> float:
+        """Average time in seconds the device was busy per request"""
+        ios = self.read_ios + self.write_ios
+        return self.busy_seconds / ios if ios else 0.0
+
+    @property
+    def read_latency(self) -> float:
+        """Average time in seconds from issuing to completing a read request"""
+        return self.read_seconds / self.read_ios if self.read_ios else 0.0
+
+    @property
+    def write_latency(self) -> float:
+        """Average time in seconds from issuing to completing a write request"""
+        return self.write_seconds / self.write_ios if self.write_ios else 0.0
+
+
+@dataclasses.dataclass(frozen=True)
+class MountDirectory:
+    """Where `mounted_device` creates the directory to mount to
+
+    Attributes:
+    -----------
+    base_dir
+        directory in which the mount directory is created; defaults to
+        `/run/storage-device-managers`, or `$XDG_RUNTIME_DIR/storage-device-managers`
+        if the former is not writable
+    name
+        fixed name of the mount directory; random if neither `name` nor `by_uuid`
+        is given
+    by_uuid
+        whether to name the mount directory after the UUID of the (first) device
+    """
+
+    base_dir: Path | None = None
+    name: str | None = None
+    by_uuid: bool = False
+
+
+@dataclasses.dataclass(frozen=True)
+class DeviceStack:
+    """Description of the storage layers to set up on top of a device
+
+    The layers are set up in the following order, skipping all that are not
+    requested: encrypt, decrypt, format, mount, change owner, create symbolic link.
+
+    Attributes:
+    -----------
+    device
+        file-like object at the bottom of the stack
+    pass_cmd
+        command printing the password; if given, the device is decrypted
+    encrypt
+        whether to encrypt the device first; requires `pass_cmd`
+    filesystem
+        file system to format the (decrypted) device with
+    mount
+        whether to mount the (decrypted) device
+    compression
+        compression level to be used by BtrFS
+    owner
+        user to hand the mount directory to; requires `mount`
+    symlink
+        path of a symbolic link to the mount directory; requires `mount`
+    """
+
+    device: Path
+    pass_cmd: str | None = None
+    encrypt: bool = False
+    filesystem: ValidFileSystems | None = None
+    mount: bool = False
+    compression: ValidCompressions | None = None
+    owner: int | str | None = None
+    symlink: Path | None = None
+
+
+@dataclasses.dataclass(frozen=True)
+class StepTiming:
+    """Start and duration of an executed step
+
+    Attributes:
+    -----------
+    name
+        name of the step, e.g. `"/dev/sdb1:mount"`
+    start
+        seconds between the start of the execution and the start of the step
+    seconds
+        wall clock time the step took
+    """
+
+    name: str
+    start: float
+    seconds: float
+
+
+@dataclasses.dataclass
+class PlanReport:
+    """Outcome of `storage_stacks`
+
+    Attributes:
+    -----------
+    decrypted
+        decrypted device of each device that was decrypted
+    mount_points
+        mount directory of each device that was mounted
+    timings
+        timing of each executed step, in order of completion
+    critical_path
+        names of the steps along the longest chain of dependent steps
+    """
+
+    decrypted: dict[Path, Path] = dataclasses.field(default_factory=dict)
+    mount_points: dict[Path, Path] = dataclasses.field(default_factory=dict)
+    timings: list[StepTiming] = dataclasses.field(default_factory=list)
+    critical_path: list[str] = dataclasses.field(default_factory=list)
+
+
+class IoPriorityClasses(enum.StrEnum):
+    """Scheduling classes of `ioprio_set`, cf. `ionice(1)`
+
+    REALTIME
+        Served before all other classes; requires root privileges.
+    BEST_EFFORT
+        Served according to the level within the class; the default.
+    IDLE
+        Served only when no other process did I/O for a while.
+    """
+
+    REALTIME = "realtime"
+    BEST_EFFORT = "best-effort"
+    IDLE = "idle"
+
+
+@dataclasses.dataclass(frozen=True)
+class ResourceLimits:
+    """Priorities and limits for the commands of an operation
+
+    The I/O priority is applied via `ioprio_set` and inherited by the commands.
+    All other settings are applied by running each command in a transient scope
+    of systemd, i.e. they limit each command on its own. Attributes left at None
+    or empty are not changed.
+
+    Attributes:
+    -----------
+    io_class
+        I/O scheduling class
+    io_level
+        priority within `io_class`, from 0 (highest) to 7 (lowest); ignored for
+        `IoPriorityClasses.IDLE`
+    io_weight
+        proportional I/O weight from 1 to 10000, set as `IOWeight`; the default
+        weight is 100
+    io_max
+        bandwidth and IOPS limits per device in the notation of `io.max`, e.g.
+        `{Path("/dev/sdb"): "wbps=52428800 wiops=1000"}`, set as `IOReadBandwidthMax`
+        and the like
+    cpu_weight
+        proportional CPU weight from 1 to 10000, set as `CPUWeight`; the default
+        weight is 100
+    """
+
+    io_class: IoPriorityClasses | None = None
+    io_level: int = 4
+    io_weight: int | None = None
+    io_max: t.Mapping[Path, str] = dataclasses.field(default_factory=dict)
+    cpu_weight: int | None = None
+
+
+@dataclasses.dataclass
+class OperationStatistics:
+    """Commands executed during an operation
+
+    Attributes:
+    -----------
+    commands
+        number of commands executed
+    cache_hits
+        number of queries answered without executing a command
+    skipped_syncs
+        number of syncs skipped since the device was synced already
+    limits
+        resource limits applied to the commands of the operation
+    """
+
+    commands: int = 0
+    cache_hits: int = 0
+    skipped_syncs: int = 0
+    limits: ResourceLimits | None = None
+
+
+@dataclasses.dataclass(frozen=True)
+class CommandEvent:
+    """Measurement of a single command or system call
+
+    Attributes:
+    -----------
+    operation
+        public function of this package that issued the command
+    command
+        class of the command, i.e. the program and its subcommand without any
+        arguments, e.g. `"cryptsetup open"` or `"mount"`
+    device
+        first path the command was called with, usually the device
+    start
+        UNIX timestamp of the start of the command
+    seconds
+        wall clock time the command took
+    exit_code
+        exit code of the command; `None` if it is unknown
+    bytes_written
+        bytes written by the command, if known
+    """
+
+    operation: str
+    command: str
+    device: str | None
+    start: float
+    seconds: float
+    exit_code: int | None
+    bytes_written: int | None = None
+
+
+InstrumentationHook = Callable[[CommandEvent], None]
+
+
+def _as_device_list(device: Devices) -> list[Path]:
+    if isinstance(device, Path):
+        return [device]
+    if not device:
+        raise ValueError("At least one device must be given!")
+    return list(device)
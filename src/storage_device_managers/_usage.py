@@ -0,0 +1,170 @@
+import errno
+import fcntl
+import os
+import select
+import struct
+import threading
+import typing as t
+from pathlib import Path
+
+from ._instrumentation import _instrumented
+from ._mounts import get_mounted_devices
+from ._types import BtrfsProfiles, BtrfsSpaceInfo, DeviceUsage
+
+_PROC_MOUNTS = Path("/proc/self/mounts")
+
+# From linux/btrfs.h: _IOWR(BTRFS_IOCTL_MAGIC, 20, struct btrfs_ioctl_space_args)
+_BTRFS_IOC_SPACE_INFO = 0xC0109414
+# struct btrfs_ioctl_space_args { __u64 space_slots; __u64 total_spaces; ... }
+_SPACE_ARGS = struct.Struct("QQ")
+# struct btrfs_ioctl_space_info { __u64 flags; __u64 total_bytes; __u64 used_bytes; }
+_SPACE_INFO = struct.Struct("QQQ")
+# Error codes of file systems not knowing the ioctl
+_NOT_BTRFS = frozenset({errno.ENOTTY, errno.EINVAL, errno.EOPNOTSUPP})
+
+# Block group flags from linux/btrfs_tree.h
+_DATA = 1 << 0
+_SYSTEM = 1 << 1
+_METADATA = 1 << 2
+_GLOBAL_RESERVE = 1 << 49
+_KINDS = (
+    (_DATA | _METADATA, "data+metadata"),
+    (_DATA, "data"),
+    (_METADATA, "metadata"),
+    (_SYSTEM, "system"),
+)
+_PROFILES = {
+    1 << 3: BtrfsProfiles.RAID0,
+    1 << 4: BtrfsProfiles.RAID1,
+    1 << 5: BtrfsProfiles.DUP,
+    1 << 6: BtrfsProfiles.RAID10,
+    1 << 7: BtrfsProfiles.RAID5,
+    1 << 8: BtrfsProfiles.RAID6,
+    1 << 9: BtrfsProfiles.RAID1C3,
+    1 << 10: BtrfsProfiles.RAID1C4,
+}
+
+
+class _MountCache:
+    """Mount points and file system kinds, valid until the mount table changes
+
+    The kernel signals changes of the mount table by letting `poll` on
+    `/proc/self/mounts` report `POLLPRI`. Each change starts a new generation,
+    which empties the cache.
+    """
+
+    def __init__(self) -> None:
+        self._poller: select.poll | None = None
+        self._mounts_fh: t.IO[bytes] | None = None
+        self._entries: dict[str, tuple[Path, bool]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, device: Path) -> tuple[Path, bool] | None:
+        with self._lock:
+            self._expire()
+            return self._entries.get(str(device))
+
+    def put(self, device: Path, mount_dir: Path, is_btrfs: bool) -> None:
+        with self._lock:
+            self._entries[str(device)] = (mount_dir, is_btrfs)
+
+    def _expire(self) -> None:
+        if self._poller is None:
+            self._mounts_fh = _PROC_MOUNTS.open("rb")
+            self._poller = select.poll()
+            self._poller.register(self._mounts_fh, select.POLLPRI | select.POLLERR)
+        if self._poller.poll(0):
+            self._entries.clear()
+
+
+_mount_cache = _MountCache()
+
+
+def device_usage(device: Path) -> DeviceUsage:
+    """Get size and free space of the file system of a mounted device
+
+    The free space is read using `statvfs`. For BtrFS, the allocation of data,
+    metadata and system block groups per profile is read via the
+    `BTRFS_IOC_SPACE_INFO` ioctl in addition. Both are system calls, which are
+    much faster than running `df` or `btrfs filesystem usage`.
+
+    Devices are resolved to their mount point via the mount table. The mount
+    point and file system kind are cached until the mount table changes.
+
+    Parameters:
+    -----------
+    device
+        mounted device, or mount point, e.g. as yielded by `mounted_device`
+
+    Returns:
+    --------
+    DeviceUsage
+        size, free space and, for BtrFS, block group allocation
+
+    Raises:
+    -------
+    ValueError
+        if `device` is neither mounted nor a mount point
+    """
+    cached = _mount_cache.get(device)
+    if cached is None:
+        mount_dir = _find_mount_dir(device)
+        spaces = _btrfs_space_info(mount_dir)
+        _mount_cache.put(device, mount_dir, spaces is not None)
+    else:
+        mount_dir, is_btrfs = cached
+        spaces = _btrfs_space_info(mount_dir) if is_btrfs else None
+    stat = os.statvfs(mount_dir)
+    return DeviceUsage(
+        mount_dir=mount_dir,
+        total_bytes=stat.f_blocks * stat.f_frsize,
+        free_bytes=stat.f_bfree * stat.f_frsize,
+        available_bytes=stat.f_bavail * stat.f_frsize,
+        btrfs_spaces=spaces or (),
+    )
+
+
+def _find_mount_dir(device: Path) -> Path:
+    mounted = get_mounted_devices()
+    if str(device) in mounted:
+        return next(iter(mounted[str(device)]))
+    if os.path.ismount(device) or any(device in dirs for dirs in mounted.values()):
+        return device
+    raise ValueError(f"Device {device} is not mounted!")
+
+
+def _btrfs_space_info(mount_dir: Path) -> tuple[BtrfsSpaceInfo, ...] | None:
+    fd = os.open(mount_dir, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        with _instrumented(["ioctl BTRFS_IOC_SPACE_INFO", mount_dir]):
+            # The first call only asks for the number of entries.
+            header = bytearray(_SPACE_ARGS.pack(0, 0))
+            fcntl.ioctl(fd, _BTRFS_IOC_SPACE_INFO, header)
+            n_spaces = _SPACE_ARGS.unpack(header)[1]
+            buffer = bytearray(_SPACE_ARGS.size + n_spaces * _SPACE_INFO.size)
+            _SPACE_ARGS.pack_into(buffer, 0, n_spaces, 0)
+            fcntl.ioctl(fd, _BTRFS_IOC_SPACE_INFO, buffer)
+    except OSError as e:
+        if e.errno in _NOT_BTRFS:
+            return None
+        raise
+    finally:
+        os.close(fd)
+    n_spaces = _SPACE_ARGS.unpack_from(buffer)[1]
+    return tuple(
+        _space_info(
+            *_SPACE_INFO.unpack_from(buffer, _SPACE_ARGS.size + idx * _SPACE_INFO.size)
+        )
+        for idx in range(n_spaces)
+    )
+
+
+def _space_info(flags: int, total_bytes: int, used_bytes: int) -> BtrfsSpaceInfo:
+    if flags & _GLOBAL_RESERVE:
+        kind = "global reserve"
+    else:
+        kind = next((name for mask, name in _KINDS if flags & mask == mask), "unknown")
+    profile = next(
+        (name for bit, name in _PROFILES.items() if flags & bit), BtrfsProfiles.SINGLE
+    )
+    return BtrfsSpaceInfo(kind, profile, total_bytes, used_bytes)
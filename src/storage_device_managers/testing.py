@@ -0,0 +1,358 @@
+"""In-memory stand-in for the commands executed by storage_device_managers
+
+The `FakeBackend` simulates the state the real commands act upon, i.e. the
+mount table, device mapper mappings, loop devices and file system signatures.
+Activated via `storage_device_managers.command_backend`, it allows to exercise
+the orchestration of this library without root privileges, real devices or
+any subprocesses. Commands that do not affect the simulated state, e.g. `sync`
+or `chown`, succeed without any effect.
+
+Example:
+
+    backend = FakeBackend(latencies={"cryptsetup open": 0.5})
+    backend.add_encrypted_device(Path("/dev/sdx"), "echo secret", "btrfs")
+    with command_backend(backend):
+        with decrypted_device(Path("/dev/sdx"), "echo secret") as decrypted:
+            with mounted_device(decrypted) as mount_dir:
+                ...
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import random
+import subprocess
+import threading
+import time
+import typing as t
+import uuid
+from collections.abc import Callable, Sequence
+from pathlib import Path
+
+import shell_interface as sh
+
+from ._instrumentation import _command_class
+from ._limits import _without_scope
+
+__all__ = ["FakeBackend", "FakeMount"]
+
+_DEFAULT_MOUNT_OPTIONS = ("rw", "relatime")
+_LUKS_SIGNATURE = "crypto_LUKS"
+_MAPPER_DIR = "/dev/mapper/"
+
+# Exit codes of the real programs for the simulated failure modes.
+_BLKID_NOT_FOUND = 2
+_CRYPTSETUP_WRONG_PASSPHRASE = 2
+_CRYPTSETUP_NO_DEVICE = 4
+_CRYPTSETUP_BUSY = 5
+_MOUNT_FAILURE = 32
+
+
+@dataclasses.dataclass(frozen=True)
+class FakeMount:
+    """Entry of the simulated mount table"""
+
+    source: str
+    target: str
+    filesystem: str
+    options: tuple[str, ...]
+
+
+@dataclasses.dataclass
+class _LuksVolume:
+    pass_cmd: str
+    uuid: str
+    filesystem: str | None = None
+
+
+@dataclasses.dataclass
+class _Failure:
+    returncode: int
+    remaining: int
+
+
+class _CommandFailed(Exception):
+    def __init__(self, returncode: int) -> None:
+        super().__init__(returncode)
+        self.returncode = returncode
+
+
+_Handler = Callable[["FakeBackend", list[str], list[str], str | None], bytes]
+
+
+class FakeBackend:
+    """Command backend simulating devices, mounts and mappings in memory
+
+    Devices are identified by their path. Before they can be used, they must be
+    registered via `add_device` or `add_encrypted_device`. Afterwards, they can
+    be formatted, encrypted, opened and mounted like real devices.
+
+    Password commands are never executed. Instead, the password command used for
+    encryption must be given verbatim when opening the device. Volume keys cached
+    in the kernel keyring via `VolumeKeyCache` are tracked in `keys`.
+
+    Parameters:
+    -----------
+    latencies
+        simulated duration in seconds per command class, e.g. `"mount"` or
+        `"cryptsetup open"`
+    default_latency
+        simulated duration of all other commands
+    failure_rates
+        probability per command class that a command fails randomly
+    seed
+        seed for the random failures
+    """
+
+    def __init__(
+        self,
+        latencies: t.Mapping[str, float] | None = None,
+        default_latency: float = 0.0,
+        failure_rates: t.Mapping[str, float] | None = None,
+        seed: int | None = None,
+    ) -> None:
+        self.latencies = dict(latencies or {})
+        self.default_latency = default_latency
+        self.failure_rates = dict(failure_rates or {})
+        self.commands: list[list[str]] = []
+        self.filesystems: dict[str, str] = {}
+        self.mappings: dict[str, str] = {}
+        self.loop_devices: dict[str, str] = {}
+        self.mounts: list[FakeMount] = []
+        self.keys: dict[str, str] = {}
+        self._luks: dict[str, _LuksVolume] = {}
+        self._failures: dict[str, _Failure] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def add_device(self, device: Path, filesystem: str | None = None) -> None:
+        """Register a device, optionally carrying a file system"""
+        with self._lock:
+            self._luks.pop(str(device), None)
+            if filesystem is None:
+                self.filesystems.pop(str(device), None)
+            else:
+                self.filesystems[str(device)] = filesystem
+
+    def add_encrypted_device(
+        self, device: Path, pass_cmd: str, filesystem: str | None = None
+    ) -> None:
+        """Register a LUKS device whose decrypted content carries `filesystem`"""
+        with self._lock:
+            self.filesystems[str(device)] = _LUKS_SIGNATURE
+            luks_uuid = str(uuid.uuid5(uuid.NAMESPACE_OID, str(device)))
+            self._luks[str(device)] = _LuksVolume(pass_cmd, luks_uuid, filesystem)
+
+    def inject_failure(self, command: str, returncode: int = 1, count: int = 1) -> None:
+        """Let the next `count` commands of the given class fail"""
+        with self._lock:
+            self._failures[command] = _Failure(returncode, count)
+
+    def run_cmd(
+        self, cmd: sh.StrPathList, capture_output: bool
+    ) -> subprocess.CompletedProcess[bytes]:
+        stdout = self._execute(cmd, None)
+        return subprocess.CompletedProcess(
+            args=cmd, returncode=0, stdout=stdout if capture_output else None
+        )
+
+    def pipe_pass_cmd_to_real_cmd(
+        self, pass_cmd: str, command: sh.StrPathList
+    ) -> subprocess.CompletedProcess[bytes]:
+        stdout = self._execute(command, pass_cmd)
+        return subprocess.CompletedProcess(args=command, returncode=0, stdout=stdout)
+
+    def _execute(self, cmd: sh.StrPathList, pass_cmd: str | None) -> bytes:
+        # Resource limits have no effect on the simulation.
+        cmd = _without_scope(cmd)
+        command = _command_class(cmd)
+        time.sleep(self.latencies.get(command, self.default_latency))
+        args = [str(arg) for arg in cmd]
+        if args[:1] == ["sudo"]:
+            args = args[1:]
+        paths = [str(arg) for arg in cmd if isinstance(arg, Path)]
+        handler = _HANDLERS.get(command, _HANDLERS.get(args[0], _succeed))
+        with self._lock:
+            self.commands.append(args)
+            try:
+                self._maybe_fail(command)
+                return handler(self, args, paths, pass_cmd)
+            except _CommandFailed as e:
+                failure = subprocess.CalledProcessError(e.returncode, args)
+        raise sh.ShellInterfaceError(f"Fake command {args} failed!") from failure
+
+    def _maybe_fail(self, command: str) -> None:
+        failure = self._failures.get(command)
+        if failure is not None:
+            failure.remaining -= 1
+            if failure.remaining == 0:
+                del self._failures[command]
+            raise _CommandFailed(failure.returncode)
+        if self._random.random() < self.failure_rates.get(command, 0.0):
+            raise _CommandFailed(1)
+
+    def _resolve(self, device: str) -> str:
+        return self.loop_devices.get(device, device)
+
+    def _filesystem_of(self, device: str) -> str | None:
+        if device.startswith(_MAPPER_DIR):
+            backing = self.mappings.get(device.removeprefix(_MAPPER_DIR))
+            return None if backing is None else self._luks[backing].filesystem
+        return self.filesystems.get(self._resolve(device))
+
+    def _set_filesystem(self, device: str, filesystem: str) -> None:
+        if device.startswith(_MAPPER_DIR):
+            backing = self.mappings.get(device.removeprefix(_MAPPER_DIR))
+            if backing is None:
+                raise _CommandFailed(1)
+            self._luks[backing].filesystem = filesystem
+            return
+        resolved = self._resolve(device)
+        self._luks.pop(resolved, None)
+        self.filesystems[resolved] = filesystem
+
+    def _mount(self, args: list[str], paths: list[str], _: str | None) -> bytes:
+        if len(args) == 1:
+            return "".join(
+                f"{mnt.source} on {mnt.target} type {mnt.filesystem} "
+                f"({','.join(mnt.options)})\n"
+                for mnt in self.mounts
+            ).encode()
+        source, target = paths[:2]
+        filesystem = self._filesystem_of(source)
+        requested = _option_value(args, "-t")
+        if filesystem in (None, _LUKS_SIGNATURE) or requested not in (None, filesystem):
+            raise _CommandFailed(_MOUNT_FAILURE)
+        extra = _option_value(args, "-o")
+        options = _DEFAULT_MOUNT_OPTIONS + (() if extra is None else (extra,))
+        self.mounts.append(FakeMount(source, target, filesystem, options))
+        return b""
+
+    def _umount(self, _: list[str], paths: list[str], __: str | None) -> bytes:
+        for idx in reversed(range(len(self.mounts))):
+            if paths[0] in (self.mounts[idx].source, self.mounts[idx].target):
+                del self.mounts[idx]
+                return b""
+        raise _CommandFailed(_MOUNT_FAILURE)
+
+    def _blkid(self, args: list[str], paths: list[str], _: str | None) -> bytes:
+        filesystem = self._filesystem_of(paths[0])
+        if filesystem is None:
+            raise _CommandFailed(_BLKID_NOT_FOUND)
+        if _option_value(args, "-s") == "UUID":
+            # Stable per device and file system, like a real file system UUID.
+            return f"{uuid.uuid5(uuid.NAMESPACE_OID, paths[0] + filesystem)}\n".encode()
+        return f"{filesystem}\n".encode()
+
+    def _mkfs(self, args: list[str], paths: list[str], _: str | None) -> bytes:
+        filesystem = args[0].removeprefix("mkfs.")
+        for device in paths:
+            self._set_filesystem(device, filesystem)
+        return b""
+
+    def _luks_format(
+        self, args: list[str], paths: list[str], pass_cmd: str | None
+    ) -> bytes:
+        resolved = self._resolve(paths[0])
+        luks_uuid = _option_value(args, "--uuid") or str(uuid.uuid4())
+        self.filesystems[resolved] = _LUKS_SIGNATURE
+        self._luks[resolved] = _LuksVolume(t.cast(str, pass_cmd), luks_uuid)
+        return b""
+
+    def _luks_uuid(self, args: list[str], paths: list[str], _: str | None) -> bytes:
+        volume = self._luks.get(self._resolve(paths[0]))
+        if volume is None:
+            raise _CommandFailed(1)
+        new_uuid = _option_value(args, "--uuid")
+        if new_uuid is not None:
+            volume.uuid = new_uuid
+            return b""
+        return f"{volume.uuid}\n".encode()
+
+    def _luks_open(
+        self, args: list[str], paths: list[str], pass_cmd: str | None
+    ) -> bytes:
+        map_name = args[-1]
+        volume = self._luks.get(self._resolve(paths[0]))
+        if volume is None:
+            raise _CommandFailed(1)
+        cached_key = _option_value(args, "--volume-key-keyring")
+        if cached_key is not None and self.keys.get(cached_key) != volume.uuid:
+            raise _CommandFailed(1)
+        if cached_key is None and volume.pass_cmd != pass_cmd:
+            raise _CommandFailed(_CRYPTSETUP_WRONG_PASSPHRASE)
+        if map_name in self.mappings:
+            raise _CommandFailed(_CRYPTSETUP_BUSY)
+        self.mappings[map_name] = self._resolve(paths[0])
+        link = _option_value(args, "--link-vk-to-keyring")
+        if link is not None:
+            self.keys[link.split("::", 1)[1]] = volume.uuid
+        return b""
+
+    def _luks_close(self, args: list[str], _: list[str], __: str | None) -> bytes:
+        map_name = args[-1]
+        if map_name not in self.mappings:
+            raise _CommandFailed(_CRYPTSETUP_NO_DEVICE)
+        if any(mnt.source == _MAPPER_DIR + map_name for mnt in self.mounts):
+            raise _CommandFailed(_CRYPTSETUP_BUSY)
+        del self.mappings[map_name]
+        return b""
+
+    def _dmsetup(self, args: list[str], _: list[str], __: str | None) -> bytes:
+        map_name = args[-1]
+        if map_name not in self.mappings:
+            raise _CommandFailed(1)
+        luks_uuid = uuid.UUID(self._luks[self.mappings[map_name]].uuid)
+        return f"CRYPT-LUKS2-{luks_uuid.hex}-{map_name}\n".encode()
+
+    def _keyctl(self, args: list[str], _: list[str], __: str | None) -> bytes:
+        key = args[2]
+        if key not in self.keys:
+            raise _CommandFailed(1)
+        if args[1] == "revoke":
+            del self.keys[key]
+        return b""
+
+    def _losetup(self, args: list[str], paths: list[str], _: str | None) -> bytes:
+        if "--detach" in args:
+            if self.loop_devices.pop(paths[0], None) is None:
+                raise _CommandFailed(1)
+            return b""
+        if "--find" in args:
+            idx = 0
+            while f"/dev/loop{idx}" in self.loop_devices:
+                idx += 1
+            self.loop_devices[f"/dev/loop{idx}"] = paths[0]
+            return f"/dev/loop{idx}\n".encode()
+        device, image = paths[:2]
+        if device in self.loop_devices:
+            raise _CommandFailed(1)
+        self.loop_devices[device] = image
+        return b""
+
+
+def _succeed(*_: object) -> bytes:
+    return b""
+
+
+def _option_value(args: Sequence[str], option: str) -> str | None:
+    if option not in args:
+        return None
+    return args[args.index(option) + 1]
+
+
+_HANDLERS: dict[str, _Handler] = {
+    "mount": FakeBackend._mount,
+    "umount": FakeBackend._umount,
+    "blkid": FakeBackend._blkid,
+    "mkfs.btrfs": FakeBackend._mkfs,
+    "mkfs.ext4": FakeBackend._mkfs,
+    "cryptsetup luksFormat": FakeBackend._luks_format,
+    "cryptsetup open": FakeBackend._luks_open,
+    "cryptsetup close": FakeBackend._luks_close,
+    "cryptsetup luksUUID": FakeBackend._luks_uuid,
+    "dmsetup info": FakeBackend._dmsetup,
+    "keyctl revoke": FakeBackend._keyctl,
+    "keyctl timeout": FakeBackend._keyctl,
+    "losetup": FakeBackend._losetup,
+}
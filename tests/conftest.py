@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-import shutil
 from pathlib import Path
 from tempfile import NamedTemporaryFile, TemporaryDirectory
 
@@ -9,11 +8,7 @@ import shell_interface as sh
 
 import storage_device_managers as sdm
 
-
-def get_random_filename(dir_: str) -> str:
-    with NamedTemporaryFile(dir=dir_) as ntf:
-        pass
-    return ntf.name
+MIN_SIZE = 128 * 1024**2  # ~109MiB is the minimum size for BtrFS
 
 
 @pytest.fixture(params=["btrfs_device", "ext4_device"])
@@ -32,38 +27,24 @@ def mounted_directories():
 
 
 @pytest.fixture(scope="session")
-def _big_file_persistent():
-    min_size = 128 * 1024**2  # ~109MiB is the minimum size for BtrFS
-    with TemporaryDirectory() as tempdir:
-        filename = get_random_filename(dir_=tempdir)
-        file = Path(filename)
-        with file.open("wb") as fh:
-            fh.write(bytes(min_size))
-        yield file
+def _image_cache(tmp_path_factory):
+    return tmp_path_factory.mktemp("image-cache")
 
 
-@pytest.fixture
-def big_file(_big_file_persistent: Path):
-    with NamedTemporaryFile() as ntf:
-        file = Path(ntf.name)
-        shutil.copy(_big_file_persistent, file)
-        yield file
+@pytest.fixture(scope="session")
+def _session_passcmd() -> str:
+    return sdm.generate_passcmd()
 
 
-@pytest.fixture(scope="session")
-def _encrypted_btrfs_device_persistent(_big_file_persistent):
-    password_cmd = sdm.generate_passcmd()
+@pytest.fixture
+def big_file(_image_cache):
     with NamedTemporaryFile() as ntf:
-        btrfs_device = Path(ntf.name)
-        shutil.copy(_big_file_persistent, btrfs_device)
-        sdm.encrypt_device(btrfs_device, password_cmd)
-        with sdm.decrypted_device(btrfs_device, password_cmd) as decrypted:
-            sdm.mkfs_btrfs(decrypted)
-        yield btrfs_device, password_cmd
+        file = Path(ntf.name)
+        yield sdm.provision_image(file, MIN_SIZE, cache_dir=_image_cache)
 
 
 @pytest.fixture
-def encrypted_btrfs_device(_encrypted_btrfs_device_persistent):
+def encrypted_btrfs_device(_image_cache, _session_passcmd):
     """
     Create encrypted BtrFS file system
 
@@ -74,11 +55,12 @@ def encrypted_btrfs_device(_encrypted_btrfs_device_persistent):
     str
         password command that echos password to STDOUT
     """
-    btrfs_device, pass_cmd = _encrypted_btrfs_device_persistent
     with NamedTemporaryFile() as ntf:
         file = Path(ntf.name)
-        shutil.copy(btrfs_device, file)
-        yield file, pass_cmd
+        sdm.provision_image(
+            file, MIN_SIZE, "btrfs", pass_cmd=_session_passcmd, cache_dir=_image_cache
+        )
+        yield file, _session_passcmd
 
 
 @pytest.fixture(params=["encrypted_btrfs_device"])
@@ -89,35 +71,15 @@ def encrypted_device(request):
     return dest, pass_cmd
 
 
-@pytest.fixture(scope="session")
-def _btrfs_device_persistent(_big_file_persistent):
-    with NamedTemporaryFile() as ntf:
-        btrfs_device = Path(ntf.name)
-        shutil.copy(_big_file_persistent, btrfs_device)
-        sdm.mkfs_btrfs(btrfs_device)
-        yield btrfs_device
-
-
 @pytest.fixture
-def btrfs_device(_btrfs_device_persistent):
+def btrfs_device(_image_cache):
     with NamedTemporaryFile() as ntf:
         file = Path(ntf.name)
-        shutil.copy(_btrfs_device_persistent, file)
-        yield file
-
-
-@pytest.fixture(scope="session")
-def _ext4_device_persistent(_big_file_persistent):
-    with NamedTemporaryFile() as ntf:
-        ext4_device = Path(ntf.name)
-        shutil.copy(_big_file_persistent, ext4_device)
-        sdm.mkfs_ext4(ext4_device)
-        yield ext4_device
+        yield sdm.provision_image(file, MIN_SIZE, "btrfs", cache_dir=_image_cache)
 
 
 @pytest.fixture
-def ext4_device(_ext4_device_persistent):
+def ext4_device(_image_cache):
     with NamedTemporaryFile() as ntf:
         file = Path(ntf.name)
-        shutil.copy(_ext4_device_persistent, file)
-        yield file
+        yield sdm.provision_image(file, MIN_SIZE, "ext4", cache_dir=_image_cache)
@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+import math
+
+from benchmarks.harness import Result, compare, load_results, percentile, save_results
+
+
+def test_percentile_uses_nearest_rank() -> None:
+    samples = [float(val) for val in range(1, 101)]
+    assert percentile(samples, 50) == samples[49]
+    assert percentile(samples, 99) == samples[98]
+    assert percentile([samples[0]], 99) == samples[0]
+
+
+def test_compare_reports_regressions_beyond_tolerance() -> None:
+    baseline = [Result("fast", (1.0, 1.0)), Result("removed", (1.0,))]
+    results = [
+        Result("fast", (1.0, 2.0)),
+        Result("new", (5.0,)),
+    ]
+    regressions = compare(results, baseline, tolerance=0.5)
+    assert [(reg.name, reg.statistic) for reg in regressions] == [("fast", "p99")]
+
+
+def test_compare_accepts_results_within_tolerance() -> None:
+    baseline = [Result("case", (1.0,))]
+    assert compare([Result("case", (1.2,))], baseline, tolerance=0.25) == []
+
+
+def test_compare_handles_zero_baseline() -> None:
+    baseline = [Result("instant", (0.0,))]
+    regressions = compare([Result("instant", (0.5,))], baseline, tolerance=0.1)
+    assert [reg.ratio for reg in regressions] == [math.inf, math.inf]
+
+
+def test_results_roundtrip_through_json(tmp_path) -> None:
+    results = [Result("sync", (0.5, 0.25), bytes_per_sample=1024)]
+    path = tmp_path / "results.json"
+    save_results(path, results)
+    assert load_results(path) == results
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import signal
+from pathlib import Path
+
+import pytest
+import shell_interface as sh
+
+import storage_device_managers as sdm
+from storage_device_managers import _btrfs
+
+
+@pytest.fixture
+def source_and_target(btrfs_device, big_file):
+    # The target needs its own file system UUID, so it must not be a copy of
+    # `btrfs_device`.
+    sdm.mkfs_btrfs(big_file)
+    user = sh.get_user()
+    with sdm.mounted_device(btrfs_device) as src, sdm.mounted_device(big_file) as dest:
+        sdm.chown(src, user, recursive=False)
+        sdm.chown(dest, user, recursive=False)
+        yield src, dest
+
+
+@pytest.mark.parametrize("compression", [False, True])
+def test_btrfs_send_receive(source_and_target, compression) -> None:
+    src, dest = source_and_target
+    content = "some arbitrary content"
+    (src / "file").write_text(content)
+    with sdm.btrfs_snapshot(src, src / "snapshot") as snapshot:
+        stats = sdm.btrfs_send_receive(snapshot, dest, compression=compression)
+        assert (dest / "snapshot" / "file").read_text() == content
+    assert stats.total_bytes > len(content)
+    assert stats.bytes_per_second > 0
+    sh.run_cmd(cmd=["sudo", "btrfs", "subvolume", "delete", dest / "snapshot"])
+
+
+def test_btrfs_send_receive_incremental(source_and_target) -> None:
+    src, dest = source_and_target
+    (src / "file").write_text("first version")
+    with sdm.btrfs_snapshot(src, src / "first") as first:
+        full = sdm.btrfs_send_receive(first, dest)
+        (src / "file").write_text("second version")
+        with sdm.btrfs_snapshot(src, src / "second") as second:
+            incremental = sdm.btrfs_send_receive(second, dest, parent=first)
+    assert (dest / "second" / "file").read_text() == "second version"
+    assert incremental.total_bytes < full.total_bytes
+    for name in ["second", "first"]:
+        sh.run_cmd(cmd=["sudo", "btrfs", "subvolume", "delete", dest / name])
+
+
+def test_btrfs_send_receive_cleans_up_on_failure(source_and_target) -> None:
+    src, dest = source_and_target
+    # Sending a writable subvolume fails, since `btrfs send` requires read-only
+    # snapshots.
+    with sdm.btrfs_snapshot(src, src / "writable", readonly=False) as snapshot:
+        with pytest.raises(sdm.SendReceiveError):
+            sdm.btrfs_send_receive(snapshot, dest)
+    assert not (dest / "writable").exists()
+
+
+def test_btrfs_send_receive_rejects_existing_destination(tmp_path: Path) -> None:
+    (tmp_path / "snapshot").mkdir()
+    with pytest.raises(FileExistsError):
+        sdm.btrfs_send_receive(Path("/nonexistent/snapshot"), tmp_path)
+
+
+def test_run_pipeline_kills_producers_if_consumer_cannot_start(mocker) -> None:
+    kill_all = mocker.spy(_btrfs, "_kill_all")
+    with pytest.raises(sdm.SendReceiveError, match="failed"):
+        _btrfs._run_pipeline([["sleep", "60"]], ["/nonexistent/receive"])
+    (producer,) = kill_all.call_args.args[0]
+    assert producer.returncode == -signal.SIGKILL
+
+
+def test_run_pipeline_reports_consumer_exiting_early() -> None:
+    with pytest.raises(sdm.SendReceiveError, match=r"\['false'\] exited with code 1"):
+        _btrfs._run_pipeline([["yes"]], ["false"])
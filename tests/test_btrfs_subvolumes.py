@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import pytest
+import shell_interface as sh
+
+import storage_device_managers as sdm
+from storage_device_managers import _btrfs
+from storage_device_managers.testing import FakeBackend
+
+N_SNAPSHOTS = 2
+
+
+class MyCustomTestException(Exception):
+    pass
+
+
+@pytest.fixture
+def mounted_btrfs(btrfs_device):
+    with sdm.mounted_device(btrfs_device) as md:
+        sdm.chown(md, sh.get_user(), recursive=False)
+        yield btrfs_device, md
+
+
+def test_subvolume(mounted_btrfs) -> None:
+    _, md = mounted_btrfs
+    path = md / "subvolume"
+    with sdm.subvolume(path) as subvol:
+        assert subvol == path
+        assert subvol.is_dir()
+    assert not path.exists()
+
+
+def test_subvolume_rejects_existing_path(mounted_btrfs) -> None:
+    _, md = mounted_btrfs
+    with pytest.raises(FileExistsError):
+        with sdm.subvolume(md):
+            pass
+
+
+def test_subvolume_does_not_delete_content(mounted_btrfs) -> None:
+    _, md = mounted_btrfs
+    path = md / "subvolume"
+    with pytest.raises(sdm.SubvolumeDeletionError):
+        with sdm.subvolume(path) as subvol:
+            sdm.chown(subvol, sh.get_user(), recursive=False)
+            (subvol / "sentinel").write_text("Must not be deleted.")
+    assert (path / "sentinel").read_text() == "Must not be deleted."
+    (path / "sentinel").unlink()
+    sh.run_cmd(cmd=["sudo", "btrfs", "subvolume", "delete", path])
+
+
+@pytest.mark.parametrize("readonly", [True, False])
+def test_btrfs_snapshot(mounted_btrfs, readonly) -> None:
+    _, md = mounted_btrfs
+    content = "some arbitrary content"
+    (md / "file").write_text(content)
+    dest = md / "snapshot"
+    with sdm.btrfs_snapshot(md, dest, readonly=readonly) as snapshot:
+        assert (snapshot / "file").read_text() == content
+        (md / "file").write_text("changed after snapshot")
+        assert (snapshot / "file").read_text() == content
+    assert not dest.exists()
+
+
+def test_btrfs_snapshot_is_deleted_in_case_of_exception(mounted_btrfs) -> None:
+    _, md = mounted_btrfs
+    dest = md / "snapshot"
+    with pytest.raises(MyCustomTestException):
+        with sdm.btrfs_snapshot(md, dest):
+            raise MyCustomTestException
+    assert not dest.exists()
+
+
+def test_btrfs_snapshot_does_not_delete_modified_snapshot(mounted_btrfs) -> None:
+    _, md = mounted_btrfs
+    dest = md / "snapshot"
+    with pytest.raises(sdm.SubvolumeDeletionError):
+        with sdm.btrfs_snapshot(md, dest, readonly=False) as snapshot:
+            (snapshot / "sentinel").write_text("Must not be deleted.")
+    assert (dest / "sentinel").exists()
+    sh.run_cmd(cmd=["sudo", "btrfs", "subvolume", "delete", dest])
+
+
+def test_btrfs_snapshot_does_not_delete_new_directory(mounted_btrfs) -> None:
+    _, md = mounted_btrfs
+    dest = md / "snapshot"
+    with pytest.raises(sdm.SubvolumeDeletionError):
+        with sdm.btrfs_snapshot(md, dest, readonly=False) as snapshot:
+            (snapshot / "empty").mkdir()
+    assert (dest / "empty").is_dir()
+    (dest / "empty").rmdir()
+    sh.run_cmd(cmd=["sudo", "btrfs", "subvolume", "delete", dest])
+
+
+def test_btrfs_snapshot_rejects_missing_src(mounted_btrfs) -> None:
+    _, md = mounted_btrfs
+    with pytest.raises(FileNotFoundError):
+        with sdm.btrfs_snapshot(md / "missing", md / "snapshot"):
+            pass
+
+
+def test_mount_btrfs_device_mounts_subvolume(mounted_btrfs) -> None:
+    device, md = mounted_btrfs
+    with sdm.subvolume(md / "subvolume") as subvol:
+        sdm.chown(subvol, sh.get_user(), recursive=False)
+        (subvol / "file").write_text("content")
+        with TemporaryDirectory() as td:
+            sdm.mount_btrfs_device(device, Path(td), subvol="subvolume")
+            assert (Path(td) / "file").read_text() == "content"
+            sh.run_cmd(cmd=["sudo", "umount", td])
+        (subvol / "file").unlink()
+
+
+def test_mount_btrfs_device_passes_subvol(mocker) -> None:
+    run_cmd = mocker.patch("shell_interface.run_cmd")
+    device = Path("/dev/sdx")
+    mount_dir = Path("/mnt")
+    sdm.mount_btrfs_device(device, mount_dir, subvol="@backup")
+    assert run_cmd.call_args.kwargs["cmd"] == [
+        "sudo",
+        "mount",
+        device,
+        mount_dir,
+        "-o",
+        "subvol=@backup",
+    ]
+
+
+def test_mount_device_rejects_subvol_for_ext4(mocker) -> None:
+    mocker.patch("storage_device_managers._mounts.get_filesystem", return_value="ext4")
+    with pytest.raises(ValueError, match="subvolumes"):
+        sdm.mount_device(Path("/dev/sdx"), Path("/mnt"), subvol="@backup")
+
+
+@pytest.fixture
+def fake_backend():
+    backend = FakeBackend()
+    with sdm.command_backend(backend):
+        yield backend
+
+
+def deleted_subvolumes(backend: FakeBackend) -> list[str]:
+    return [
+        cmd[3]
+        for cmd in backend.commands
+        if cmd[:3] == ["btrfs", "subvolume", "delete"]
+    ]
+
+
+def test_btrfs_snapshot_is_deleted_if_generation_is_unknown(
+    fake_backend, tmp_path
+) -> None:
+    dest = tmp_path / "snapshot"
+    # The fake `btrfs subvolume show` prints nothing, so no generation is found.
+    with pytest.raises(ValueError, match="generation"):
+        with sdm.btrfs_snapshot(tmp_path, dest):
+            pass
+    assert deleted_subvolumes(fake_backend) == [str(dest)]
+
+
+def test_btrfs_snapshot_keeps_exception_of_body(fake_backend, tmp_path, mocker) -> None:
+    mocker.patch.object(_btrfs, "_get_subvolume_generation", return_value=1)
+    dest = tmp_path / "snapshot"
+    # The fake `btrfs property get` does not report the snapshot as read-only.
+    with pytest.raises(MyCustomTestException) as exc_info:
+        with sdm.btrfs_snapshot(tmp_path, dest):
+            raise MyCustomTestException
+    assert isinstance(exc_info.value.__cause__, sdm.SubvolumeDeletionError)
+    assert deleted_subvolumes(fake_backend) == []
+    with pytest.raises(sdm.SubvolumeDeletionError):
+        with sdm.btrfs_snapshot(tmp_path, dest):
+            pass
+
+
+def test_btrfs_snapshot_compares_committed_generations(
+    fake_backend, tmp_path, mocker
+) -> None:
+    mocker.patch.object(_btrfs, "_get_subvolume_generation", side_effect=[1, 2, 3, 3])
+    with pytest.raises(sdm.SubvolumeDeletionError, match="modified"):
+        with sdm.btrfs_snapshot(tmp_path, tmp_path / "modified", readonly=False):
+            pass
+    with sdm.btrfs_snapshot(tmp_path, tmp_path / "unchanged", readonly=False):
+        pass
+    assert deleted_subvolumes(fake_backend) == [str(tmp_path / "unchanged")]
+    syncs = [
+        cmd
+        for cmd in fake_backend.commands
+        if cmd[:3] == ["btrfs", "filesystem", "sync"]
+    ]
+    assert len(syncs) == N_SNAPSHOTS
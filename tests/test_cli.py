@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import io
+import json
+import typing as t
+from pathlib import Path
+
+import pytest
+
+import storage_device_managers as sdm
+from storage_device_managers._cli import _run_batch, main
+from storage_device_managers.testing import FakeBackend
+
+PASS_CMD = "echo secret"
+
+
+@pytest.fixture
+def backend():
+    fake = FakeBackend()
+    with sdm.command_backend(fake):
+        yield fake
+
+
+def run_batch(text: str, jobs: int = 1) -> tuple[int, list[dict[str, t.Any]]]:
+    out = io.StringIO()
+    returncode = _run_batch(io.StringIO(text), jobs, out)
+    return returncode, [json.loads(line) for line in out.getvalue().splitlines()]
+
+
+def test_cli_prints_filesystem(backend, capsys) -> None:
+    backend.add_device(Path("/dev/sdx"), "ext4")
+    assert main(["get-filesystem", "/dev/sdx"]) == 0
+    assert capsys.readouterr().out == "ext4\n"
+
+
+def test_cli_is_mounted_sets_exit_code(backend, tmp_path: Path) -> None:
+    backend.add_device(Path("/dev/sdx"), "btrfs")
+    assert main(["is-mounted", "/dev/sdx"]) == 1
+    assert main(["mount-device", str(tmp_path), "/dev/sdx"]) == 0
+    assert main(["is-mounted", "/dev/sdx"]) == 0
+
+
+def test_cli_reports_failures_on_stderr(backend, capsys) -> None:
+    assert main(["get-filesystem", "/dev/unknown"]) == 1
+    assert capsys.readouterr().err.startswith("ShellInterfaceError: ")
+
+
+def test_batch_runs_ndjson_stream(backend, tmp_path: Path) -> None:
+    backend.add_encrypted_device(Path("/dev/sdx"), PASS_CMD, "btrfs")
+    requests = [
+        {
+            "id": "open",
+            "op": "open_encrypted_device",
+            "args": {"device": "/dev/sdx", "pass_cmd": PASS_CMD},
+        },
+        {
+            "id": "mount",
+            "op": "mount_device",
+            "args": {
+                "device": "/dev/mapper/sdx",
+                "mount_dir": str(tmp_path),
+                "compression": "lzo",
+            },
+        },
+        {"id": "check", "op": "is_mounted", "args": {"device": "/dev/mapper/sdx"}},
+    ]
+    text = "\n".join(json.dumps(req) for req in requests) + "\n"
+    returncode, responses = run_batch(text)
+    assert returncode == 0
+    assert [resp["id"] for resp in responses] == ["open", "mount", "check"]
+    assert responses[0]["result"] == "/dev/mapper/sdx"
+    assert responses[2]["result"] is True
+    assert backend.mounts[0].options[-1] == "compress=lzo"
+
+
+def test_batch_reports_failures_per_operation(backend) -> None:
+    text = json.dumps(
+        [
+            {"op": "get_filesystem", "args": {"device": "/dev/unknown"}},
+            {"op": "no_such_operation"},
+            {"op": "sync_device", "args": {}},
+            {"op": "generate_passcmd"},
+        ]
+    )
+    returncode, responses = run_batch(text)
+    assert returncode == 1
+    assert [resp["ok"] for resp in responses] == [False, False, False, True]
+    assert responses[0]["error"]["type"] == "ShellInterfaceError"
+    assert "no_such_operation" in responses[1]["error"]["message"]
+    assert "missing" in responses[2]["error"]["message"]
+
+
+def test_batch_reports_invalid_json(backend) -> None:
+    returncode, responses = run_batch('{"op": "generate_passcmd"}\nnot json\n')
+    assert returncode == 1
+    assert responses[1]["index"] == 1
+    assert responses[1]["ok"] is False
+    assert responses[1]["error"]["message"].startswith("Invalid JSON")
+
+
+def test_batch_runs_operations_in_parallel(backend, tmp_path: Path) -> None:
+    n_devices = 8
+    lines = []
+    for idx in range(n_devices):
+        backend.add_device(Path(f"/dev/sd{idx}"), "ext4")
+        mount_dir = tmp_path / str(idx)
+        args = {"device": f"/dev/sd{idx}", "mount_dir": str(mount_dir)}
+        lines.append(json.dumps({"id": idx, "op": "mount_device", "args": args}))
+    returncode, responses = run_batch("\n".join(lines), jobs=4)
+    assert returncode == 0
+    assert sorted(resp["id"] for resp in responses) == list(range(n_devices))
+    assert len(backend.mounts) == n_devices
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import os
+import shutil
 from collections import Counter
 from pathlib import Path
 from tempfile import NamedTemporaryFile, TemporaryDirectory
@@ -12,6 +13,7 @@ from hypothesis import given
 from hypothesis import strategies as st
 
 import storage_device_managers as sdm
+from storage_device_managers.testing import FakeBackend
 
 
 def get_random_filename() -> str:
@@ -143,6 +145,49 @@ def test_symbolic_link_does_not_crash_in_case_of_vanished_link() -> None:
             sh.run_cmd(cmd=cmd)
 
 
+def test_symbolic_links_creates_writable_links_without_commands(
+    tmp_path: Path,
+) -> None:
+    backend = FakeBackend()
+    sources = [tmp_path / f"src{idx}" for idx in range(3)]
+    for src in sources:
+        src.touch()
+    links = {tmp_path / f"link{idx}": src for idx, src in enumerate(sources)}
+    with sdm.command_backend(backend):
+        with sdm.symbolic_links(links) as created:
+            assert created == list(links)
+            assert all(link.resolve() == links[link] for link in created)
+    assert not any(os.path.lexists(link) for link in links)
+    assert backend.commands == []
+
+
+def test_symbolic_links_rolls_back_on_failure(tmp_path: Path) -> None:
+    source = tmp_path / "src"
+    source.touch()
+    first = tmp_path / "first"
+    links = {first: source, tmp_path / "missing" / "second": source}
+    with pytest.raises(FileNotFoundError):
+        with sdm.symbolic_links(links):
+            pass
+    assert not os.path.lexists(first)
+
+
+def test_symbolic_links_escalates_in_one_command(tmp_path: Path, mocker) -> None:
+    mocker.patch("os.symlink", side_effect=PermissionError)
+    backend = FakeBackend()
+    source = tmp_path / "src"
+    source.touch()
+    links = {tmp_path / f"link{idx}": source for idx in range(4)}
+    with sdm.command_backend(backend):
+        with sdm.symbolic_links(links):
+            pass
+    assert len(backend.commands) == 1
+    assert backend.commands[0][:2] == ["sh", "-c"]
+    assert backend.commands[0][4:] == [
+        str(path) for link in links for path in (source, link)
+    ]
+
+
 def test_generate_passcmd_is_not_static():
     N = 128
     passwords = Counter(sdm.generate_passcmd() for _ in range(N))
@@ -199,3 +244,42 @@ def test_encrypt_device_raises_passcmderror_on_bad_pass_cmd(big_file) -> None:
     bad_pass_cmd = "exit 1"
     with pytest.raises(sh.PassCmdError):
         sdm.encrypt_device(big_file, bad_pass_cmd)
+
+
+@pytest.fixture
+def two_encrypted_devices(encrypted_btrfs_device):
+    device, pass_cmd = encrypted_btrfs_device
+    with NamedTemporaryFile() as ntf:
+        copy = Path(ntf.name)
+        shutil.copy(device, copy)
+        yield [device, copy], pass_cmd
+
+
+def test_decrypted_devices(two_encrypted_devices) -> None:
+    devices, pass_cmd = two_encrypted_devices
+    with sdm.decrypted_devices(devices, pass_cmd) as decrypted:
+        assert [dd.name for dd in decrypted] == [dev.name for dev in devices]
+        assert all(dd.exists() for dd in decrypted)
+    assert not any(dd.exists() for dd in decrypted)
+
+
+def test_decrypted_devices_closes_opened_devices_on_failure(
+    two_encrypted_devices,
+) -> None:
+    devices, pass_cmd = two_encrypted_devices
+    with NamedTemporaryFile() as not_encrypted:
+        all_devices = [*devices, Path(not_encrypted.name)]
+        with pytest.raises(sdm.DeviceDecryptionError):
+            with sdm.decrypted_devices(all_devices, pass_cmd):
+                pass
+    assert not any(Path("/dev/mapper", dev.name).exists() for dev in devices)
+
+
+def test_decrypted_devices_opens_all_devices(mocker) -> None:
+    mocker.patch("shell_interface.pipe_pass_cmd_to_real_cmd")
+    run_cmd = mocker.patch("shell_interface.run_cmd")
+    devices = [Path("/dev/sdx"), Path("/dev/sdy")]
+    with sdm.decrypted_devices(devices, "echo secret") as decrypted:
+        assert decrypted == [Path("/dev/mapper/sdx"), Path("/dev/mapper/sdy")]
+    closed = sorted(c.kwargs["cmd"][-1] for c in run_cmd.call_args_list)
+    assert closed == ["sdx", "sdy"]
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import errno
+import struct
+from pathlib import Path
+
+import pytest
+
+import storage_device_managers as sdm
+from storage_device_managers import _usage
+from storage_device_managers.testing import FakeBackend
+
+DEVICE = Path("/dev/sdx")
+SPACES = [
+    (1 << 0, 10 * 1024**3, 4 * 1024**3),  # data, single
+    (1 << 2 | 1 << 5, 1024**3, 1024**2),  # metadata, dup
+    (1 << 1 | 1 << 4, 8 * 1024**2, 16 * 1024),  # system, raid1
+    (1 << 49 | 1 << 2, 512 * 1024**2, 0),  # global reserve
+]
+
+
+def fake_space_info(fd: int, request: int, buffer: bytearray) -> int:
+    slots = struct.unpack_from("Q", buffer)[0]
+    struct.pack_into("QQ", buffer, 0, slots, len(SPACES))
+    for idx, space in enumerate(SPACES[:slots]):
+        struct.pack_into("QQQ", buffer, 16 + idx * 24, *space)
+    return 0
+
+
+@pytest.fixture
+def backend(tmp_path: Path, mocker):
+    mocker.patch.object(_usage, "_mount_cache", _usage._MountCache())
+    fake = FakeBackend()
+    fake.add_device(DEVICE, "btrfs")
+    with sdm.command_backend(fake):
+        sdm.mount_device(DEVICE, tmp_path)
+        yield fake
+
+
+def test_device_usage_reads_statvfs(backend, tmp_path: Path, mocker) -> None:
+    mocker.patch("fcntl.ioctl", side_effect=OSError(errno.ENOTTY, "no btrfs"))
+    usage = sdm.device_usage(DEVICE)
+    assert usage.mount_dir == tmp_path
+    assert usage.total_bytes >= usage.free_bytes >= usage.available_bytes
+    assert usage.used_bytes == usage.total_bytes - usage.free_bytes
+    assert usage.btrfs_spaces == ()
+    assert sdm.device_usage(tmp_path).mount_dir == tmp_path
+
+
+def test_device_usage_reports_btrfs_spaces(backend, mocker) -> None:
+    mocker.patch("fcntl.ioctl", side_effect=fake_space_info)
+    usage = sdm.device_usage(DEVICE)
+    assert usage.btrfs_spaces == (
+        sdm.BtrfsSpaceInfo("data", sdm.BtrfsProfiles.SINGLE, 10 * 1024**3, 4 * 1024**3),
+        sdm.BtrfsSpaceInfo("metadata", sdm.BtrfsProfiles.DUP, 1024**3, 1024**2),
+        sdm.BtrfsSpaceInfo("system", sdm.BtrfsProfiles.RAID1, 8 * 1024**2, 16 * 1024),
+        sdm.BtrfsSpaceInfo(
+            "global reserve", sdm.BtrfsProfiles.SINGLE, 512 * 1024**2, 0
+        ),
+    )
+
+
+def test_device_usage_caches_mount_point(backend, mocker) -> None:
+    ioctl = mocker.patch("fcntl.ioctl", side_effect=OSError(errno.ENOTTY, "no btrfs"))
+    sdm.device_usage(DEVICE)
+    n_commands = len(backend.commands)
+    sdm.device_usage(DEVICE)
+    assert len(backend.commands) == n_commands
+    assert ioctl.call_count == 1
+
+
+def test_device_usage_rejects_unmounted_device(backend) -> None:
+    with pytest.raises(ValueError, match="not mounted"):
+        sdm.device_usage(Path("/dev/sdy"))
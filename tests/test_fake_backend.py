@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import threading
+from pathlib import Path
+
+import pytest
+import shell_interface as sh
+
+import storage_device_managers as sdm
+from storage_device_managers._backend import _backends
+from storage_device_managers.testing import FakeBackend
+
+PASS_CMD = "echo secret"
+
+
+@pytest.fixture
+def backend():
+    fake = FakeBackend()
+    with sdm.command_backend(fake):
+        yield fake
+
+
+def test_fake_backend_decrypts_and_mounts(backend) -> None:
+    device = Path("/dev/sdx")
+    backend.add_encrypted_device(device, PASS_CMD, "btrfs")
+    with sdm.decrypted_device(device, PASS_CMD) as decrypted:
+        assert backend.mappings == {"sdx": str(device)}
+        with sdm.mounted_device(
+            decrypted, compression=sdm.ValidCompressions.LZO
+        ) as mount_dir:
+            assert sdm.get_mounted_devices() == {
+                str(decrypted): {
+                    mount_dir: frozenset({"rw", "relatime", "compress=lzo"})
+                }
+            }
+        assert backend.mounts == []
+    assert backend.mappings == {}
+
+
+def test_fake_backend_rejects_wrong_password(backend) -> None:
+    device = Path("/dev/sdx")
+    backend.add_encrypted_device(device, PASS_CMD, "btrfs")
+    with pytest.raises(sdm.DeviceDecryptionError):
+        sdm.open_encrypted_device(device, "echo wrong")
+
+
+def test_fake_backend_tracks_formatting(backend, tmp_path) -> None:
+    image = tmp_path / "image"
+    backend.add_device(image)
+    uuid = sdm.encrypt_device(image, PASS_CMD)
+    assert uuid is not None
+    assert sdm.get_filesystem(image) == "crypto_LUKS"
+    with sdm.decrypted_device(image, PASS_CMD) as decrypted:
+        sdm.mkfs_ext4(decrypted)
+        assert sdm.get_filesystem(decrypted) == "ext4"
+
+
+def test_fake_backend_refuses_to_close_mounted_device(backend) -> None:
+    device = Path("/dev/sdx")
+    backend.add_encrypted_device(device, PASS_CMD, "ext4")
+    decrypted = sdm.open_encrypted_device(device, PASS_CMD)
+    with sdm.mounted_device(decrypted), pytest.raises(sh.ShellInterfaceError):
+        sdm.close_decrypted_device(decrypted)
+
+
+def test_fake_backend_injects_failures(backend) -> None:
+    device = Path("/dev/sdx")
+    backend.add_device(device, "btrfs")
+    backend.inject_failure("umount", returncode=32)
+    with pytest.raises(sdm.UnmountError), sdm.mounted_device(device):
+        pass
+    # The failure was consumed, so the device can be unmounted now.
+    sdm.unmount_device(device)
+    assert backend.mounts == []
+
+
+def test_command_backend_restores_previous_backend() -> None:
+    fake = FakeBackend()
+    with sdm.command_backend(fake):
+        assert _backends[-1] is fake
+    assert isinstance(_backends[-1], sdm.ShellBackend)
+
+
+def test_fake_backend_supports_concurrent_flows(backend) -> None:
+    n_devices = 50
+    devices = [Path(f"/dev/fake{idx}") for idx in range(n_devices)]
+    for device in devices:
+        backend.add_encrypted_device(device, PASS_CMD, "btrfs")
+    errors: list[BaseException] = []
+
+    def flow(device: Path) -> None:
+        try:
+            with sdm.decrypted_device(device, PASS_CMD) as decrypted:
+                with sdm.mounted_device(decrypted):
+                    pass
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=flow, args=(dev,)) for dev in devices]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert backend.mounts == []
+    assert backend.mappings == {}
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import storage_device_managers as sdm
+
+# Generous upper bound for `import storage_device_managers` in microseconds. The
+# import itself takes only a few milliseconds; the budget merely catches heavy
+# imports sneaking back in.
+IMPORT_BUDGET_US = 50_000
+# Upper bound for looking up an attribute, including all modules imported for it.
+# `is_mounted` took about 70 ms when this was set, mostly for the dataclasses of
+# `_types`. Importing shell_interface on top would exceed the budget.
+ATTRIBUTE_BUDGET_US = 100_000
+
+# Modules needed only by few functions, which must not be loaded by e.g. `is_mounted`
+DEFERRED_MODULES = [
+    "storage_device_managers._block",
+    "storage_device_managers._files",
+    "storage_device_managers._inventory",
+    "storage_device_managers._trim",
+]
+
+EXPENSIVE_MODULES = [
+    "concurrent.futures",
+    "hashlib",
+    "importlib.metadata",
+    "loguru",
+    "secrets",
+    "shell_interface",
+    "tempfile",
+    "uuid",
+]
+
+
+def _run_python(
+    code: str, *options: str, env: dict[str, str] | None = None
+) -> subprocess.CompletedProcess[str]:
+    return subprocess.run(
+        [sys.executable, *options, "-c", code],
+        capture_output=True,
+        check=True,
+        text=True,
+        env=env,
+    )
+
+
+def test_import_does_not_load_expensive_modules() -> None:
+    code = "import json, sys, storage_device_managers; print(json.dumps(list(sys.modules)))"
+    loaded = set(json.loads(_run_python(code).stdout))
+    assert sorted(loaded & set(EXPENSIVE_MODULES)) == []
+
+
+def _import_timings(code: str, pycache: Path) -> dict[str, tuple[int, int]]:
+    """Map the modules imported by `code` to their self and cumulative import time
+
+    Modules imported during interpreter startup are left out. Compiling stale
+    bytecode is not measured, as a first run writes the bytecode to `pycache`.
+    """
+    env = {k: v for k, v in os.environ.items() if k != "PYTHONDONTWRITEBYTECODE"}
+    options = ["-X", f"pycache_prefix={pycache}", "-X", "importtime"]
+    _run_python(code, *options, env=env)
+    startup = _parse_import_times(_run_python("pass", *options, env=env).stderr)
+    timings = _parse_import_times(_run_python(code, *options, env=env).stderr)
+    return {module: times for module, times in timings.items() if module not in startup}
+
+
+def _parse_import_times(stderr: str) -> dict[str, tuple[int, int]]:
+    # Lines look like "import time:  self [us] | cumulative | imported package"
+    timings = {}
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "cumulative" not in line:
+            own, cumulative, module = line.removeprefix("import time:").split("|")
+            timings[module.strip()] = (int(own), int(cumulative))
+    return timings
+
+
+def test_import_stays_within_budget(tmp_path: Path) -> None:
+    timings = _import_timings("import storage_device_managers", tmp_path)
+    _, cumulative = timings["storage_device_managers"]
+    assert cumulative < IMPORT_BUDGET_US
+
+
+def test_attribute_access_stays_within_budget(tmp_path: Path) -> None:
+    code = "import storage_device_managers as sdm; sdm.is_mounted"
+    timings = _import_timings(code, tmp_path)
+    # shell_interface, loguru and importlib.metadata are loaded by the first command.
+    deferred = [*DEFERRED_MODULES, *EXPENSIVE_MODULES]
+    assert sorted(set(timings) & set(deferred)) == []
+    # Summing the self times of all modules, including third-party ones, gives the
+    # cumulative time of all imports.
+    assert sum(self_time for self_time, _ in timings.values()) < ATTRIBUTE_BUDGET_US
+
+
+def test_version_is_resolved_lazily() -> None:
+    code = (
+        "import sys, storage_device_managers as sdm; "
+        "loaded = 'importlib.metadata' in sys.modules; "
+        "print(loaded, sdm.__version__)"
+    )
+    loaded, version = _run_python(code).stdout.split()
+    assert loaded == "False"
+    assert version
+
+
+@pytest.mark.parametrize("name", ["is_mounted", "ValidCompressions"])
+def test_attributes_are_loaded_on_first_access(name) -> None:
+    code = (
+        "import sys, storage_device_managers as sdm; "
+        f"sdm.{name}; "
+        "print(sorted(m for m in sys.modules if m.startswith('storage_device_managers')))"
+    )
+    loaded = _run_python(code).stdout
+    assert "storage_device_managers._stacks" not in loaded
+    assert "storage_device_managers._images" not in loaded
+
+
+def test_unknown_attribute_raises_attribute_error() -> None:
+    with pytest.raises(AttributeError, match="no_such_function"):
+        sdm.no_such_function  # noqa: B018
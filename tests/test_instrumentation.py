@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import io
+import json
+import subprocess
+from pathlib import Path
+
+import pytest
+import shell_interface as sh
+
+import storage_device_managers as sdm
+from storage_device_managers._instrumentation import _command_class
+
+
+@pytest.fixture
+def run_cmd(mocker):
+    def fake_run_cmd(cmd, capture_output=False):
+        if "false" in cmd:
+            raise sh.ShellInterfaceError from subprocess.CalledProcessError(
+                returncode=32, cmd=cmd
+            )
+        return subprocess.CompletedProcess(args=cmd, returncode=0, stdout=b"btrfs\n")
+
+    return mocker.patch("shell_interface.run_cmd", side_effect=fake_run_cmd)
+
+
+def test_instrumentation_reports_commands(run_cmd) -> None:
+    device = Path("/dev/sdx")
+    events: list[sdm.CommandEvent] = []
+    with sdm.instrumentation(events.append):
+        sdm.mkfs_btrfs(device)
+        sdm.get_filesystem(device)
+    assert [(ev.operation, ev.command, ev.device) for ev in events] == [
+        ("mkfs_btrfs", "mkfs.btrfs", str(device)),
+        ("get_filesystem", "blkid", str(device)),
+    ]
+    assert all(ev.exit_code == 0 and ev.seconds >= 0 for ev in events)
+
+
+def test_instrumentation_reports_failures(run_cmd) -> None:
+    events: list[sdm.CommandEvent] = []
+    with sdm.instrumentation(events.append), pytest.raises(sh.ShellInterfaceError):
+        sdm.chown(Path("/mnt"), "false", recursive=False)
+    expected_exit_code = 32
+    assert [ev.exit_code for ev in events] == [expected_exit_code]
+
+
+def test_instrumentation_unregisters_hook(run_cmd) -> None:
+    events: list[sdm.CommandEvent] = []
+    with sdm.instrumentation(events.append):
+        pass
+    sdm.get_filesystem(Path("/dev/sdx"))
+    assert events == []
+
+
+def test_command_class_includes_subcommands() -> None:
+    assert _command_class(["sudo", "btrfs", "subvolume", "snapshot", "-r"]) == (
+        "btrfs subvolume snapshot"
+    )
+    assert _command_class(["sudo", "cryptsetup", "open", Path("/dev/sdx")]) == (
+        "cryptsetup open"
+    )
+    assert _command_class(["sudo", "mount", Path("/dev/sdx")]) == "mount"
+
+
+def test_command_histogram_exports_prometheus_text(run_cmd) -> None:
+    histogram = sdm.CommandHistogram(buckets=[0.5, 60])
+    with sdm.instrumentation(histogram):
+        sdm.get_filesystem(Path("/dev/sdx"))
+        with pytest.raises(sh.ShellInterfaceError):
+            sdm.chown(Path("/mnt"), "false", recursive=False)
+    assert histogram.count("get_filesystem", "blkid") == 1
+    text = histogram.to_prometheus()
+    labels = 'operation="chown",command="chown"'
+    assert (
+        f'storage_device_managers_command_duration_seconds_bucket{{{labels},le="60"}} 1'
+        in text
+    )
+    assert f"storage_device_managers_command_failures_total{{{labels}}} 1" in text
+    # Each family is one block, introduced by its own HELP and TYPE lines.
+    family = None
+    seen = []
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            family = line.split()[2]
+            assert family not in seen
+            seen.append(family)
+        elif not line.startswith("# HELP "):
+            assert family is not None
+            assert line.split("{")[0].startswith(family)
+    assert seen == [
+        "storage_device_managers_command_duration_seconds",
+        "storage_device_managers_command_failures_total",
+        "storage_device_managers_command_written_bytes_total",
+    ]
+
+
+def test_json_lines_exporter_writes_one_line_per_event(run_cmd) -> None:
+    stream = io.StringIO()
+    with sdm.instrumentation(sdm.JsonLinesExporter(stream)):
+        sdm.get_filesystem(Path("/dev/sdx"))
+        sdm.get_filesystem(Path("/dev/sdy"))
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [rec["device"] for rec in records] == ["/dev/sdx", "/dev/sdy"]
+    assert {rec["command"] for rec in records} == {"blkid"}
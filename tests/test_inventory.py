@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import struct
+from pathlib import Path
+from uuid import UUID, uuid4
+
+import pytest
+
+import storage_device_managers as sdm
+from storage_device_managers import _inventory
+from storage_device_managers.testing import FakeBackend
+
+PASS_CMD = "echo secret"
+
+
+def write_image(path: Path, offset: int, payload: bytes) -> Path:
+    image = bytearray(_inventory._PROBE_SIZE)
+    image[offset : offset + len(payload)] = payload
+    path.write_bytes(bytes(image))
+    return path
+
+
+def luks2_image(path: Path, uuid: UUID, label: str) -> Path:
+    header = bytearray(512)
+    header[:8] = b"LUKS\xba\xbe\x00\x02"
+    header[24 : 24 + len(label)] = label.encode()
+    header[168:204] = str(uuid).encode()
+    return write_image(path, 0, bytes(header))
+
+
+def ext4_image(path: Path, uuid: UUID, label: str) -> Path:
+    superblock = bytearray(1024)
+    superblock[0x38:0x3A] = struct.pack("<H", 0xEF53)
+    superblock[0x68:0x78] = uuid.bytes
+    superblock[0x78 : 0x78 + len(label)] = label.encode()
+    return write_image(path, 1024, bytes(superblock))
+
+
+def btrfs_image(path: Path, uuid: UUID, label: str) -> Path:
+    superblock = bytearray(4096)
+    superblock[0x20:0x30] = uuid.bytes
+    superblock[0x40:0x48] = b"_BHRfS_M"
+    superblock[0x12B : 0x12B + len(label)] = label.encode()
+    return write_image(path, 64 * 1024, bytes(superblock))
+
+
+@pytest.fixture
+def dev_disk(tmp_path: Path, mocker) -> Path:
+    dev_disk = tmp_path / "disk"
+    for folder in ("by-uuid", "by-label", "by-partuuid"):
+        (dev_disk / folder).mkdir(parents=True)
+    mocker.patch.object(_inventory, "_DEV_DISK", dev_disk)
+    return dev_disk
+
+
+@pytest.mark.parametrize("make_image", [luks2_image, ext4_image, btrfs_image])
+def test_inventory_probes_superblocks(make_image, tmp_path: Path, dev_disk) -> None:
+    uuid = uuid4()
+    image = make_image(tmp_path / "image", uuid, "backup")
+    inventory = sdm.DeviceInventory()
+    inventory.probe(image)
+    assert inventory.resolve(uuid) == image
+    assert inventory.resolve(f"UUID={str(uuid).upper()}") == image
+    assert inventory.resolve("LABEL=backup") == image
+    assert inventory.identifiers(image) == {"UUID": str(uuid), "LABEL": "backup"}
+
+
+def test_inventory_reads_udev_symlinks(tmp_path: Path, dev_disk: Path) -> None:
+    device = tmp_path / "sdb1"
+    device.touch()
+    (dev_disk / "by-label" / r"my\x20backup").symlink_to(device)
+    (dev_disk / "by-partuuid" / "0a1b2c3d-01").symlink_to(device)
+    inventory = sdm.DeviceInventory()
+    assert inventory.resolve("LABEL=my backup") == device
+    assert inventory.resolve("PARTUUID=0A1B2C3D-01") == device
+
+
+def test_inventory_rescans_on_miss(tmp_path: Path, dev_disk: Path) -> None:
+    uuid = uuid4()
+    inventory = sdm.DeviceInventory(max_age=None)
+    with pytest.raises(sdm.DeviceNotFoundError):
+        inventory.resolve(uuid)
+    device = tmp_path / "sdc"
+    device.touch()
+    (dev_disk / "by-uuid" / str(uuid)).symlink_to(device)
+    assert inventory.resolve(uuid) == device
+
+
+def test_inventory_drops_removed_devices(tmp_path: Path, dev_disk: Path) -> None:
+    inventory = sdm.DeviceInventory(max_age=None)
+    (dev_disk / "by-label" / "data").symlink_to("/dev/sdz")
+    inventory.rescan()
+    assert inventory.identifiers(Path("/dev/sdz")) == {"LABEL": "data"}
+    inventory._handle_uevent(
+        b"remove@/devices/virtual/block/sdz\0ACTION=remove\0"
+        b"SUBSYSTEM=block\0DEVNAME=sdz\0"
+    )
+    assert inventory.identifiers(Path("/dev/sdz")) == {}
+
+
+@pytest.mark.parametrize("spec", [Path("/dev/sdx"), "/dev/sdx", "sdx=1"])
+def test_inventory_passes_paths_through(spec, dev_disk) -> None:
+    assert sdm.DeviceInventory().resolve(spec) == Path(str(spec))
+
+
+def test_decrypted_device_accepts_uuid(tmp_path: Path, dev_disk, mocker) -> None:
+    uuid = uuid4()
+    image = luks2_image(tmp_path / "sdx", uuid, "")
+    mocker.patch.object(_inventory, "device_inventory", sdm.DeviceInventory())
+    _inventory.device_inventory.probe(image)
+    backend = FakeBackend()
+    backend.add_encrypted_device(image, PASS_CMD, "ext4")
+    with sdm.command_backend(backend):
+        with sdm.decrypted_device(uuid, PASS_CMD) as decrypted:
+            assert decrypted == Path("/dev/mapper/sdx")
+            assert backend.mappings == {"sdx": str(image)}
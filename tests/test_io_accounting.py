@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+import storage_device_managers as sdm
+from storage_device_managers import _iostat
+
+PEAK = 3
+
+
+def stat_line(
+    read_ios: int, read_sectors: int, write_ios: int, write_sectors: int, in_flight: int
+) -> str:
+    fields = [read_ios, 0, read_sectors, 2 * read_ios, write_ios, 0, write_sectors]
+    fields += [3 * write_ios, in_flight, read_ios + write_ios, 0, 0, 0, 0, 0, 0, 0]
+    return " ".join(map(str, fields)) + "\n"
+
+
+@pytest.fixture
+def fake_sysfs(tmp_path: Path, mocker) -> tuple[Path, Path]:
+    """Create a sysfs with a dm-crypt mapping on top of a loop device"""
+    sysfs = tmp_path / "sys"
+    image = tmp_path / "image"
+    image.touch()
+    for name in ("dm-0", "loop7"):
+        (sysfs / "block" / name / "slaves").mkdir(parents=True)
+        (sysfs / "block" / name / "stat").write_text(stat_line(0, 0, 0, 0, 0))
+    (sysfs / "block/loop7/loop").mkdir()
+    (sysfs / "block/loop7/loop/backing_file").write_text(f"{image}\n")
+    (sysfs / "block/dm-0/slaves/loop7").symlink_to(sysfs / "block/loop7")
+    (sysfs / "class/block").mkdir(parents=True)
+    for name in ("dm-0", "loop7"):
+        (sysfs / "class/block" / name).symlink_to(sysfs / "block" / name)
+    mocker.patch("storage_device_managers._block._SYSFS", sysfs)
+    mocker.patch.object(_iostat, "_SYSFS", sysfs)
+    return sysfs, image
+
+
+def test_io_accounting_reports_differences(fake_sysfs) -> None:
+    sysfs, image = fake_sysfs
+    (sysfs / "block/loop7/stat").write_text(stat_line(10, 80, 5, 40, 0))
+    with sdm.io_accounting(image, sample_interval=None) as io:
+        assert io.devices == ("loop7",)
+        (sysfs / "block/loop7/stat").write_text(stat_line(20, 160, 9, 72, PEAK))
+        assert io.report()["loop7"].in_flight_peak == PEAK
+        (sysfs / "block/loop7/stat").write_text(stat_line(30, 240, 15, 120, 0))
+    (sysfs / "block/loop7/stat").write_text(stat_line(99, 999, 99, 999, 0))
+    stats = io.report()["loop7"]
+    assert (stats.read_ios, stats.write_ios) == (20, 10)
+    assert (stats.read_bytes, stats.write_bytes) == (160 * 512, 80 * 512)
+    assert stats.read_latency == pytest.approx(0.002)
+    assert stats.write_latency == pytest.approx(0.003)
+    assert stats.service_time == pytest.approx(0.001)
+    assert stats.in_flight_peak == PEAK
+    assert stats.iops == pytest.approx(30 / stats.seconds)
+
+
+def test_io_accounting_follows_slaves_of_mount_source(
+    fake_sysfs, tmp_path: Path, mocker
+) -> None:
+    sysfs, image = fake_sysfs
+    mount_dir = tmp_path / "mount point"
+    mount_dir.mkdir()
+    escaped_dir = str(mount_dir).replace(" ", "\\040")
+    mountinfo = tmp_path / "mountinfo"
+    mountinfo.write_text(
+        "22 1 0:21 / / rw - ext4 /dev/root rw\n"
+        f"36 22 0:32 / {escaped_dir} rw - btrfs {image} rw\n"
+    )
+    mocker.patch.object(_iostat, "_PROC_MOUNTINFO", mountinfo)
+    # Pretend that the mount source is the dm-crypt mapping.
+    mocker.patch.object(_iostat, "_loop_device_name", return_value="dm-0")
+    with sdm.io_accounting(mount_dir, sample_interval=0.001) as io:
+        (sysfs / "block/loop7/stat").write_text(stat_line(0, 0, 1, 8, PEAK))
+        (sysfs / "block/dm-0/stat").write_text(stat_line(0, 0, 1, 8, 0))
+    assert io.devices == ("dm-0", "loop7")
+    report = io.report()
+    assert report["dm-0"].write_bytes == report["loop7"].write_bytes == 8 * 512
+    assert report["loop7"].in_flight_peak == PEAK
+
+
+def test_io_accounting_rejects_plain_directories(fake_sysfs, tmp_path: Path, mocker):
+    mountinfo = tmp_path / "mountinfo"
+    mountinfo.write_text("22 1 0:21 / / rw - ext4 /dev/root rw\n")
+    mocker.patch.object(_iostat, "_PROC_MOUNTINFO", mountinfo)
+    with pytest.raises(ValueError, match="no mount point"):
+        with sdm.io_accounting(tmp_path):
+            pass
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import subprocess
+from pathlib import Path
+
+import pytest
+import shell_interface as sh
+
+import storage_device_managers as sdm
+from storage_device_managers import _block
+
+
+@pytest.fixture
+def fake_losetup(mocker):
+    mocker.patch("storage_device_managers._block._loop_pool", [])
+    completed = subprocess.CompletedProcess(
+        args=[], returncode=0, stdout=b"/dev/loop5\n"
+    )
+    return mocker.patch("shell_interface.run_cmd", return_value=completed)
+
+
+def test_loop_device_configures_device(fake_losetup, tmp_path) -> None:
+    image = tmp_path / "image"
+    image.touch()
+    with sdm.loop_device(image, block_size=512, read_only=True) as device:
+        assert device == Path("/dev/loop5")
+    commands = [c.kwargs["cmd"] for c in fake_losetup.call_args_list]
+    assert commands == [
+        [
+            "sudo",
+            "losetup",
+            "--find",
+            "--show",
+            "--direct-io=on",
+            "--sector-size",
+            "512",
+            "--read-only",
+            image,
+        ],
+        ["sudo", "losetup", "--detach", Path("/dev/loop5")],
+    ]
+
+
+def test_loop_device_reuses_detached_devices(fake_losetup, tmp_path) -> None:
+    image = tmp_path / "image"
+    image.touch()
+    with sdm.loop_device(image):
+        pass
+    with sdm.loop_device(image, direct_io=False) as device:
+        assert device == Path("/dev/loop5")
+    attach_cmd = fake_losetup.call_args_list[2].kwargs["cmd"]
+    assert "--find" not in attach_cmd
+    assert attach_cmd[-2:] == [Path("/dev/loop5"), image]
+    assert "--direct-io=off" in attach_cmd
+
+
+def test_loop_device_drops_broken_pooled_devices(
+    fake_losetup, tmp_path, mocker
+) -> None:
+    mocker.patch("storage_device_managers._block._loop_pool", [Path("/dev/loop9")])
+    warning = mocker.patch("storage_device_managers._block.logger.warning")
+    completed = fake_losetup.return_value
+    fake_losetup.side_effect = [sh.ShellInterfaceError("busy"), completed, completed]
+    image = tmp_path / "image"
+    image.touch()
+    with sdm.loop_device(image) as device:
+        assert device == Path("/dev/loop5")
+    warning.assert_called_once()
+    assert warning.call_args.kwargs["device"] == Path("/dev/loop9")
+    assert _block._loop_pool == [Path("/dev/loop5")]
+
+
+def test_loop_device_rejects_missing_image(tmp_path) -> None:
+    with pytest.raises(FileNotFoundError):
+        with sdm.loop_device(tmp_path / "missing"):
+            pass
+
+
+def test_loop_device_composes_with_mounted_device(btrfs_device) -> None:
+    with sdm.loop_device(btrfs_device) as loop:
+        assert loop.is_block_device()
+        with sdm.mounted_device(loop) as md:
+            assert sdm.is_mounted(loop)
+            assert md in sdm.get_mounted_devices()[str(loop)]
+    assert not sdm.is_mounted(loop)
+
+
+def test_loop_device_composes_with_decrypted_device(encrypted_device) -> None:
+    device, pass_cmd = encrypted_device
+    with sdm.loop_device(device) as loop:
+        with sdm.decrypted_device(loop, pass_cmd) as decrypted:
+            assert sdm.get_filesystem(decrypted) == "btrfs"
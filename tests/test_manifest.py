@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+import pytest
+
+import storage_device_managers as sdm
+from storage_device_managers import _manifest
+
+N_FILES = 3
+
+
+@pytest.fixture
+def tree(tmp_path: Path) -> Path:
+    root = tmp_path / "backup"
+    (root / "a" / "b").mkdir(parents=True)
+    (root / "top.txt").write_text("top")
+    (root / "a" / "empty").touch()
+    (root / "a" / "b" / "large.bin").write_bytes(os.urandom(3 * 1024**2 + 17))
+    (root / "a" / "link").symlink_to("../top.txt")
+    return root
+
+
+def test_update_manifest_hashes_all_files_initially(tree: Path) -> None:
+    stats = sdm.update_manifest(tree, jobs=4)
+    assert stats.manifest == tree / _manifest._MANIFEST_NAME
+    assert stats.manifest.exists()
+    assert (stats.n_files, stats.n_hashed) == (3, 3)
+    assert stats.bytes_hashed == 3 + 3 * 1024**2 + 17
+    algorithm, entries = _manifest._read_manifest(stats.manifest)
+    assert algorithm == _manifest._DEFAULT_HASH
+    assert set(entries) == {"top.txt", "a/empty", "a/b/large.bin"}
+
+
+def test_update_manifest_rehashes_only_changed_files(tree: Path) -> None:
+    sdm.update_manifest(tree)
+    (tree / "top.txt").write_text("changed")
+    (tree / "a" / "new").write_text("new")
+    (tree / "a" / "empty").unlink()
+    stats = sdm.update_manifest(tree)
+    assert (stats.n_files, stats.n_hashed) == (3, 2)
+    assert stats.bytes_hashed == len("changed") + len("new")
+
+
+def test_update_manifest_rehashes_all_for_other_hash(tree: Path, mocker) -> None:
+    manifest = tree.parent / "manifest.json.gz"
+    sdm.update_manifest(tree, manifest=manifest)
+    mocker.patch.object(_manifest, "_DEFAULT_HASH", "other")
+    mocker.patch.dict(_manifest._HASHES, {"other": _manifest._HASHES["blake2b"]})
+    stats = sdm.update_manifest(tree, manifest=manifest)
+    assert stats.n_hashed == stats.n_files == N_FILES
+    assert _manifest._read_manifest(manifest)[0] == "other"
+
+
+def test_verify_manifest_detects_corruption(tree: Path) -> None:
+    sdm.update_manifest(tree)
+    large = tree / "a" / "b" / "large.bin"
+    stat = large.stat()
+    with large.open("r+b") as fh:
+        fh.seek(1024**2)
+        fh.write(b"\0")
+    os.utime(large, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    (tree / "top.txt").unlink()
+    stats = sdm.verify_manifest(tree)
+    assert stats.missing == ("top.txt",)
+    assert stats.mismatched == ("a/b/large.bin",)
+    assert stats.n_hashed == N_FILES - 1
+    # The incremental update cannot detect corruption without changed metadata.
+    assert sdm.update_manifest(tree).n_hashed == 0
+
+
+def test_verify_manifest_requires_manifest(tree: Path) -> None:
+    with pytest.raises(FileNotFoundError):
+        sdm.verify_manifest(tree)
@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 import typing as t
+from pathlib import Path
+from uuid import uuid4
 
 import pytest
 
@@ -16,3 +18,114 @@ def test_mkfs_ext4(big_file) -> None:
 def test_mkfs(big_file, filesystem) -> None:
     sdm.mkfs(big_file, filesystem)
     assert sdm.get_filesystem(big_file) == filesystem
+
+
+@pytest.mark.parametrize("profile", list(sdm.MkfsProfiles))
+@pytest.mark.parametrize("filesystem", t.get_args(sdm.ValidFileSystems))
+def test_mkfs_with_profile(big_file, filesystem, profile) -> None:
+    sdm.mkfs(big_file, filesystem, profile)
+    assert sdm.get_filesystem(big_file) == filesystem
+
+
+def test_mkfs_btrfs_passes_options(mocker) -> None:
+    run_cmd = mocker.patch("shell_interface.run_cmd")
+    device = Path("/dev/null")
+    uuid = uuid4()
+    options = sdm.BtrfsMkfsOptions(
+        label="backup",
+        uuid=uuid,
+        nodesize=32768,
+        nodiscard=True,
+        checksum=sdm.ChecksumAlgorithms.BLAKE2,
+        block_group_tree=True,
+    )
+    sdm.mkfs_btrfs(device, options)
+    cmd = run_cmd.call_args.kwargs["cmd"]
+    assert cmd[:2] == ["sudo", "mkfs.btrfs"]
+    assert cmd[-1] == device
+    for flag, value in [
+        ("--label", "backup"),
+        ("--uuid", str(uuid)),
+        ("--nodesize", "32768"),
+        ("--csum", "blake2"),
+        ("--features", "block-group-tree"),
+    ]:
+        assert cmd[cmd.index(flag) + 1] == value
+    assert "--nodiscard" in cmd
+    assert "--sectorsize" not in cmd
+
+
+def test_mkfs_ext4_passes_options(mocker) -> None:
+    run_cmd = mocker.patch("shell_interface.run_cmd")
+    device = Path("/dev/null")
+    options = sdm.Ext4MkfsOptions(
+        label="backup",
+        lazy_itable_init=False,
+        lazy_journal_init=True,
+        nodiscard=True,
+        journal=False,
+        stride=16,
+        stripe_width=32,
+    )
+    sdm.mkfs_ext4(device, options)
+    cmd = run_cmd.call_args.kwargs["cmd"]
+    assert cmd[:2] == ["sudo", "mkfs.ext4"]
+    assert cmd[-1] == device
+    assert cmd[cmd.index("-L") + 1] == "backup"
+    assert cmd[cmd.index("-O") + 1] == "^has_journal"
+    extended = cmd[cmd.index("-E") + 1].split(",")
+    assert set(extended) == {
+        "lazy_itable_init=0",
+        "lazy_journal_init=1",
+        "stride=16",
+        "stripe_width=32",
+        "nodiscard",
+    }
+
+
+def test_fast_provision_zeroes_ext4_tables_within_mkfs(mocker) -> None:
+    run_cmd = mocker.patch("shell_interface.run_cmd")
+    sdm.mkfs_ext4(Path("/dev/null"), sdm.MkfsProfiles.FAST_PROVISION)
+    cmd = run_cmd.call_args.kwargs["cmd"]
+    extended = cmd[cmd.index("-E") + 1].split(",")
+    assert set(extended) == {"lazy_itable_init=0", "lazy_journal_init=0", "nodiscard"}
+
+
+def test_mkfs_without_options_passes_no_flags(mocker) -> None:
+    run_cmd = mocker.patch("shell_interface.run_cmd")
+    device = Path("/dev/null")
+    sdm.mkfs_ext4(device)
+    sdm.mkfs_btrfs(device)
+    commands = [c.kwargs["cmd"] for c in run_cmd.call_args_list]
+    assert commands == [
+        ["sudo", "mkfs.ext4", device],
+        ["sudo", "mkfs.btrfs", device],
+    ]
+
+
+@pytest.mark.parametrize(
+    ("filesystem", "options"),
+    [("btrfs", sdm.Ext4MkfsOptions()), ("ext4", sdm.BtrfsMkfsOptions())],
+)
+def test_mkfs_rejects_options_of_other_filesystem(filesystem, options) -> None:
+    with pytest.raises(TypeError):
+        sdm.mkfs(Path("/dev/null"), filesystem, options)
+
+
+def test_mkfs_btrfs_creates_multi_device_filesystem(mocker) -> None:
+    run_cmd = mocker.patch("shell_interface.run_cmd")
+    devices = [Path("/dev/sdx"), Path("/dev/sdy")]
+    options = sdm.BtrfsMkfsOptions(
+        data_profile=sdm.BtrfsProfiles.RAID0,
+        metadata_profile=sdm.BtrfsProfiles.RAID1,
+    )
+    sdm.mkfs_btrfs(devices, options)
+    assert run_cmd.call_args.kwargs["cmd"] == [
+        "sudo",
+        "mkfs.btrfs",
+        "--data",
+        "raid0",
+        "--metadata",
+        "raid1",
+        *devices,
+    ]
@@ -7,6 +7,7 @@ import pytest
 import shell_interface as sh
 
 import storage_device_managers as sdm
+from storage_device_managers.testing import FakeBackend
 
 
 def in_docker_container() -> bool:
@@ -118,7 +119,7 @@ def test_mounted_device_does_not_delete_content_on_umount_error(
 ) -> None:
     compression = sdm.ValidCompressions.ZSTD15
     mocker.patch(
-        "storage_device_managers.unmount_device",
+        "storage_device_managers._mounts.unmount_device",
         side_effect=sdm.UnmountError("Mocked unmount error"),
     )
     user = sh.get_user()
@@ -134,3 +135,72 @@ def test_mounted_device_does_not_delete_content_on_umount_error(
     mocker.stopall()
     sdm.unmount_device(btrfs_device)
     assert not sdm.is_mounted(btrfs_device)
+
+
+def test_mount_btrfs_device_passes_all_members(mocker) -> None:
+    run_cmd = mocker.patch("shell_interface.run_cmd")
+    devices = [Path("/dev/sdx"), Path("/dev/sdy"), Path("/dev/sdz")]
+    mount_dir = Path("/mnt")
+    sdm.mount_btrfs_device(devices, mount_dir, sdm.ValidCompressions.ZSTD)
+    commands = [c.kwargs["cmd"] for c in run_cmd.call_args_list]
+    assert commands == [
+        ["sudo", "btrfs", "device", "scan", *devices],
+        [
+            "sudo",
+            "mount",
+            devices[0],
+            mount_dir,
+            "-o",
+            "compress=zstd,device=/dev/sdy,device=/dev/sdz",
+        ],
+    ]
+
+
+def test_mount_device_rejects_multiple_ext4_devices(mocker) -> None:
+    mocker.patch("storage_device_managers._mounts.get_filesystem", return_value="ext4")
+    with pytest.raises(ValueError, match="Multiple devices"):
+        sdm.mount_device([Path("/dev/sdx"), Path("/dev/sdy")], Path("/mnt"))
+
+
+def test_temporary_directory_reuses_empty_named_directory(tmp_path: Path) -> None:
+    (tmp_path / "backup").mkdir()
+    with sdm.temporary_directory(tmp_path, "backup") as directory:
+        assert directory == tmp_path / "backup"
+    assert not directory.exists()
+
+
+def test_temporary_directory_refuses_non_empty_named_directory(
+    tmp_path: Path,
+) -> None:
+    sentinel = tmp_path / "backup" / "sentinel"
+    sentinel.parent.mkdir()
+    sentinel.touch()
+    with pytest.raises(FileExistsError):
+        with sdm.temporary_directory(tmp_path, "backup"):
+            pass
+    assert sentinel.exists()
+
+
+@pytest.mark.parametrize("name", ["", "..", "a/b"])
+def test_temporary_directory_rejects_invalid_names(tmp_path: Path, name) -> None:
+    with pytest.raises(ValueError, match="plain file name"):
+        with sdm.temporary_directory(tmp_path, name):
+            pass
+
+
+def test_mounted_device_uses_deterministic_directory(tmp_path: Path) -> None:
+    backend = FakeBackend()
+    device = Path("/dev/sdx")
+    backend.add_device(device, "ext4")
+    directory = sdm.MountDirectory(base_dir=tmp_path, by_uuid=True)
+    with sdm.command_backend(backend):
+        with sdm.mounted_device(device, directory=directory) as first:
+            assert first.parent == tmp_path
+            assert backend.mounts[0].target == str(first)
+        with sdm.mounted_device(device, directory=directory) as second:
+            assert second == first
+        with sdm.mounted_device(
+            device, directory=sdm.MountDirectory(tmp_path, "x")
+        ) as named:
+            assert named == tmp_path / "x"
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import subprocess
+from pathlib import Path
+
+import pytest
+
+import storage_device_managers as sdm
+
+MOUNT_OUTPUT = b"/dev/sdx on /mnt type btrfs (rw,relatime)\n"
+
+
+@pytest.fixture
+def run_cmd(mocker):
+    def fake_run_cmd(cmd, capture_output=False):
+        stdout = b""
+        if cmd == ["mount"]:
+            stdout = MOUNT_OUTPUT
+        elif "blkid" in cmd:
+            stdout = b"btrfs\n"
+        return subprocess.CompletedProcess(args=cmd, returncode=0, stdout=stdout)
+
+    return mocker.patch("shell_interface.run_cmd", side_effect=fake_run_cmd)
+
+
+def test_operation_reuses_read_only_queries(run_cmd) -> None:
+    device = Path("/dev/sdx")
+    n_queries = 3
+    with sdm.operation() as statistics:
+        for _ in range(n_queries):
+            assert sdm.get_filesystem(device) == "btrfs"
+            assert sdm.is_mounted(device)
+    commands = [c.kwargs["cmd"] for c in run_cmd.call_args_list]
+    assert commands == [
+        ["sudo", "blkid", "-o", "value", "-s", "TYPE", device],
+        ["mount"],
+    ]
+    assert statistics.commands == len(commands)
+    assert statistics.cache_hits == 2 * (n_queries - 1)
+
+
+def test_operation_invalidates_cache_on_mutating_command(run_cmd) -> None:
+    device = Path("/dev/sdx")
+    with sdm.operation() as statistics:
+        sdm.get_mounted_devices()
+        sdm.get_filesystem(device)
+        sdm.mount_btrfs_device(device, Path("/mnt"))
+        # The file system is unaffected by mounting.
+        sdm.get_filesystem(device)
+        sdm.get_mounted_devices()
+    commands = [c.kwargs["cmd"][:2] for c in run_cmd.call_args_list]
+    assert commands == [["mount"], ["sudo", "blkid"], ["sudo", "mount"], ["mount"]]
+    assert statistics.commands == len(commands)
+    assert statistics.cache_hits == 1
+
+
+def test_operation_skips_repeated_sync(run_cmd) -> None:
+    device = Path("/dev/sdx")
+    with sdm.operation() as statistics:
+        sdm.sync_device(device)
+        sdm.sync_device(device)
+        sdm.chown(Path("/mnt"), "root", recursive=False)
+        sdm.sync_device(device)
+    assert statistics.skipped_syncs == 1
+    sync_cmd = ["sudo", "sync", "-f", device]
+    sync_calls = [c for c in run_cmd.call_args_list if c.kwargs["cmd"] == sync_cmd]
+    assert len(sync_calls) == len(["before chown", "after chown"])
+
+
+def test_queries_are_not_cached_outside_of_operation(run_cmd) -> None:
+    sdm.get_mounted_devices()
+    sdm.get_mounted_devices()
+    assert [c.kwargs["cmd"] for c in run_cmd.call_args_list] == [["mount"], ["mount"]]
+
+
+def test_nested_operations_share_statistics(run_cmd) -> None:
+    with sdm.operation() as outer:
+        with sdm.operation() as inner:
+            sdm.get_mounted_devices()
+    assert inner is outer
+    assert outer.commands == 1
+
+
+def test_unmount_device_counts_commands(run_cmd) -> None:
+    device = Path("/dev/sdx")
+    with sdm.operation() as statistics:
+        sdm.unmount_device(device)
+    commands = [c.kwargs["cmd"] for c in run_cmd.call_args_list]
+    assert commands == [
+        ["sudo", "blkid", "-o", "value", "-s", "TYPE", device],
+        ["mount"],
+        ["sudo", "btrfs", "filesystem", "sync", Path("/mnt")],
+        ["sudo", "sync", "-f", device],
+        ["sudo", "umount", device],
+    ]
+    assert statistics.commands == len(commands)
@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import errno
+import typing as t
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import pytest
+import shell_interface as sh
+
+import storage_device_managers as sdm
+from storage_device_managers import _crypt, _images
+from storage_device_managers.testing import FakeBackend
+
+SIZE = 16 * 1024**2
+N_TEMPLATES_CREATED = 2
+CACHE_DIR_MODE = 0o700
+PASS_CMD = "echo secret"
+
+
+def create_zeroed(template: Path, size: int, *_: object) -> None:
+    template.parent.mkdir(parents=True, exist_ok=True)
+    with template.open("wb") as fh:
+        fh.truncate(size)
+
+
+def write_marker(template: Path) -> None:
+    with template.open("r+b") as fh:
+        fh.seek(SIZE // 2)
+        fh.write(b"golden template")
+
+
+def test_provision_image_creates_sparse_file(tmp_path) -> None:
+    dest = tmp_path / "image"
+    result = sdm.provision_image(dest, SIZE, cache_dir=tmp_path / "cache")
+    assert result == dest
+    assert dest.stat().st_size == SIZE
+    assert dest.stat().st_blocks == 0
+
+
+def test_provision_image_clones_template(tmp_path) -> None:
+    cache_dir = tmp_path / "cache"
+    sdm.provision_image(tmp_path / "first", SIZE, cache_dir=cache_dir)
+    (template,) = cache_dir.glob("*.img")
+    marker = b"golden template"
+    offset = SIZE // 2
+    with template.open("r+b") as fh:
+        fh.seek(offset)
+        fh.write(marker)
+
+    dest = tmp_path / "second"
+    sdm.provision_image(dest, SIZE, cache_dir=cache_dir)
+    assert list(cache_dir.glob("*.img")) == [template]
+    assert dest.read_bytes() == template.read_bytes()
+    assert dest.stat().st_blocks * 512 < SIZE
+
+
+def test_provision_image_rejects_non_empty_dest(tmp_path) -> None:
+    dest = tmp_path / "image"
+    dest.write_text("Must not be overwritten.")
+    with pytest.raises(FileExistsError):
+        sdm.provision_image(dest, SIZE, cache_dir=tmp_path / "cache")
+    assert dest.read_text() == "Must not be overwritten."
+
+
+@pytest.mark.parametrize("filesystem", t.get_args(sdm.ValidFileSystems))
+def test_provision_image_formats_image(tmp_path, filesystem) -> None:
+    cache_dir = tmp_path / "cache"
+    for name in ["first", "second"]:
+        dest = sdm.provision_image(
+            tmp_path / name, 128 * 1024**2, filesystem, cache_dir=cache_dir
+        )
+        assert sdm.get_filesystem(dest) == filesystem
+    assert len(list(cache_dir.glob("*.img"))) == 1
+
+
+def test_provision_image_encrypts_image(tmp_path) -> None:
+    pass_cmd = sdm.generate_passcmd()
+    dest = sdm.provision_image(
+        tmp_path / "image",
+        128 * 1024**2,
+        "btrfs",
+        pass_cmd=pass_cmd,
+        cache_dir=tmp_path / "cache",
+    )
+    with sdm.decrypted_device(dest, pass_cmd) as decrypted:
+        assert sdm.get_filesystem(decrypted) == "btrfs"
+
+
+def test_provision_image_keys_templates_by_password_command(tmp_path, mocker) -> None:
+    cache_dir = tmp_path / "cache"
+
+    def create_template(template, size, *_):
+        template.parent.mkdir(parents=True, exist_ok=True)
+        template.write_bytes(b"\0" * size)
+
+    create = mocker.patch.object(
+        _images, "_create_template", side_effect=create_template
+    )
+    mocker.patch.object(_images, "_regenerate_uuids")
+    test_passphrase = mocker.patch.object(_images, "_pipe_pass_cmd_to_real_cmd")
+    for name, pass_cmd in [("a", "echo first"), ("b", "echo second")]:
+        sdm.provision_image(
+            tmp_path / name, SIZE, pass_cmd=pass_cmd, cache_dir=cache_dir
+        )
+    templates = sorted(cache_dir.glob("*.img"))
+    assert create.call_count == len(templates) == N_TEMPLATES_CREATED
+    assert cache_dir.stat().st_mode & 0o777 == CACHE_DIR_MODE
+    sdm.provision_image(
+        tmp_path / "c", SIZE, pass_cmd="echo first", cache_dir=cache_dir
+    )
+    assert create.call_count == N_TEMPLATES_CREATED
+    # A template that its password command no longer opens is replaced.
+    test_passphrase.side_effect = sh.ShellInterfaceError("No key available")
+    sdm.provision_image(
+        tmp_path / "d", SIZE, pass_cmd="echo first", cache_dir=cache_dir
+    )
+    assert create.call_count == N_TEMPLATES_CREATED + 1
+    assert sorted(cache_dir.glob("*.img")) == templates
+
+
+@pytest.mark.parametrize("filesystem", t.get_args(sdm.ValidFileSystems))
+def test_provision_image_gives_clones_new_uuids(tmp_path, mocker, filesystem) -> None:
+    mocker.patch.object(_images, "_create_template", side_effect=create_zeroed)
+    backend = FakeBackend()
+    dest = tmp_path / "image"
+    backend.add_encrypted_device(dest, PASS_CMD, filesystem)
+    with sdm.command_backend(backend):
+        old_uuid = _crypt._luks_uuid(dest)
+        sdm.provision_image(
+            dest, SIZE, filesystem, pass_cmd=PASS_CMD, cache_dir=tmp_path / "cache"
+        )
+        assert _crypt._luks_uuid(dest) != old_uuid
+    assert [*_images._NEW_UUID_CMDS[filesystem], "/dev/mapper/image"] in (
+        backend.commands
+    )
+    assert backend.mappings == {}
+
+
+def test_provision_image_gives_unencrypted_clones_new_uuids(tmp_path, mocker) -> None:
+    mocker.patch.object(_images, "_create_template", side_effect=create_zeroed)
+    backend = FakeBackend()
+    dest = tmp_path / "image"
+    with sdm.command_backend(backend):
+        sdm.provision_image(dest, SIZE, "ext4", cache_dir=tmp_path / "cache")
+    assert backend.commands == [["tune2fs", "-U", "random", str(dest)]]
+
+
+def test_provision_image_copies_across_file_systems(tmp_path) -> None:
+    shm = Path("/dev/shm")
+    if not shm.is_dir() or shm.stat().st_dev == tmp_path.stat().st_dev:
+        pytest.skip("requires /dev/shm on another file system")
+    cache_dir = tmp_path / "cache"
+    sdm.provision_image(tmp_path / "first", SIZE, cache_dir=cache_dir)
+    (template,) = cache_dir.glob("*.img")
+    write_marker(template)
+    with TemporaryDirectory(dir=shm) as td:
+        dest = sdm.provision_image(Path(td) / "image", SIZE, cache_dir=cache_dir)
+        assert dest.read_bytes() == template.read_bytes()
+        assert dest.stat().st_blocks * 512 < SIZE
+
+
+def test_provision_image_copies_without_copy_file_range(tmp_path, mocker) -> None:
+    cache_dir = tmp_path / "cache"
+    sdm.provision_image(tmp_path / "first", SIZE, cache_dir=cache_dir)
+    (template,) = cache_dir.glob("*.img")
+    write_marker(template)
+    mocker.patch("fcntl.ioctl", side_effect=OSError(errno.EXDEV, "cross-device"))
+    mocker.patch("os.copy_file_range", side_effect=OSError(errno.EXDEV, "cross-device"))
+    dest = sdm.provision_image(tmp_path / "second", SIZE, cache_dir=cache_dir)
+    assert dest.read_bytes() == template.read_bytes()
+    assert dest.stat().st_blocks * 512 < SIZE
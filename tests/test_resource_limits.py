@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import os
+import subprocess
+from pathlib import Path
+
+import pytest
+import shell_interface as sh
+
+import storage_device_managers as sdm
+from storage_device_managers import _limits
+from storage_device_managers.testing import FakeBackend
+
+DEVICE = Path("/dev/sdx")
+IDLE_PRIORITY = 3 << 13
+
+
+class RecordingBackend(FakeBackend):
+    """FakeBackend remembering the commands as passed and the I/O priority"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.raw_commands: list[list[str]] = []
+        self.priorities: list[int] = []
+
+    def run_cmd(
+        self, cmd: sh.StrPathList, capture_output: bool
+    ) -> subprocess.CompletedProcess[bytes]:
+        self.raw_commands.append([str(arg) for arg in cmd])
+        self.priorities.append(_limits._ioprio_syscall(1))
+        return super().run_cmd(cmd, capture_output)
+
+
+@pytest.fixture
+def backend():
+    fake = RecordingBackend()
+    fake.add_device(DEVICE, "ext4")
+    with sdm.command_backend(fake):
+        yield fake
+
+
+@pytest.mark.skipif(
+    os.uname().machine not in _limits._IOPRIO_SYSCALLS, reason="unknown syscalls"
+)
+def test_operation_sets_io_priority_of_commands(backend) -> None:
+    before = _limits._ioprio_syscall(1)
+    limits = sdm.ResourceLimits(io_class=sdm.IoPriorityClasses.IDLE)
+    with sdm.operation(limits) as stats:
+        sdm.get_filesystem(DEVICE)
+    assert backend.priorities == [IDLE_PRIORITY]
+    assert _limits._ioprio_syscall(1) == before
+    assert stats.limits == limits
+
+
+def test_operation_runs_commands_in_transient_scopes(backend, tmp_path: Path) -> None:
+    io_max = {DEVICE: "wbps=52428800 riops=max"}
+    limits = sdm.ResourceLimits(io_weight=50, io_max=io_max, cpu_weight=20)
+    with sdm.operation(limits):
+        sdm.mount_device(DEVICE, tmp_path)
+        sdm.get_filesystem(DEVICE)
+    properties = [
+        "--property=IOWeight=50",
+        f"--property=IOWriteBandwidthMax={DEVICE} 52428800",
+        f"--property=IOReadIOPSMax={DEVICE} infinity",
+        "--property=CPUWeight=20",
+    ]
+    units = set()
+    for cmd in backend.raw_commands:
+        assert cmd[:5] == ["sudo", "systemd-run", "--scope", "--quiet", "--collect"]
+        assert cmd[6:11] == [*properties, "--"]
+        units.add(cmd[5])
+    assert len(units) == len(backend.raw_commands)
+    assert ["mount", "-t", "ext4", str(DEVICE), str(tmp_path)] in [
+        cmd[11:] for cmd in backend.raw_commands
+    ]
+    # The simulation is unaffected by the limits.
+    assert backend.mounts[0].target == str(tmp_path)
+
+
+def test_operation_rejects_invalid_io_max(backend) -> None:
+    limits = sdm.ResourceLimits(io_max={DEVICE: "wbps"})
+    with pytest.raises(ValueError, match=r"Invalid io\.max limit"):
+        with sdm.operation(limits):
+            sdm.get_filesystem(DEVICE)
+    assert backend.raw_commands == []
+
+
+def test_operation_checks_realtime_privilege_up_front(backend, mocker) -> None:
+    mocker.patch.object(_limits, "_ioprio_syscall", side_effect=PermissionError)
+    limits = sdm.ResourceLimits(io_class=sdm.IoPriorityClasses.REALTIME)
+    with pytest.raises(PermissionError, match="REALTIME"):
+        with sdm.operation(limits):
+            sdm.get_filesystem(DEVICE)
+    assert backend.raw_commands == []
+
+
+def test_nested_operations_keep_limits(backend) -> None:
+    limits = sdm.ResourceLimits(cpu_weight=20)
+    with sdm.operation(limits):
+        with sdm.operation(limits):
+            pass
+        with pytest.raises(ValueError, match="resource limits"):
+            with sdm.operation(sdm.ResourceLimits(cpu_weight=10)):
+                pass
+    assert backend.raw_commands == []
+
+
+def test_commands_without_root_privileges_stay_in_place() -> None:
+    properties = ["CPUWeight=20"]
+    assert _limits._in_scope(["mount"], properties) == ["mount"]
+    wrapped = _limits._in_scope(["sudo", "sync", "--", DEVICE], properties)
+    assert _limits._without_scope(wrapped) == ["sudo", "sync", "--", DEVICE]
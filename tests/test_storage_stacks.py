@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import contextlib
+import threading
+from pathlib import Path
+
+import pytest
+
+import storage_device_managers as sdm
+
+
+class MyCustomTestException(Exception):
+    pass
+
+
+@pytest.fixture
+def events(mocker):
+    """
+    Replace all layers by fakes that record their calls
+
+    Mounting `/dev/broken` fails with MyCustomTestException.
+    """
+    recorded: list[tuple[str, Path]] = []
+    lock = threading.Lock()
+
+    def record(event: str, device: Path) -> None:
+        with lock:
+            recorded.append((event, device))
+
+    @contextlib.contextmanager
+    def fake_decrypted_device(device, pass_cmd):
+        record("open", device)
+        try:
+            yield Path("/dev/mapper") / device.name
+        finally:
+            record("close", device)
+
+    @contextlib.contextmanager
+    def fake_mounted_device(device, compression=None):
+        if device.name == "broken":
+            raise MyCustomTestException
+        record("mount", device)
+        try:
+            yield Path("/mnt") / device.name
+        finally:
+            record("unmount", device)
+
+    mocker.patch(
+        "storage_device_managers._stacks.decrypted_device", fake_decrypted_device
+    )
+    mocker.patch("storage_device_managers._stacks.mounted_device", fake_mounted_device)
+    mocker.patch(
+        "storage_device_managers._stacks.mkfs",
+        side_effect=lambda device, fs: record("mkfs", device),
+    )
+    return recorded
+
+
+def test_storage_stacks_sets_up_and_tears_down_layers(events) -> None:
+    stacks = [
+        sdm.DeviceStack(Path("/dev/sdx"), pass_cmd="echo x", mount=True),
+        sdm.DeviceStack(Path("/dev/sdy"), filesystem="ext4", mount=True),
+    ]
+    with sdm.storage_stacks(stacks) as report:
+        assert report.decrypted == {Path("/dev/sdx"): Path("/dev/mapper/sdx")}
+        assert report.mount_points == {
+            Path("/dev/sdx"): Path("/mnt/sdx"),
+            Path("/dev/sdy"): Path("/mnt/sdy"),
+        }
+        assert {timing.name for timing in report.timings} == {
+            "/dev/sdx:decrypt",
+            "/dev/sdx:mount",
+            "/dev/sdy:mkfs",
+            "/dev/sdy:mount",
+        }
+        assert report.critical_path in (
+            ["/dev/sdx:decrypt", "/dev/sdx:mount"],
+            ["/dev/sdy:mkfs", "/dev/sdy:mount"],
+        )
+    for device in [Path("/dev/sdx"), Path("/dev/mapper/sdx")]:
+        assert events.count(("mount", device)) == events.count(("unmount", device))
+    sdx_events = [event for event in events if "sdx" in str(event[1])]
+    assert sdx_events == [
+        ("open", Path("/dev/sdx")),
+        ("mount", Path("/dev/mapper/sdx")),
+        ("unmount", Path("/dev/mapper/sdx")),
+        ("close", Path("/dev/sdx")),
+    ]
+    sdy_events = [event for event in events if "sdy" in str(event[1])]
+    assert sdy_events == [
+        ("mkfs", Path("/dev/sdy")),
+        ("mount", Path("/dev/sdy")),
+        ("unmount", Path("/dev/sdy")),
+    ]
+
+
+def test_storage_stacks_rolls_back_on_failure(events) -> None:
+    stacks = [
+        sdm.DeviceStack(Path("/dev/sdx"), pass_cmd="echo x", mount=True),
+        sdm.DeviceStack(Path("/dev/broken"), mount=True),
+    ]
+    with pytest.raises(MyCustomTestException):
+        with sdm.storage_stacks(stacks, max_workers=1):
+            raise AssertionError("Body must not be executed.")
+    opened = [device for event, device in events if event in {"open", "mount"}]
+    closed = [device for event, device in events if event in {"close", "unmount"}]
+    assert closed == opened[::-1]
+
+
+@pytest.mark.parametrize(
+    "stack",
+    [
+        sdm.DeviceStack(Path("/dev/sdx"), encrypt=True),
+        sdm.DeviceStack(Path("/dev/sdx"), owner="root"),
+        sdm.DeviceStack(Path("/dev/sdx"), symlink=Path("/tmp/link")),
+    ],
+)
+def test_storage_stacks_rejects_inconsistent_stacks(events, stack) -> None:
+    with pytest.raises(ValueError):
+        with sdm.storage_stacks([stack]):
+            pass
+    assert not events
+
+
+def test_storage_stacks_rejects_shared_devices(events) -> None:
+    stacks = [sdm.DeviceStack(Path("/dev/sdx"), mount=True)] * 2
+    with pytest.raises(ValueError, match="several stacks"):
+        with sdm.storage_stacks(stacks):
+            pass
+    assert not events
+
+
+def test_storage_stacks_with_real_devices(encrypted_device, ext4_device) -> None:
+    encrypted, pass_cmd = encrypted_device
+    stacks = [
+        sdm.DeviceStack(encrypted, pass_cmd=pass_cmd, mount=True),
+        sdm.DeviceStack(ext4_device, mount=True),
+    ]
+    with sdm.storage_stacks(stacks) as report:
+        for device in [encrypted, ext4_device]:
+            assert report.mount_points[device].is_dir()
+    assert not sdm.is_mounted(ext4_device)
+    assert not report.decrypted[encrypted].exists()
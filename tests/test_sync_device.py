@@ -7,10 +7,11 @@ from unittest.mock import call
 import shell_interface as sh
 
 import storage_device_managers as sdm
+from storage_device_managers import _mounts
 
 
 def test_sync_device_is_called_on_unmount(btrfs_device, mocker) -> None:
-    spy = mocker.spy(sdm, "sync_device")
+    spy = mocker.spy(_mounts, "sync_device")
     with TemporaryDirectory() as mount_dir:
         sdm.mount_btrfs_device(btrfs_device, Path(mount_dir))
         sdm.unmount_device(btrfs_device)
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+import storage_device_managers as sdm
+from storage_device_managers import _iostat
+from storage_device_managers.testing import FakeBackend, FakeMount
+
+PASS_CMD = "echo secret"
+OUTER = Path("/mnt/outer")
+INNER = OUTER / "inner"
+OTHER = Path("/mnt/other")
+N_NESTED = 2
+
+
+@pytest.fixture
+def backend(tmp_path: Path, mocker):
+    mountinfo = tmp_path / "mountinfo"
+    mountinfo.write_text(
+        "22 1 0:21 / / rw - ext4 /dev/root rw\n"
+        f"40 22 0:40 / {OUTER} rw - btrfs /dev/sdx rw\n"
+        f"41 40 0:41 / {INNER} rw - ext4 /dev/sdy rw\n"
+        f"42 22 0:40 / {OTHER} rw - btrfs /dev/sdx rw\n"
+    )
+    mocker.patch.object(_iostat, "_PROC_MOUNTINFO", mountinfo)
+    fake = FakeBackend()
+    with sdm.command_backend(fake):
+        yield fake
+
+
+def mount(backend: FakeBackend, device: str, mount_dir: Path) -> None:
+    filesystem = "ext4" if device == "/dev/sdy" else "btrfs"
+    backend.add_device(Path(device), filesystem)
+    backend.mounts.append(FakeMount(device, str(mount_dir), filesystem, ("rw",)))
+
+
+def umount_order(backend: FakeBackend) -> list[str]:
+    return [cmd[1] for cmd in backend.commands if cmd[0] == "umount"]
+
+
+def test_unmount_all_unmounts_nested_mounts_first(backend) -> None:
+    mount(backend, "/dev/sdx", OUTER)
+    mount(backend, "/dev/sdy", INNER)
+    mount(backend, "/dev/sdx", OTHER)
+    sdm.unmount_all([Path("/dev/sdx"), Path("/dev/sdy")])
+    assert backend.mounts == []
+    order = umount_order(backend)
+    assert order.index(str(INNER)) < order.index(str(OUTER))
+    syncs = [cmd for cmd in backend.commands if cmd[:2] == ["sync", "-f"]]
+    assert sorted(cmd[2] for cmd in syncs) == ["/dev/sdx", "/dev/sdy"]
+
+
+def test_unmount_all_accepts_mount_directories(backend) -> None:
+    mount(backend, "/dev/sdx", OUTER)
+    mount(backend, "/dev/sdx", OTHER)
+    sdm.unmount_all([OTHER])
+    assert umount_order(backend) == [str(OTHER)]
+    assert [mnt.target for mnt in backend.mounts] == [str(OUTER)]
+
+
+def test_unmount_all_keeps_parents_of_failed_mounts(backend) -> None:
+    mount(backend, "/dev/sdx", OUTER)
+    mount(backend, "/dev/sdy", INNER)
+    backend.inject_failure("umount", returncode=32)
+    with pytest.raises(ExceptionGroup) as exc_info:
+        sdm.unmount_all([Path("/dev/sdx"), Path("/dev/sdy")])
+    assert len(exc_info.value.exceptions) == len(backend.mounts) == N_NESTED
+    assert all(isinstance(e, sdm.UnmountError) for e in exc_info.value.exceptions)
+    assert umount_order(backend) == [str(INNER)]
+
+
+def test_unmount_all_reports_devices_not_mounted(backend) -> None:
+    mount(backend, "/dev/sdx", OTHER)
+    with pytest.raises(ExceptionGroup) as exc_info:
+        sdm.unmount_all([Path("/dev/sdz"), Path("/dev/sdx")])
+    assert exc_info.group_contains(sdm.UnmountError, match="/dev/sdz is not mounted")
+    assert backend.mounts == []
+
+
+def test_close_all_unmounts_and_closes(backend) -> None:
+    devices = [Path("/dev/sda"), Path("/dev/sdb")]
+    for device in devices:
+        backend.add_encrypted_device(device, PASS_CMD, "btrfs")
+    decrypted = [sdm.open_encrypted_device(dev, PASS_CMD) for dev in devices]
+    sdm.mount_device(decrypted[0], OTHER)
+    sdm.close_all(decrypted)
+    assert backend.mounts == []
+    assert backend.mappings == {}
+
+
+def test_close_all_aggregates_errors(backend) -> None:
+    backend.add_encrypted_device(Path("/dev/sda"), PASS_CMD, "btrfs")
+    decrypted = sdm.open_encrypted_device(Path("/dev/sda"), PASS_CMD)
+    with pytest.raises(ExceptionGroup) as exc_info:
+        sdm.close_all([Path("/dev/sdz"), decrypted])
+    assert exc_info.group_contains(sdm.InvalidDecryptedDevice)
+    assert backend.mappings == {}
@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import errno
+import functools
+import struct
+import subprocess
+from pathlib import Path
+
+import pytest
+
+import storage_device_managers as sdm
+from storage_device_managers import _iostat, _trim
+from storage_device_managers.testing import FakeBackend
+
+TRIMMED = 4096 * 1000
+DEVICE_SIZE = 1024**3
+# Larger than the device, like the statistics of a file system spanning devices
+FILESYSTEM_SIZE = 2 * DEVICE_SIZE
+# Block groups of BtrFS reallocated beyond the device size, e.g. by a balance
+BTRFS_CHUNKS = ((22020096, 8388608), (2 * DEVICE_SIZE, DEVICE_SIZE))
+BTRFS_END = 3 * DEVICE_SIZE
+
+
+def mount(tmp_path: Path, filesystem: str, source: Path | str) -> None:
+    mountinfo = tmp_path / "mountinfo"
+    mountinfo.write_text(f"40 22 0:40 / {tmp_path} rw - {filesystem} {source} rw\n")
+
+
+@pytest.fixture(autouse=True)
+def mount_source(tmp_path: Path, mocker) -> Path:
+    """Make `tmp_path` a mount point of a fake device"""
+    source = tmp_path / "device"
+    source.touch()
+    mount(tmp_path, "ext4", source)
+    mocker.patch.object(_iostat, "_PROC_MOUNTINFO", tmp_path / "mountinfo")
+    return source
+
+
+@pytest.fixture
+def block_device(mocker) -> None:
+    mocker.patch.object(Path, "is_block_device", return_value=True)
+
+
+def mock_statvfs(mocker, size: int) -> None:
+    statvfs = mocker.patch("os.statvfs")
+    statvfs.return_value.f_blocks = size
+    statvfs.return_value.f_frsize = 1
+
+
+def fake_ioctl(fd: int, request: int, buffer: bytearray) -> int:
+    if request == _trim._BLKGETSIZE64:
+        buffer[:] = struct.pack("Q", DEVICE_SIZE)
+        return 0
+    start, _, minimum = struct.unpack("QQQ", buffer)
+    buffer[:] = struct.pack("QQQ", start, TRIMMED, minimum)
+    return 0
+
+
+def run_cmd_output(
+    stdout: bytes, cmd: list[str], **kwargs: object
+) -> subprocess.CompletedProcess[bytes]:
+    if cmd[1] == "blockdev":
+        stdout = f"{DEVICE_SIZE}\n".encode()
+    elif cmd[1:3] == ["btrfs", "inspect-internal"]:
+        stdout = b"".join(
+            f"\titem 0 key (FIRST_CHUNK_TREE CHUNK_ITEM {start}) itemoff 15975\n"
+            f"\t\tlength {length} owner 2 stripe_len 65536 type DATA\n".encode()
+            for start, length in BTRFS_CHUNKS
+        )
+    return subprocess.CompletedProcess(args=cmd, returncode=0, stdout=stdout)
+
+
+@pytest.mark.usefixtures("block_device")
+def test_trim_filesystem_uses_fitrim(tmp_path: Path, mocker) -> None:
+    ioctl = mocker.patch("fcntl.ioctl", side_effect=fake_ioctl)
+    statistics = sdm.trim_filesystem(tmp_path, sdm.TrimRange(offset=4096, length=8192))
+    assert statistics.bytes_trimmed == TRIMMED
+    assert statistics.mount_dir == tmp_path
+    assert statistics.next_offset == 4096 + 8192
+    assert [call.args[1] for call in ioctl.call_args_list] == [
+        _trim._FITRIM,
+        _trim._BLKGETSIZE64,
+    ]
+
+
+@pytest.mark.usefixtures("block_device")
+def test_trim_filesystem_wraps_around_at_device_end(tmp_path: Path, mocker) -> None:
+    mocker.patch("fcntl.ioctl", side_effect=fake_ioctl)
+    mock_statvfs(mocker, FILESYSTEM_SIZE)
+    trim_range = sdm.TrimRange(offset=DEVICE_SIZE - 4096, length=8192)
+    assert sdm.trim_filesystem(tmp_path, trim_range).next_offset == 0
+    assert sdm.trim_filesystem(tmp_path).next_offset == 0
+
+
+@pytest.mark.usefixtures("block_device")
+def test_trim_filesystem_falls_back_to_fstrim(tmp_path: Path, mocker) -> None:
+    mocker.patch("fcntl.ioctl", side_effect=PermissionError)
+    mocker.patch("os.open", side_effect=PermissionError)
+    run_cmd = mocker.patch(
+        "shell_interface.run_cmd",
+        side_effect=functools.partial(
+            run_cmd_output, b"/mnt: 1 GiB (1073741824 bytes) trimmed\n"
+        ),
+    )
+    statistics = sdm.trim_filesystem(tmp_path, sdm.TrimRange(length=1024**2))
+    assert statistics.bytes_trimmed == 1024**3
+    assert statistics.next_offset == 1024**2
+    fstrim_cmd, size_cmd = (call.kwargs["cmd"] for call in run_cmd.call_args_list)
+    assert fstrim_cmd[:2] == ["sudo", "fstrim"]
+    assert fstrim_cmd[-2:] == ["--length", str(1024**2)]
+    assert size_cmd[:3] == ["sudo", "blockdev", "--getsize64"]
+
+
+@pytest.mark.parametrize("source", ["tmpfs", "device"])
+def test_trim_filesystem_wraps_around_without_block_device(
+    tmp_path: Path, mocker, source: str
+) -> None:
+    mount(tmp_path, "tmpfs", source if source == "tmpfs" else tmp_path / source)
+    ioctl = mocker.patch("fcntl.ioctl", side_effect=fake_ioctl)
+    mock_statvfs(mocker, FILESYSTEM_SIZE)
+    trim_range = sdm.TrimRange(offset=DEVICE_SIZE, length=8192)
+    assert sdm.trim_filesystem(tmp_path, trim_range).next_offset == DEVICE_SIZE + 8192
+    trim_range = sdm.TrimRange(offset=FILESYSTEM_SIZE - 4096, length=8192)
+    assert sdm.trim_filesystem(tmp_path, trim_range).next_offset == 0
+    assert _trim._BLKGETSIZE64 not in (call.args[1] for call in ioctl.call_args_list)
+
+
+def test_trim_filesystem_wraps_around_within_mount_point(
+    tmp_path: Path, mocker
+) -> None:
+    directory = tmp_path / "directory"
+    directory.mkdir()
+    mocker.patch("fcntl.ioctl", side_effect=fake_ioctl)
+    mock_statvfs(mocker, FILESYSTEM_SIZE)
+    trim_range = sdm.TrimRange(offset=FILESYSTEM_SIZE - 4096, length=8192)
+    assert sdm.trim_filesystem(directory, trim_range).next_offset == 0
+
+
+@pytest.mark.usefixtures("block_device")
+def test_trim_filesystem_wraps_around_at_btrfs_logical_end(
+    tmp_path: Path, mount_source: Path, mocker
+) -> None:
+    mount(tmp_path, "btrfs", mount_source)
+    mocker.patch("fcntl.ioctl", side_effect=fake_ioctl)
+    run_cmd = mocker.patch(
+        "shell_interface.run_cmd", side_effect=functools.partial(run_cmd_output, b"")
+    )
+    trim_range = sdm.TrimRange(offset=DEVICE_SIZE, length=DEVICE_SIZE)
+    assert sdm.trim_filesystem(tmp_path, trim_range).next_offset == 2 * DEVICE_SIZE
+    trim_range = sdm.TrimRange(offset=BTRFS_END - 4096, length=8192)
+    assert sdm.trim_filesystem(tmp_path, trim_range).next_offset == 0
+    assert run_cmd.call_args.kwargs["cmd"] == [
+        "sudo",
+        "btrfs",
+        "inspect-internal",
+        "dump-tree",
+        "-t",
+        "chunk",
+        mount_source,
+    ]
+
+
+def test_unmount_device_trims_before_unmounting(tmp_path: Path, mocker) -> None:
+    ioctl = mocker.patch("fcntl.ioctl", side_effect=fake_ioctl)
+    backend = FakeBackend()
+    device = Path("/dev/sdx")
+    backend.add_device(device, "ext4")
+    with sdm.command_backend(backend):
+        sdm.mount_device(device, tmp_path)
+        sdm.unmount_device(device, trim=sdm.TrimRange(length=1024**2))
+    assert [call.args[1] for call in ioctl.call_args_list].count(_trim._FITRIM) == 1
+    assert backend.mounts == []
+
+
+def test_unmount_device_unmounts_if_trim_fails(tmp_path: Path, mocker) -> None:
+    mocker.patch("fcntl.ioctl", side_effect=OSError(errno.EOPNOTSUPP, "no discard"))
+    backend = FakeBackend()
+    device = Path("/dev/sdx")
+    backend.add_device(device, "ext4")
+    with sdm.command_backend(backend):
+        sdm.mount_device(device, tmp_path)
+        sdm.unmount_device(device, trim=sdm.TrimRange())
+    assert backend.mounts == []
+
+
+@pytest.mark.parametrize("allow_discards", [True, False])
+def test_open_encrypted_device_allows_discards(allow_discards) -> None:
+    backend = FakeBackend()
+    backend.add_encrypted_device(Path("/dev/sdx"), "echo secret")
+    with sdm.command_backend(backend):
+        sdm.open_encrypted_device(
+            Path("/dev/sdx"), "echo secret", allow_discards=allow_discards
+        )
+    assert ("--allow-discards" in backend.commands[-1]) == allow_discards
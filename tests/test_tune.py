@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+import storage_device_managers as sdm
+from storage_device_managers.testing import FakeBackend
+
+DEVICE = Path("/dev/sdx")
+
+
+@pytest.fixture
+def backend():
+    fake = FakeBackend()
+    with sdm.command_backend(fake), sdm.operation():
+        yield fake
+
+
+def commands(backend: FakeBackend, program: str) -> list[list[str]]:
+    return [cmd for cmd in backend.commands if cmd[0] == program]
+
+
+def test_tune_ext4_online_settings(backend) -> None:
+    backend.add_device(DEVICE, "ext4")
+    settings = sdm.Ext4TuneSettings(
+        journal_mode=sdm.Ext4JournalModes.WRITEBACK, reserved_blocks_percentage=0.5
+    )
+    sdm.tune_filesystem(DEVICE, settings)
+    assert commands(backend, "tune2fs") == [
+        [
+            "tune2fs",
+            "-o",
+            "^journal_data_writeback,journal_data_writeback",
+            "-m",
+            "0.5",
+            str(DEVICE),
+        ]
+    ]
+
+
+def test_tune_ext4_recreates_journal_before_fast_commit(backend) -> None:
+    backend.add_device(DEVICE, "ext4")
+    sdm.tune_ext4(DEVICE, sdm.Ext4TuneSettings(fast_commit=True, journal_size=256))
+    assert commands(backend, "tune2fs") == [
+        ["tune2fs", "-O", "^has_journal", str(DEVICE)],
+        ["tune2fs", "-J", "size=256", str(DEVICE)],
+        ["tune2fs", "-O", "fast_commit", str(DEVICE)],
+    ]
+
+
+def test_tune_ext4_refuses_journal_changes_while_mounted(
+    backend, tmp_path: Path
+) -> None:
+    backend.add_device(DEVICE, "ext4")
+    sdm.mount_device(DEVICE, tmp_path)
+    with pytest.raises(sdm.FilesystemMountedError):
+        sdm.tune_ext4(DEVICE, sdm.Ext4TuneSettings(fast_commit=False))
+    assert commands(backend, "tune2fs") == []
+
+
+def test_tune_btrfs_uses_existing_mount(backend, tmp_path: Path) -> None:
+    backend.add_device(DEVICE, "btrfs")
+    sdm.mount_device(DEVICE, tmp_path)
+    settings = sdm.BtrfsTuneSettings(
+        compression={"home": "zstd", "var/log": "none"}, nodatacow=["images"]
+    )
+    sdm.tune_filesystem(DEVICE, settings)
+    assert commands(backend, "btrfs") == [
+        ["btrfs", "property", "set", str(tmp_path / "home"), "compression", "zstd"],
+        ["btrfs", "property", "set", str(tmp_path / "var/log"), "compression", "none"],
+    ]
+    assert commands(backend, "chattr") == [["chattr", "+C", str(tmp_path / "images")]]
+    assert len(backend.mounts) == 1
+
+
+def test_tune_btrfs_mounts_temporarily(backend, tmp_path: Path, mocker) -> None:
+    mocker.patch(
+        "storage_device_managers._files._default_mount_base", return_value=tmp_path
+    )
+    backend.add_device(DEVICE, "btrfs")
+    sdm.tune_btrfs(DEVICE, sdm.BtrfsTuneSettings(nodatacow=["images"]))
+    # Commands consisting of `mount` alone list the mounts.
+    [mount_cmd] = [cmd for cmd in commands(backend, "mount") if len(cmd) > 1]
+    mount_dir = Path(mount_cmd[-1])
+    assert mount_dir.parent == tmp_path
+    assert commands(backend, "chattr") == [["chattr", "+C", str(mount_dir / "images")]]
+    assert backend.mounts == []
+
+
+def test_tune_filesystem_rejects_mismatching_settings(backend) -> None:
+    backend.add_device(DEVICE, "ext4")
+    with pytest.raises(TypeError):
+        sdm.tune_filesystem(DEVICE, sdm.BtrfsTuneSettings())
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import subprocess
+from pathlib import Path
+
+import pytest
+import shell_interface as sh
+
+import storage_device_managers as sdm
+
+
+def write_tree(root: Path, files: dict[str, str]) -> None:
+    for name, content in files.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+
+
+@pytest.fixture
+def fake_sysfs(tmp_path, mocker):
+    """
+    Create a sysfs with a loop device stacked on top of a partition
+
+    Returns
+    -------
+    Path
+        root of the fake sysfs
+    Path
+        regular file that is attached to the loop device
+    """
+    sysfs = tmp_path / "sys"
+    image = tmp_path / "image"
+    image.touch()
+    write_tree(
+        sysfs,
+        {
+            "block/loop7/dev": "7:7\n",
+            "block/loop7/loop/backing_file": f"{image}\n",
+            "block/loop7/queue/read_ahead_kb": "128\n",
+            "block/loop7/queue/scheduler": "[none]\n",
+            "block/loop7/queue/nr_requests": "128\n",
+            "class/bdi/7:7/max_ratio": "100\n",
+            "class/bdi/7:7/strict_limit": "0\n",
+            "block/sda/dev": "8:0\n",
+            "block/sda/sda2/partition": "2\n",
+            "block/sda/queue/read_ahead_kb": "128\n",
+            "block/sda/queue/scheduler": "[mq-deadline] kyber bfq none\n",
+            "block/sda/queue/nr_requests": "64\n",
+        },
+    )
+    (sysfs / "block/loop7/slaves").mkdir()
+    (sysfs / "block/loop7/slaves/sda2").symlink_to(sysfs / "block/sda/sda2")
+    (sysfs / "class/block").mkdir(parents=True)
+    (sysfs / "class/block/loop7").symlink_to(sysfs / "block/loop7")
+    (sysfs / "class/block/sda2").symlink_to(sysfs / "block/sda/sda2")
+    mocker.patch("storage_device_managers._block._SYSFS", sysfs)
+    # Execute the write commands without `sudo`, since the fake sysfs is owned by
+    # the current user.
+    mocker.patch(
+        "shell_interface.run_cmd",
+        side_effect=lambda cmd: subprocess.run(cmd[1:], check=True),
+    )
+    return sysfs, image
+
+
+def test_tuned_block_device_applies_and_restores_settings(fake_sysfs) -> None:
+    sysfs, image = fake_sysfs
+    tuning = sdm.BlockQueueTuning(
+        read_ahead_kb=4096,
+        scheduler="bfq",
+        nr_requests=256,
+        max_ratio=20,
+        strict_limit=True,
+    )
+    expected_restored = {
+        "block/loop7/queue/read_ahead_kb": "128",
+        "block/sda/queue/scheduler": "mq-deadline",
+        "block/sda/queue/nr_requests": "64",
+        "class/bdi/7:7/max_ratio": "100",
+        "class/bdi/7:7/strict_limit": "0",
+    }
+    with sdm.tuned_block_device(image, tuning) as device:
+        assert device == image
+        assert (sysfs / "block/loop7/queue/read_ahead_kb").read_text() == "4096"
+        assert (sysfs / "block/sda/queue/scheduler").read_text() == "bfq"
+        assert (sysfs / "block/sda/queue/nr_requests").read_text() == "256"
+        assert (sysfs / "class/bdi/7:7/max_ratio").read_text() == "20"
+        assert (sysfs / "class/bdi/7:7/strict_limit").read_text() == "1"
+        # Device mapper targets have no scheduler of their own.
+        assert (sysfs / "block/loop7/queue/scheduler").read_text() == "[none]\n"
+    for name, restored in expected_restored.items():
+        assert (sysfs / name).read_text() == restored
+
+
+def test_tuned_block_device_leaves_unset_attributes_alone(fake_sysfs) -> None:
+    sysfs, image = fake_sysfs
+    with sdm.tuned_block_device(image, sdm.BlockQueueTuning(read_ahead_kb=1024)):
+        assert (sysfs / "block/sda/queue/nr_requests").read_text() == "64\n"
+        assert (sysfs / "class/bdi/7:7/max_ratio").read_text() == "100\n"
+
+
+def test_tuned_block_device_rejects_unattached_file(fake_sysfs, tmp_path) -> None:
+    unattached = tmp_path / "unattached"
+    unattached.touch()
+    with pytest.raises(ValueError, match="loop device"):
+        with sdm.tuned_block_device(unattached, sdm.BlockQueueTuning()):
+            pass
+
+
+def test_mounted_device_applies_tuning(btrfs_device) -> None:
+    tuning = sdm.BlockQueueTuning(read_ahead_kb=2048)
+    with sdm.mounted_device(btrfs_device, tuning=tuning):
+        for backing_file in Path("/sys/block").glob("loop*/loop/backing_file"):
+            if backing_file.read_text().strip() == str(btrfs_device.resolve()):
+                queue = backing_file.parent.parent / "queue"
+                assert (queue / "read_ahead_kb").read_text().strip() == "2048"
+                break
+        else:
+            raise AssertionError("No loop device found for mounted device.")
+
+
+def test_tuned_block_device_restores_settings_if_applying_fails(
+    fake_sysfs, mocker
+) -> None:
+    sysfs, image = fake_sysfs
+    nr_requests = sysfs / "block/sda/queue/nr_requests"
+    nr_requests.unlink()
+    # Writing to /proc/version fails with an I/O error.
+    nr_requests.symlink_to("/proc/version")
+
+    def run_cmd(cmd):
+        if subprocess.run(cmd[1:], check=False).returncode != 0:
+            raise sh.ShellInterfaceError(f"Command {cmd} failed!")
+
+    mocker.patch("shell_interface.run_cmd", side_effect=run_cmd)
+    tuning = sdm.BlockQueueTuning(read_ahead_kb=4096, scheduler="bfq", nr_requests=256)
+    with pytest.raises(sh.ShellInterfaceError):
+        with sdm.tuned_block_device(image, tuning):
+            pass
+    assert (sysfs / "block/loop7/queue/read_ahead_kb").read_text() == "128"
+    assert (sysfs / "block/sda/queue/scheduler").read_text() == "mq-deadline"
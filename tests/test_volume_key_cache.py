@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+import storage_device_managers as sdm
+from storage_device_managers.testing import FakeBackend
+
+PASS_CMD = "echo secret"
+DEVICE = Path("/dev/sdx")
+
+
+@pytest.fixture
+def backend():
+    fake = FakeBackend()
+    fake.add_encrypted_device(DEVICE, PASS_CMD, "btrfs")
+    with sdm.command_backend(fake):
+        yield fake
+
+
+def test_reopen_uses_cached_volume_key(backend) -> None:
+    cache = sdm.VolumeKeyCache(ttl=60)
+    with sdm.decrypted_device(DEVICE, PASS_CMD, key_cache=cache):
+        pass
+    assert len(backend.keys) == 1
+    [key] = backend.keys
+    assert ["keyctl", "timeout", key, "60"] in backend.commands
+    backend.commands.clear()
+    with sdm.decrypted_device(DEVICE, "false", key_cache=cache) as decrypted:
+        assert decrypted == Path("/dev/mapper/sdx")
+    opens = [cmd for cmd in backend.commands if cmd[:2] == ["cryptsetup", "open"]]
+    assert opens == [
+        ["cryptsetup", "open", "--volume-key-keyring", key, str(DEVICE), "sdx"]
+    ]
+
+
+def test_close_revokes_cached_volume_key(backend) -> None:
+    decrypted = sdm.open_encrypted_device(
+        DEVICE, PASS_CMD, key_cache=sdm.VolumeKeyCache()
+    )
+    sdm.close_decrypted_device(decrypted, revoke_key=True)
+    assert backend.keys == {}
+    with pytest.raises(sdm.DeviceDecryptionError):
+        sdm.open_encrypted_device(DEVICE, "false", key_cache=sdm.VolumeKeyCache())
+
+
+def test_revoking_missing_key_succeeds(backend) -> None:
+    decrypted = sdm.open_encrypted_device(DEVICE, PASS_CMD)
+    sdm.close_decrypted_device(decrypted, revoke_key=True)
+    assert backend.mappings == {}
+
+
+def test_without_cache_no_key_is_stored(backend) -> None:
+    with sdm.decrypted_device(DEVICE, PASS_CMD):
+        pass
+    assert backend.keys == {}
+
+
+def test_failing_key_timeout_closes_device_and_revokes_key(backend) -> None:
+    backend.inject_failure("keyctl timeout")
+    with pytest.raises(sdm.DeviceDecryptionError):
+        sdm.open_encrypted_device(DEVICE, PASS_CMD, key_cache=sdm.VolumeKeyCache())
+    assert backend.keys == {}
+    assert backend.mappings == {}